@@ -0,0 +1,196 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import hashlib
+import io
+import json
+import os
+import tarfile
+
+from ansible import errors as ansible_errors
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.plugins import action
+# TODO(dougszu): From Ansible 12 onwards we must explicitly trust templates.
+# Since this feature is not supported in previous releases, we define a
+# noop method here for backwards compatibility. This can be removed in the
+# G cycle.
+try:
+    from ansible.template import trust_as_template
+except ImportError:
+    def trust_as_template(template):
+        return template
+
+DOCUMENTATION = '''
+---
+module: kolla_config_bundle
+short_description: Copy the config files of services as a single bundle
+description:
+  - Renders config files on the controller, as the template, merge_configs
+    and merge_yaml action plugins would, into a single compressed archive
+    with a manifest of their checksums. The archive is sent to the host
+    along with the kolla_config_bundle module, which only writes the files
+    that differ there.
+  - The result lists the files written in changed_files and the services
+    they belong to, the first directory of their path, in changed_services.
+    With --diff, it gives the content of those files before and after.
+options:
+  dest:
+    description:
+      - Directory to write the files in, usually node_config_directory
+    required: True
+    type: str
+  files:
+    description:
+      - Files to write. Each file has a dest path relative to the dest
+        directory, starting with the directory of its service, and one of
+        template, merge_configs, merge_yaml or content.
+      - The mode of a file defaults to 0660 and vars gives extra variables
+        to render it with. Files with enabled false are left out.
+      - merge_configs takes whitespace and merge_yaml takes extend_lists and
+        yaml_width, as the action plugins of the same name.
+    required: True
+    type: list
+    elements: dict
+  owner:
+    description:
+      - Owner of the files written
+    required: False
+    type: str
+  group:
+    description:
+      - Group of the files written
+    required: False
+    type: str
+author: Kolla Ansible team
+'''
+
+EXAMPLES = '''
+- hosts: placement-api
+  tasks:
+    - name: Copying over placement config files
+      kolla_config_bundle:
+        dest: /etc/kolla
+        files:
+          - dest: placement-api/config.json
+            template: placement-api.json.j2
+          - dest: placement-api/placement.conf
+            merge_configs:
+              - "{{ role_path }}/templates/placement.conf.j2"
+              - "{{ node_custom_config }}/placement.conf"
+            vars:
+              service_name: placement-api
+'''
+
+MANIFEST = '.manifest.json'
+
+
+def build_bundle(files):
+    """Return a gzip compressed tar of files and of their manifest
+
+    files maps the path of each file to its content and mode.
+    """
+    manifest = {'files': {}}
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        for path, (content, mode) in sorted(files.items()):
+            data = content.encode('utf-8')
+            manifest['files'][path] = {
+                'checksum': hashlib.sha256(data).hexdigest(),
+                'mode': mode,
+            }
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        data = json.dumps(manifest, sort_keys=True).encode('utf-8')
+        info = tarfile.TarInfo(MANIFEST)
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+class ActionModule(action.ActionBase):
+
+    def _plugin(self, name):
+        return self._shared_loader_obj.action_loader.get(
+            name,
+            task=self._task,
+            connection=self._connection,
+            play_context=self._play_context,
+            loader=self._loader,
+            templar=self._templar,
+            shared_loader_obj=self._shared_loader_obj)
+
+    def _template(self, path):
+        source = self._find_needle('templates', path)
+        with open(source, 'r') as f:
+            template_data = trust_as_template(f.read())
+
+        # set search path to mimic 'template' module behavior
+        searchpath = [
+            self._loader._basedir,
+            os.path.join(self._loader._basedir, 'templates'),
+            os.path.dirname(source),
+        ]
+        self._templar.environment.loader.searchpath = searchpath
+        return self._templar.template(template_data)
+
+    def render(self, entry, task_vars):
+        """Return the content of a file of the bundle"""
+        old_vars = self._templar.available_variables
+        temp_vars = task_vars.copy()
+        temp_vars.update(entry.get('vars') or {})
+        self._templar.available_variables = temp_vars
+        try:
+            if entry.get('template'):
+                return self._template(entry['template'])
+            if entry.get('merge_configs'):
+                return self._plugin('merge_configs').render(
+                    entry['merge_configs'], entry.get('whitespace', True))
+            if entry.get('merge_yaml'):
+                return self._plugin('merge_yaml').render(
+                    entry['merge_yaml'], entry.get('extend_lists', False),
+                    entry.get('yaml_width'))
+            if 'content' in entry:
+                return entry['content']
+        finally:
+            self._templar.available_variables = old_vars
+        raise ansible_errors.AnsibleActionFail(
+            'No template, merge_configs, merge_yaml or content for {}'.format(
+                entry.get('dest')))
+
+    def run(self, tmp=None, task_vars=None):
+        if task_vars is None:
+            task_vars = dict()
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp  # not used
+
+        files = {}
+        for entry in self._task.args.get('files') or []:
+            if not boolean(entry.get('enabled', True)):
+                continue
+            mode = entry.get('mode', '0660')
+            if isinstance(mode, int):
+                mode = '{:04o}'.format(mode)
+            files[entry['dest']] = (self.render(entry, task_vars), mode)
+
+        module_args = dict(
+            dest=self._task.args['dest'],
+            bundle=base64.b64encode(build_bundle(files)).decode('ascii'),
+            owner=self._task.args.get('owner'),
+            group=self._task.args.get('group'),
+        )
+        result.update(self._execute_module(
+            module_name='kolla_config_bundle', module_args=module_args,
+            task_vars=task_vars))
+        self._remove_tmp_path(self._connection._shell.tmpdir)
+        return result
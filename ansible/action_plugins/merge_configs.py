@@ -13,7 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
 import collections
+import copy
+import hashlib
+import json
 import os
 import shutil
 import tempfile
@@ -34,6 +38,9 @@ from io import StringIO
 
 from oslo_config import iniparser
 
+from kolla_ansible import merge_action
+from kolla_ansible import parse_cache
+
 
 _ORPHAN_SECTION = 'TEMPORARY_ORPHAN_VARIABLE_SECTION'
 
@@ -43,6 +50,9 @@ module: merge_configs
 short_description: Merge ini-style configs
 description:
      - ConfigParser is used to merge several ini-style configs into one
+     - With --diff, the keys added, removed and changed in dest are returned
+       in config_diff, and a digest of those changes in config_diff_digest,
+       instead of a diff of every line of dest.
 options:
   dest:
     description:
@@ -103,14 +113,47 @@ class OverrideConfigParser(iniparser.BaseParser):
         self._cur_sections = collections.OrderedDict()
         self._cur_section = None
         super(OverrideConfigParser, self).parse(lineiter)
+        self.merge(self._cur_sections)
 
-        # merge _cur_sections into _sections
-        for section, values in self._cur_sections.items():
+    def merge(self, sections):
+        """Merge the sections parsed from a file into _sections"""
+        for section, values in sections.items():
             if section not in self._sections:
                 self._sections[section] = collections.OrderedDict()
             for key, value in values.items():
                 self._sections[section][key] = value
 
+    def entries(self):
+        """Return the values of each key by section and key"""
+        return collections.OrderedDict(
+            ((section, key), ['\n'.join(value) for value in values])
+            for section, keys in self._sections.items()
+            for key, values in keys.items())
+
+    def diff(self, other):
+        """Return the keys added, removed and changed in other
+
+        Keys are named '[section] key', or just key outside of any section,
+        and come with their values before and after, a list of one value
+        per assignment.
+        """
+        before = self.entries()
+        after = other.entries()
+        diff = {'added': [], 'removed': [], 'changed': []}
+        for entry, values in after.items():
+            if entry not in before:
+                diff['added'].append(dict(key=_key_name(entry),
+                                          after=values))
+            elif before[entry] != values:
+                diff['changed'].append(dict(key=_key_name(entry),
+                                            before=before[entry],
+                                            after=values))
+        for entry, values in before.items():
+            if entry not in after:
+                diff['removed'].append(dict(key=_key_name(entry),
+                                            before=values))
+        return diff
+
     def new_section(self, section):
         cur_section = self._cur_sections.get(section)
         if not cur_section:
@@ -153,15 +196,114 @@ class OverrideConfigParser(iniparser.BaseParser):
             fp.write('\n')
 
 
-class ActionModule(action.ActionBase):
+def _key_name(entry):
+    section, key = entry
+    if section == _ORPHAN_SECTION:
+        return key
+    return '[{}] {}'.format(section, key)
+
+
+def _format_diff(diff):
+    """Return a diff of config keys as text, one line per key"""
+    lines = []
+    for change in diff['changed']:
+        lines.append('~ {}: {} -> {}\n'.format(
+            change['key'], ', '.join(change['before']),
+            ', '.join(change['after'])))
+    for change in diff['added']:
+        lines.append('+ {}: {}\n'.format(change['key'],
+                                         ', '.join(change['after'])))
+    for change in diff['removed']:
+        lines.append('- {}: {}\n'.format(change['key'],
+                                         ', '.join(change['before'])))
+    return ''.join(lines)
+
+
+def config_diff(before, after):
+    """Return the result of a task for the diff between two configs
+
+    config_diff is the structured diff of their keys and config_diff_digest
+    its SHA256, the same for every host with the same changes. The diff
+    shown by Ansible is the same diff as text.
+    """
+    configs = []
+    for content in (before, after):
+        config = OverrideConfigParser()
+        config.parse(StringIO(content))
+        configs.append(config)
+    return _diff_result(configs[0].diff(configs[1]))
+
+
+def _diff_result(diff):
+    digest = hashlib.sha256(
+        json.dumps(diff, sort_keys=True).encode('utf-8')).hexdigest()
+    return dict(config_diff=diff, config_diff_digest=digest,
+                diff=dict(prepared=_format_diff(diff)))
+
+
+# Result of a task whose dest is already up to date.
+_NO_CONFIG_DIFF = _diff_result({'added': [], 'removed': [], 'changed': []})
+
+
+def _parse_sections(content):
+    parser = OverrideConfigParser()
+    parser.parse(StringIO(content))
+    return parser._cur_sections
+
+
+_PARSE_CACHE = parse_cache.ParseCache(
+    os.path.join(constants.DEFAULT_LOCAL_TMP, 'kolla-merge-configs'))
+
+
+class ActionModule(merge_action.MergeActionMixin,
+                   action.ActionBase):
 
     TRANSFERS_FILES = True
 
+    _UNCHANGED_ARGS = merge_action.UNCHANGED_ARGS | {'whitespace'}
+
+    def _deployed_config(self, task_vars):
+        """Return the content of dest, None if it cannot be parsed"""
+        dest = self._task.args['dest']
+        stat = self._execute_remote_stat(dest, all_vars=task_vars,
+                                         follow=True)
+        if not stat['exists']:
+            return ''
+        if not stat.get('isreg'):
+            return None
+        slurp = self._execute_module(module_name='ansible.legacy.slurp',
+                                     module_args=dict(src=dest),
+                                     task_vars=task_vars, persist_files=True)
+        if slurp.get('failed') or 'content' not in slurp:
+            return None
+        return base64.b64decode(slurp['content']).decode('utf-8',
+                                                         errors='replace')
+
+    def _config_diff(self, content, task_vars):
+        """Return the diff of the keys of dest with --diff, else None
+
+        The diff of keys replaces the line diff of the whole file the copy
+        action would return, unless dest cannot be parsed.
+        """
+        if not self._task.diff:
+            return None
+        deployed = self._deployed_config(task_vars)
+        if deployed is None:
+            return None
+        try:
+            return config_diff(deployed, content)
+        except iniparser.ParseError:
+            return None
+
     def read_config(self, source, config):
         # Only use config if present
         if os.access(source, os.R_OK):
-            with open(source, 'r') as f:
-                template_data = trust_as_template(f.read())
+            sections, template_data = _PARSE_CACHE.read(source,
+                                                        _parse_sections)
+            if template_data is None:
+                config.merge(sections)
+                return
+            template_data = trust_as_template(template_data)
 
             # set search path to mimic 'template' module behavior
             searchpath = [
@@ -176,6 +318,21 @@ class ActionModule(action.ActionBase):
             config.parse(fakefile)
             fakefile.close()
 
+    def render(self, sources, whitespace=True):
+        """Return the merged content of the sources"""
+        config = OverrideConfigParser(whitespace=whitespace)
+
+        for source in sources:
+            self.read_config(source, config)
+
+        # Dump configparser to string via an emulated file
+
+        fakefile = StringIO()
+        config.write(fakefile)
+        full_source = fakefile.getvalue()
+        fakefile.close()
+        return full_source
+
     def run(self, tmp=None, task_vars=None):
 
         result = super(ActionModule, self).run(tmp, task_vars)
@@ -187,17 +344,16 @@ class ActionModule(action.ActionBase):
         if not isinstance(sources, list):
             sources = [sources]
 
-        config = OverrideConfigParser(whitespace=whitespace)
-
-        for source in sources:
-            self.read_config(source, config)
+        full_source = self.render(sources, whitespace)
 
-        # Dump configparser to string via an emulated file
+        unchanged = self._unchanged_result(full_source, task_vars)
+        if unchanged is not None:
+            result.update(unchanged)
+            if self._task.diff:
+                result.update(copy.deepcopy(_NO_CONFIG_DIFF))
+            return result
 
-        fakefile = StringIO()
-        config.write(fakefile)
-        full_source = fakefile.getvalue()
-        fakefile.close()
+        diff = self._config_diff(full_source, task_vars)
 
         local_tempdir = tempfile.mkdtemp(dir=constants.DEFAULT_LOCAL_TMP)
 
@@ -209,6 +365,8 @@ class ActionModule(action.ActionBase):
             new_task = self._task.copy()
             new_task.args.pop('sources', None)
             new_task.args.pop('whitespace', None)
+            if diff is not None:
+                new_task.diff = False
 
             new_task.args.update(
                 dict(
@@ -229,6 +387,8 @@ class ActionModule(action.ActionBase):
                 'src': result_file, 'sources': sources,
                 'whitespace': whitespace})
             result.update(copy_result)
+            if diff is not None:
+                result.update(diff)
         finally:
             shutil.rmtree(local_tempdir)
         return result
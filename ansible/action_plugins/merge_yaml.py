@@ -23,6 +23,9 @@ from ansible import constants
 from ansible import errors as ansible_errors
 from ansible.plugins import action
 
+from kolla_ansible import merge_action
+from kolla_ansible import parse_cache
+
 # TODO(dougszu): From Ansible 12 onwards we must explicitly trust templates.
 # Since this feature is not supported in previous releases, we define a
 # noop method here for backwards compatibility. This can be removed in the
@@ -92,16 +95,26 @@ Merge multiple yaml files:
 '''
 
 
-class ActionModule(action.ActionBase):
+_PARSE_CACHE = parse_cache.ParseCache(
+    os.path.join(constants.DEFAULT_LOCAL_TMP, 'kolla-merge-yaml'))
+
+
+class ActionModule(merge_action.MergeActionMixin,
+                   action.ActionBase):
 
     TRANSFERS_FILES = True
 
+    _UNCHANGED_ARGS = merge_action.UNCHANGED_ARGS | {'extend_lists',
+                                                     'yaml_width', 'vars'}
+
     def read_config(self, source):
         result = None
         # Only use config if present
         if source and os.access(source, os.R_OK):
-            with open(source, 'r') as f:
-                template_data = trust_as_template(f.read())
+            result, template_data = _PARSE_CACHE.read(source, yaml.safe_load)
+            if template_data is None:
+                return result or {}
+            template_data = trust_as_template(template_data)
 
             # set search path to mimic 'template' module behavior
             searchpath = [
@@ -115,6 +128,14 @@ class ActionModule(action.ActionBase):
             result = yaml.safe_load(template_data)
         return result or {}
 
+    def render(self, sources, extend_lists=False, yaml_width=None):
+        """Return the merged content of the sources"""
+        output = {}
+        for source in sources:
+            Utils.update_nested_conf(
+                output, self.read_config(source), extend_lists)
+        return yaml.dump(output, default_flow_style=False, width=yaml_width)
+
     def run(self, tmp=None, task_vars=None):
         if task_vars is None:
             task_vars = dict()
@@ -129,26 +150,27 @@ class ActionModule(action.ActionBase):
         temp_vars.update(extra_vars)
         self._templar.available_variables = temp_vars
 
-        output = {}
         sources = self._task.args.get('sources', None)
         extend_lists = self._task.args.get('extend_lists', False)
         yaml_width = self._task.args.get('yaml_width', None)
         if not isinstance(sources, list):
             sources = [sources]
-        for source in sources:
-            Utils.update_nested_conf(
-                output, self.read_config(source), extend_lists)
+        full_source = self.render(sources, extend_lists, yaml_width)
 
         # restore original vars
         self._templar.available_variables = old_vars
 
+        unchanged = self._unchanged_result(full_source, task_vars)
+        if unchanged is not None:
+            result.update(unchanged)
+            return result
+
         local_tempdir = tempfile.mkdtemp(dir=constants.DEFAULT_LOCAL_TMP)
 
         try:
             result_file = os.path.join(local_tempdir, 'source')
             with open(result_file, 'w') as f:
-                f.write(yaml.dump(output, default_flow_style=False,
-                                  width=yaml_width))
+                f.write(full_source)
 
             new_task = self._task.copy()
             new_task.args.pop('sources', None)
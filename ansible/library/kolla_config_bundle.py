@@ -0,0 +1,184 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+import grp
+import hashlib
+import io
+import json
+import os
+import pwd
+import tarfile
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule
+from traceback import format_exc
+
+
+DOCUMENTATION = '''
+---
+module: kolla_config_bundle
+short_description: Module for unpacking a bundle of config files
+description:
+  - A module used to write the config files of the services of a host,
+    rendered on the controller by the kolla_config_bundle action plugin and
+    sent along with the module as a single compressed archive.
+  - The manifest of the archive gives the checksum and mode of each file.
+    Only files whose checksum or mode differ on the host are written.
+  - The services whose files changed are returned, a service being the
+    first directory of the path of a file.
+  - With --diff, the content of each file written is returned before and
+    after in diff, like the copy module does.
+  - The module is not meant to be used directly, use the
+    kolla_config_bundle action plugin.
+options:
+  dest:
+    description:
+      - Directory to unpack the files in, usually node_config_directory
+    required: True
+    type: str
+  bundle:
+    description:
+      - The archive, a gzip compressed tar encoded in base64
+    required: True
+    type: str
+  owner:
+    description:
+      - Owner of the files written and of the directories created
+    required: False
+    type: str
+  group:
+    description:
+      - Group of the files written and of the directories created
+    required: False
+    type: str
+author: Kolla Ansible team
+'''
+
+EXAMPLES = '''
+- hosts: all
+  tasks:
+    - name: Copying over config files
+      kolla_config_bundle:
+        dest: /etc/kolla
+        files:
+          - dest: placement-api/config.json
+            template: placement-api.json.j2
+'''
+
+MANIFEST = '.manifest.json'
+
+
+def _checksum(path):
+    sha256 = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha256.update(chunk)
+    except FileNotFoundError:
+        return None
+    return sha256.hexdigest()
+
+
+def _check_path(path):
+    parts = path.split('/')
+    if os.path.isabs(path) or '..' in parts or len(parts) < 2:
+        raise ValueError('Invalid path in bundle: {}'.format(path))
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8', errors='replace')
+    except FileNotFoundError:
+        return ''
+
+
+def unpack(dest, bundle, owner=None, group=None, check_mode=False,
+           diff=False):
+    """Write the files of a bundle which differ on the host
+
+    Returns the paths of the files written, relative to dest, and with diff
+    the before and after content of those files, in the format of the diff
+    of the copy module.
+    """
+    uid = pwd.getpwnam(owner).pw_uid if owner else -1
+    gid = grp.getgrnam(group).gr_gid if group else -1
+    changed = []
+    diffs = []
+    with tarfile.open(fileobj=io.BytesIO(bundle), mode='r:gz') as tar:
+        manifest = json.load(tar.extractfile(MANIFEST))
+        for path, entry in sorted(manifest['files'].items()):
+            _check_path(path)
+            full_path = os.path.join(dest, path)
+            mode = int(entry['mode'], 8)
+            if (_checksum(full_path) == entry['checksum'] and
+                    os.stat(full_path).st_mode & 0o7777 == mode):
+                continue
+            changed.append(path)
+            data = tar.extractfile(path).read()
+            if diff:
+                diffs.append(dict(
+                    before_header=full_path, after_header=full_path,
+                    before=_read(full_path),
+                    after=data.decode('utf-8', errors='replace')))
+            if check_mode:
+                continue
+            directory = os.path.dirname(full_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory, mode=0o770)
+                os.chown(directory, uid, gid)
+            f = tempfile.NamedTemporaryFile(dir=directory, delete=False)
+            try:
+                with f:
+                    f.write(data)
+                os.chmod(f.name, mode)
+                os.chown(f.name, uid, gid)
+                os.replace(f.name, full_path)
+            except Exception:
+                os.unlink(f.name)
+                raise
+    return changed, diffs
+
+
+def main():
+    argument_spec = dict(
+        dest=dict(required=True, type='str'),
+        bundle=dict(required=True, type='str', no_log=True),
+        owner=dict(required=False, type='str'),
+        group=dict(required=False, type='str'),
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+        bypass_checks=False
+    )
+
+    try:
+        changed, diffs = unpack(module.params['dest'],
+                                base64.b64decode(module.params['bundle']),
+                                module.params.get('owner'),
+                                module.params.get('group'),
+                                module.check_mode,
+                                module._diff)
+        services = sorted({path.split('/')[0] for path in changed})
+        result = dict(changed=bool(changed), changed_files=changed,
+                      changed_services=services)
+        if module._diff:
+            result['diff'] = diffs
+        module.exit_json(**result)
+    except Exception:
+        module.fail_json(changed=True, msg=repr(format_exc()))
+
+
+if __name__ == "__main__":
+    main()
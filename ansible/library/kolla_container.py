@@ -30,6 +30,17 @@ module: kolla_container
 short_description: Module for controlling containers
 description:
      - A module targeting at controlling container engine as used by Kolla.
+     - Containers and images are inspected at most once per module run. The
+       number of engine API calls made for this is returned as
+       C(engine_api_calls).
+     - With Docker, lookups are answered by the Kolla host agent when it is
+       running on the host, and the number of its answers is returned as
+       C(agent_calls). Without the agent the engine is queried directly.
+     - The pull_image action returns C(pull_stats) with the bytes downloaded
+       per layer, the total bytes, the duration in seconds and the
+       throughput in MB/s.
+     - The pull_images action returns C(pull_stats) per image and the list
+       of images which changed in C(changed_images).
 options:
   common_options:
     description:
@@ -44,10 +55,12 @@ options:
     type: str
     choices:
       - compare_container
+      - compare_containers
       - compare_image
       - create_volume
       - ensure_image
       - pull_image
+      - pull_images
       - remove_container
       - remove_image
       - remove_volume
@@ -56,6 +69,7 @@ options:
       - start_container
       - stop_container
       - stop_container_and_remove_container
+      - update_unit_files
   api_version:
     description:
       - The version of the api for docker-py to use when contacting docker
@@ -87,6 +101,19 @@ options:
       - The command to execute in the container
     required: False
     type: str
+  containers:
+    description:
+      - List of containers for the compare_containers and update_unit_files
+        actions.
+        Each entry is a dict of the container options accepted by this
+        module, and requires at least a name. Options which are not set
+        in an entry are taken from the module parameters. Connection,
+        authentication and image pull options are not accepted in entries.
+      - The configuration of the containers is checked concurrently and the
+        time taken by each check is returned in C(config_check_latency).
+    required: False
+    type: list
+    elements: dict
   container_engine:
     description:
       - Name of container engine to use
@@ -114,6 +141,13 @@ options:
       - Name of the docker image
     required: False
     type: str
+  images:
+    description:
+      - List of images for the pull_images action. Duplicates are pulled
+        once.
+    required: False
+    type: list
+    elements: str
   ipc_mode:
     description:
       - Set docker ipc namespace
@@ -164,6 +198,26 @@ options:
     required: False
     default: False
     type: bool
+  pull_concurrency:
+    description:
+      - Maximum number of images pulled at the same time by the pull_images
+        action, at least 1
+    required: False
+    default: 4
+    type: int
+  pull_retries:
+    description:
+      - Number of times the pull_images action retries pulling an image
+        which failed to pull
+    required: False
+    default: 3
+    type: int
+  pull_retry_delay:
+    description:
+      - Seconds to wait before retrying a failed image pull
+    required: False
+    default: 5
+    type: int
   remove_on_exit:
     description:
       - When not detaching from container, remove on successful exit
@@ -247,6 +301,13 @@ EXAMPLES = '''
       kolla_container:
         action: pull_image
         image: private-registry.example.com:5000/ubuntu
+    - name: Pull images, three at a time
+      kolla_container:
+        action: pull_images
+        images:
+          - private-registry.example.com:5000/ubuntu
+          - private-registry.example.com:5000/centos
+        pull_concurrency: 3
     - name: Create named volume
       kolla_container:
         action: create_volume
@@ -259,6 +320,22 @@ EXAMPLES = '''
       kolla_container:
         action: remove_image
         image: name_of_image
+    - name: Update systemd units of containers with one daemon reload
+      kolla_container:
+        action: update_unit_files
+        containers:
+          - name: test_container
+          - name: other_container
+            graceful_timeout: 60
+    - name: Compare containers
+      kolla_container:
+        action: compare_containers
+        containers:
+          - name: test_container
+            image: ubuntu
+          - name: other_container
+            image: centos
+            privileged: True
 '''
 
 
@@ -266,15 +343,18 @@ def generate_module():
     # NOTE(jeffrey4l): add empty string '' to choices let us use
     # pid_mode: "{{ service.pid_mode | default ('') }}" in yaml
     # NOTE(r-krcek): arguments_spec should also be reflected in the list of
-    # arguments in service-check-containers role
+    # arguments in service-check-containers role and in CONTAINER_SPEC_KEYS
+    # in kolla_ansible/filters.py
     argument_spec = dict(
         common_options=dict(required=False, type='dict', default=dict()),
         action=dict(required=True, type='str',
                     choices=['compare_container',
+                             'compare_containers',
                              'compare_image',
                              'create_volume',
                              'ensure_image',
                              'pull_image',
+                             'pull_images',
                              'recreate_or_restart_container',
                              'remove_container',
                              'remove_image',
@@ -282,7 +362,8 @@ def generate_module():
                              'restart_container',
                              'start_container',
                              'stop_container',
-                             'stop_and_remove_container']),
+                             'stop_and_remove_container',
+                             'update_unit_files']),
         api_version=dict(required=False, type='str'),
         auth_email=dict(required=False, type='str'),
         auth_password=dict(required=False, type='str', no_log=True),
@@ -290,12 +371,14 @@ def generate_module():
         auth_username=dict(required=False, type='str'),
         command=dict(required=False, type='str'),
         container_engine=dict(required=False, type='str'),
+        containers=dict(required=False, type='list', elements='dict'),
         detach=dict(required=False, type='bool', default=True),
         labels=dict(required=False, type='dict', default=dict()),
         name=dict(required=False, type='str'),
         environment=dict(required=False, type='dict'),
         healthcheck=dict(required=False, type='dict'),
         image=dict(required=False, type='str'),
+        images=dict(required=False, type='list', elements='str'),
         ipc_mode=dict(required=False, type='str', choices=['',
                                                            'host',
                                                            'private',
@@ -308,6 +391,9 @@ def generate_module():
         cgroupns_mode=dict(required=False, type='str',
                            choices=['private', 'host']),
         privileged=dict(required=False, type='bool', default=False),
+        pull_concurrency=dict(required=False, type='int', default=4),
+        pull_retries=dict(required=False, type='int', default=3),
+        pull_retry_delay=dict(required=False, type='int', default=5),
         graceful_timeout=dict(required=False, type='int'),
         remove_on_exit=dict(required=False, type='bool', default=True),
         restart_policy=dict(required=False, type='str', choices=[
@@ -333,10 +419,26 @@ def generate_module():
         client_timeout=dict(required=False, type='int'),
         ignore_missing=dict(required=False, type='bool', default=False),
     )
+    # NOTE: Entries of containers are normalized with the options of a
+    # single container. These have no defaults, so that options not set in
+    # an entry are None and taken from the module parameters instead.
+    module_options = ('action', 'api_version', 'auth_email', 'auth_password',
+                      'auth_registry', 'auth_username', 'client_timeout',
+                      'common_options', 'container_engine', 'containers',
+                      'images', 'pull_concurrency', 'pull_retries',
+                      'pull_retry_delay', 'tls_cacert', 'tls_cert', 'tls_key',
+                      'tls_verify')
+    container_options = {
+        key: {k: v for k, v in spec.items() if k != 'default'}
+        for key, spec in argument_spec.items() if key not in module_options}
+    container_options['name'] = dict(required=True, type='str')
+    argument_spec['containers']['options'] = container_options
     required_if = [
         ['action', 'pull_image', ['image']],
+        ['action', 'pull_images', ['images']],
         ['action', 'start_container', ['image', 'name']],
         ['action', 'compare_container', ['name']],
+        ['action', 'compare_containers', ['containers']],
         ['action', 'compare_image', ['name']],
         ['action', 'create_volume', ['name']],
         ['action', 'ensure_image', ['image']],
@@ -347,6 +449,7 @@ def generate_module():
         ['action', 'restart_container', ['name']],
         ['action', 'stop_container', ['name']],
         ['action', 'stop_and_remove_container', ['name']],
+        ['action', 'update_unit_files', ['containers']],
     ]
     module = AnsibleModule(
         argument_spec=argument_spec,
@@ -419,6 +522,9 @@ def main():
         # types. If we ever add method that will have to return some
         # meaningful data, we need to refactor all methods to return dicts.
         result = bool(getattr(cw, module.params.get('action'))())
+        cw.result['engine_api_calls'] = cw.snapshot.api_calls
+        if cw.agent:
+            cw.result['agent_calls'] = cw.agent.calls
         module.exit_json(changed=cw.changed, result=result, **cw.result)
     except Exception:
         module.fail_json(changed=True, msg=repr(traceback.format_exc()),
@@ -13,9 +13,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
+import math
+import re
+import time
+
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.kolla_host_agent import AgentClient
+from ansible.module_utils.kolla_host_agent import AgentError
 from traceback import format_exc
 
+# Container events after which the facts of the container are refreshed.
+REFRESH_EVENTS = ('create', 'start', 'stop', 'die', 'destroy',
+                  'health_status')
+# NOTE: Docker keeps a bounded number of past events, so facts cached longer
+# ago than this, or with more events since, are gathered again in full.
+CURSOR_MAX_AGE = 600
+CURSOR_MAX_EVENTS = 256
 
 DOCUMENTATION = '''
 ---
@@ -24,6 +38,9 @@ short_description: Module for collecting container facts
 description:
   - A module targeted at collecting container facts. It is used for
     retrieving data about containers like their environment or state.
+  - With Docker, container facts are served by the Kolla host agent when it
+    is running on the host. Without the agent the engine is queried
+    directly.
 options:
   container_engine:
     description:
@@ -41,17 +58,31 @@ options:
       - Name or names of the containers
     required: False
     type: str or list
+  fields:
+    description:
+      - Fields of the container facts returned by the action
+        "get_containers", as dotted paths such as C(State.Status) or
+        C(Config.Image). The structure of the facts is kept, but only the
+        given fields are included. By default all fields are returned.
+    required: False
+    type: list
+    elements: str
   action:
     description:
       - The action to perform
       - The action "get_containers" only returns running containers, unless
         argument get_all_containers is True
+      - The action "get_health" returns, for each container with a
+        healthcheck, its health status and failing streak, and the failure
+        rate and the mean and 95th percentile duration of the checks in the
+        healthcheck log. It covers the same containers as "get_containers".
     required: True
     type: str
     choices:
       - get_containers
       - get_container_env
       - get_container_state
+      - get_health
   args:
     description:
       - Additional arguments for actions
@@ -66,6 +97,22 @@ options:
         type: bool
         required: False
         default: False
+      since:
+        description:
+          - Event cursor returned as C(cursor) by a previous
+            "get_containers" call. Together with cached, only the
+            containers with create, start, stop, die, destroy or health
+            events since then are inspected, and the others are taken
+            from cached.
+        type: float
+        required: False
+      cached:
+        description:
+          - Container facts returned as C(containers) by the call which
+            returned the since cursor, called with the same name, fields
+            and get_all_containers.
+        type: dict
+        required: False
 author: Jeffrey Zhang, Michal Nasiadka, Roman Krček, Ivan Halomi
 '''
 
@@ -92,6 +139,29 @@ EXAMPLES = '''
         container_engine: podman
         action: get_containers
 
+    - name: Get the image and state of the glance_api container
+      kolla_container_facts:
+        container_engine: docker
+        name:
+          - glance_api
+        action: get_containers
+        fields:
+          - Config.Image
+          - State.Status
+
+    - name: Refresh facts of all containers gathered earlier
+      kolla_container_facts:
+        container_engine: docker
+        action: get_containers
+        args:
+          since: "{{ container_facts.cursor }}"
+          cached: "{{ container_facts.containers }}"
+
+    - name: Get health of all running containers
+      kolla_container_facts:
+        container_engine: docker
+        action: get_health
+
     - name: Get Horizon container state
       kolla_container_facts:
         container_engine: podman
@@ -124,6 +194,54 @@ EXAMPLES = '''
 '''
 
 
+def _parse_time(value: str) -> float:
+    """Return seconds since the epoch of an RFC 3339 timestamp.
+
+    Engines report nanoseconds, which are truncated to microseconds.
+    """
+    match = re.match(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?'
+                     r'(Z|[+-]\d\d:\d\d)?$', value)
+    if not match:
+        raise ValueError('Invalid timestamp: {}'.format(value))
+    timestamp, fraction, zone = match.groups()
+    parsed = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+    if zone and zone != 'Z':
+        sign = -1 if zone[0] == '-' else 1
+        parsed -= sign * datetime.timedelta(hours=int(zone[1:3]),
+                                            minutes=int(zone[4:6]))
+    seconds = parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return seconds + float((fraction or '.0')[:7])
+
+
+def health_summary(health: dict) -> dict:
+    """Aggregate the healthcheck state of a container.
+
+    The failure rate and check durations cover the checks retained in the
+    healthcheck log, which the engines keep the last five of by default.
+    """
+    log = health.get('Log') or []
+    durations = sorted(
+        _parse_time(entry['End']) - _parse_time(entry['Start'])
+        for entry in log)
+    failures = sum(1 for entry in log if entry.get('ExitCode') != 0)
+    summary = {
+        'status': health.get('Status'),
+        'failing_streak': health.get('FailingStreak', 0),
+        'checks': len(log),
+        'failure_rate': None,
+        'mean_duration': None,
+        'p95_duration': None,
+    }
+    if log:
+        # NOTE: Nearest rank percentile, so it is always a measured value.
+        p95 = durations[max(0, math.ceil(0.95 * len(durations)) - 1)]
+        summary.update(
+            failure_rate=round(failures / len(log), 3),
+            mean_duration=round(sum(durations) / len(durations), 3),
+            p95_duration=round(p95, 3))
+    return summary
+
+
 class ContainerFactsWorker():
     def __init__(self, module):
         self.module = module
@@ -154,29 +272,135 @@ class ContainerFactsWorker():
             envs[key] = value
         return envs
 
+    def _name_filters(self, names: list) -> dict:
+        """Return engine list filters matching exactly the given names."""
+        # NOTE: The name filter is a regular expression matched by the
+        # engine, so anchor it to avoid listing containers which only share
+        # a prefix. The exact match is still checked by the caller.
+        return {'name': ['^{}$'.format(re.escape(name)) for name in names]}
+
+    def _project(self, attrs: dict) -> dict:
+        """Return only the requested fields of the container facts.
+
+        Fields are dotted paths, for example State.Status would reduce
+        the facts to {'State': {'Status': 'running'}}. Fields missing
+        from the facts are left out.
+        """
+        fields = self.params.get('fields')
+        if not fields:
+            return attrs
+        projected = dict()
+        for field in fields:
+            keys = field.split('.')
+            value = attrs
+            for key in keys:
+                if not isinstance(value, dict) or key not in value:
+                    break
+                value = value[key]
+            else:
+                target = projected
+                for key in keys[:-1]:
+                    target = target.setdefault(key, dict())
+                target[keys[-1]] = value
+        return projected
+
     def get_containers_names(self):
         """Handles when module is called with action get_containers_names"""
         containers = self.client.containers.list()
         names = [cont.name for cont in containers]
         self.result['container_names'] = names
 
+    def _inspect_containers(self, names: list, get_all_containers: bool):
+        """Yield name and inspect output of containers, all if no names."""
+        # NOTE: The list is sparse, so only the containers which match are
+        # inspected, by reload().
+        if names:
+            containers = self.client.containers.list(
+                all=get_all_containers, sparse=True,
+                filters=self._name_filters(names))
+        else:
+            containers = self.client.containers.list(
+                all=get_all_containers, sparse=True)
+        for container in containers:
+            container_name = (container.name or
+                              container.attrs['Names'][0].lstrip('/'))
+            if names and container_name not in names:
+                continue
+            container.reload()
+            yield container_name, container.attrs
+
+    def _list_containers(self, names: list, get_all_containers: bool) -> dict:
+        """Return the facts of the containers, all if names is empty."""
+        facts = dict()
+        for container_name, attrs in self._inspect_containers(
+                names, get_all_containers):
+            # NOTE(r-krcek): For performance reasons don't include
+            # healthcheck logs. It can contain MBs worth of data!
+            attrs["State"].get("Health", dict()).pop("Log", None)
+            facts[container_name] = self._project(attrs)
+        return facts
+
+    def _changed_containers(self, since: float, until: float):
+        """Return names of containers with events between since and until.
+
+        Returns None if the events may be incomplete.
+        """
+        if until - since > CURSOR_MAX_AGE:
+            return None
+        changed = set()
+        count = 0
+        # NOTE: Podman only takes whole seconds, widen the window to them.
+        for event in self.client.events(since=math.floor(since),
+                                        until=math.ceil(until),
+                                        filters={'type': 'container'},
+                                        decode=True):
+            count += 1
+            action = event.get('Action', event.get('status', ''))
+            if action.split(':')[0] in REFRESH_EVENTS:
+                changed.add(event['Actor']['Attributes']['name'])
+        return None if count >= CURSOR_MAX_EVENTS else changed
+
     def get_containers(self):
         """Handle when module is called with action get_containers"""
         names = self.params.get('name')
         args = self.params.get('args', {})
         get_all_containers = args.get('get_all_containers', False)
-        self.result['containers'] = dict()
+        since = args.get('since')
+        cached = args.get('cached')
+        until = time.time()
+
+        changed = None
+        if since is not None and cached is not None:
+            changed = self._changed_containers(since, until)
+        if changed is None:
+            self.result['containers'] = self._list_containers(
+                names, get_all_containers)
+        else:
+            containers = {
+                name: facts for name, facts in cached.items()
+                if name not in changed and (not names or name in names)}
+            refresh = [name for name in sorted(changed)
+                       if not names or name in names]
+            if refresh:
+                containers.update(
+                    self._list_containers(refresh, get_all_containers))
+            self.result['containers'] = containers
+            self.result['refreshed_containers'] = refresh
+        self.result['cursor'] = until
+
+    def get_health(self):
+        """Handle when module is called with action get_health"""
+        names = self.params.get('name')
+        args = self.params.get('args', {})
+        get_all_containers = args.get('get_all_containers', False)
+        self.result['health'] = dict()
 
-        containers = self.client.containers.list(all=get_all_containers)
-        for container in containers:
-            container.reload()
-            container_name = container.name
-            if names and container_name not in names:
-                continue
-            # NOTE(r-krcek): For performance reasons don't include
-            # healthcheck logs. It can contain MBs worth of data!
-            container.attrs["State"].get("Health", dict()).pop("Log", None)
-            self.result['containers'][container_name] = container.attrs
+        for container_name, attrs in self._inspect_containers(
+                names, get_all_containers):
+            health = attrs['State'].get('Health')
+            if health:
+                self.result['health'][container_name] = health_summary(
+                    health)
 
     def get_containers_state(self):
         """Handle when module is called with action get_containers_state"""
@@ -231,6 +455,38 @@ class DockerFactsWorker(ContainerFactsWorker):
             base_url='http+unix:/var/run/docker.sock',
             version=module.params.get('api_version'))
         self.containerError = dockerError
+        self.agent = AgentClient.connect()
+
+    def get_containers(self):
+        if self.agent:
+            try:
+                return self._get_containers_from_agent()
+            except AgentError:
+                pass
+        return super().get_containers()
+
+    def _get_containers_from_agent(self):
+        names = self.params.get('name')
+        args = self.params.get('args', {})
+        get_all_containers = args.get('get_all_containers', False)
+        # NOTE: The agent applies the engine events up to each request
+        # before answering, so its facts are current as of until, and since
+        # and cached are not needed. The cursor is returned for the next
+        # call, which may not find the agent.
+        until = time.time()
+
+        containers = dict()
+        listed = self.agent.call('list', section='containers')
+        for container_name, container in listed.items():
+            if names and container_name not in names:
+                continue
+            if not get_all_containers and container['State'] != 'running':
+                continue
+            attrs = self.agent.call('inspect_container', name=container_name)
+            attrs["State"].get("Health", dict()).pop("Log", None)
+            containers[container_name] = self._project(attrs)
+        self.result['containers'] = containers
+        self.result['cursor'] = until
 
 
 class PodmanFactsWorker(ContainerFactsWorker):
@@ -250,6 +506,7 @@ class PodmanFactsWorker(ContainerFactsWorker):
 def main():
     argument_spec = dict(
         name=dict(required=False, type='list', default=[]),
+        fields=dict(required=False, type='list', elements='str'),
         api_version=dict(required=False, type='str', default='auto'),
         container_engine=dict(required=True, type='str'),
         action=dict(required=True, type='str',
@@ -257,7 +514,8 @@ def main():
                              'get_containers_env',
                              'get_volumes',
                              'get_containers_names',
-                             'get_containers_state']),
+                             'get_containers_state',
+                             'get_health']),
         args=dict(
             type='dict',
             required=False,
@@ -265,7 +523,9 @@ def main():
             options=dict(
                 get_all_containers=dict(required=False,
                                         type='bool',
-                                        default=False)
+                                        default=False),
+                since=dict(required=False, type='float'),
+                cached=dict(required=False, type='dict'),
             )
         )
     )
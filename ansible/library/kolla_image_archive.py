@@ -0,0 +1,332 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+from ansible.module_utils.basic import AnsibleModule
+from traceback import format_exc
+
+
+DOCUMENTATION = '''
+---
+module: kolla_image_archive
+short_description: Module for distributing images as archives
+description:
+  - A module used to copy container images from a seed host to its peers
+    without pulling them from the registry on every host.
+  - The action "layers" runs on a peer and returns the layers and the IDs of
+    the images already present there.
+  - The action "export" runs on the seed host and saves the images into a
+    single archive, and returns their IDs on the seed host. Images already
+    present on the peer are left out, as are layers the peer already has,
+    including those exported earlier in the same archive.
+  - The action "load" runs on the peer and loads the images of an archive
+    created by "export", then removes the archive.
+options:
+  container_engine:
+    description:
+      - Name of container engine to use
+    required: True
+    type: str
+  api_version:
+    description:
+      - The version of the API for container SDK to use
+    required: False
+    type: str
+    default: auto
+  api_url:
+    description:
+      - URL of the container engine API. Defaults to the local socket of
+        the container engine.
+    required: False
+    type: str
+  action:
+    description:
+      - The action to perform
+    required: True
+    type: str
+    choices:
+      - export
+      - layers
+      - load
+  images:
+    description:
+      - List of images for the "layers" and "export" actions
+    required: False
+    type: list
+    elements: str
+  archive:
+    description:
+      - Path of the archive for the "export" and "load" actions
+    required: False
+    type: str
+  present_images:
+    description:
+      - Image IDs already present on the peer by image, as returned by the
+        "layers" action
+    required: False
+    type: dict
+  skip_layers:
+    description:
+      - Layers already present on the peer, as returned by the "layers"
+        action
+    required: False
+    type: list
+    elements: str
+author: Kolla Ansible team
+'''
+
+EXAMPLES = '''
+- hosts: compute
+  tasks:
+    - name: Get images and layers present on the peer
+      kolla_image_archive:
+        container_engine: docker
+        action: layers
+        images:
+          - quay.io/openstack.kolla/nova-compute:master-rocky-10
+      register: peer
+
+    - name: Export images on the seed host
+      kolla_image_archive:
+        container_engine: docker
+        action: export
+        images:
+          - quay.io/openstack.kolla/nova-compute:master-rocky-10
+        present_images: "{{ peer.present_images }}"
+        skip_layers: "{{ peer.layers }}"
+        archive: /tmp/kolla-images.tar
+      delegate_to: seed
+
+    - name: Load images on the peer
+      kolla_image_archive:
+        container_engine: docker
+        action: load
+        archive: /tmp/kolla-images.tar
+'''
+
+
+def chain_ids(diff_ids):
+    """Return the chain IDs of the layers of an image
+
+    A layer is only the same as a layer of another image if all layers
+    below it are the same as well, which the chain ID captures.
+    """
+    chain = []
+    for diff_id in diff_ids:
+        if chain:
+            diff_id = 'sha256:' + hashlib.sha256(
+                '{} {}'.format(chain[-1], diff_id).encode('utf-8')).hexdigest()
+        chain.append(diff_id)
+    return chain
+
+
+def filter_archive(src, dest, skip):
+    """Copy an image archive, leaving out the layers in skip
+
+    Container engines only read the layers of an archive they do not have
+    yet, so an archive without them loads fine on a host which has them.
+    Returns the chain IDs of the layers of the archived images and the
+    number of layer files left out.
+    """
+    with tarfile.open(src) as tar:
+        manifest = json.load(tar.extractfile('manifest.json'))
+        chains = set()
+        omit = set()
+        keep = set()
+        for entry in manifest:
+            config = json.load(tar.extractfile(entry['Config']))
+            layer_chains = chain_ids(config['rootfs']['diff_ids'])
+            for layer, chain in zip(entry['Layers'], layer_chains):
+                chains.add(chain)
+                (omit if chain in skip else keep).add(layer)
+        # NOTE: A layer file may be shared by several images.
+        omit -= keep
+
+        with tarfile.open(dest, 'w') as out:
+            for member in tar:
+                if member.name in omit:
+                    continue
+                fileobj = tar.extractfile(member) if member.isfile() else None
+                out.addfile(member, fileobj)
+    return chains, len(omit)
+
+
+class ImageArchiveWorker():
+    def __init__(self, module):
+        self.module = module
+        self.params = module.params
+        self.result = dict(changed=False)
+
+    def _get_image(self, name):
+        """Return the image if it exists, None otherwise."""
+        try:
+            return self.client.images.get(name)
+        except self.containerError.NotFound:
+            return None
+
+    def _load(self, path):
+        with open(path, 'rb') as f:
+            self.client.images.load(f)
+
+    def layers(self):
+        """Handle when module is called with action layers"""
+        layers = set()
+        for image in self.client.images.list():
+            layers.update(chain_ids(image.attrs['RootFS'].get('Layers', [])))
+        present = dict()
+        for name in self.params.get('images'):
+            image = self._get_image(name)
+            present[name] = image.id if image else None
+        self.result['layers'] = sorted(layers)
+        self.result['present_images'] = present
+
+    def export(self):
+        """Handle when module is called with action export"""
+        present = self.params.get('present_images') or dict()
+        skip = set(self.params.get('skip_layers') or [])
+        archive = self.params.get('archive')
+        exported = []
+        image_ids = dict()
+        skipped_layers = 0
+
+        with tempfile.TemporaryDirectory() as tmp, \
+                tarfile.open(archive, 'w') as bundle:
+            for name in dict.fromkeys(self.params.get('images')):
+                image = self._get_image(name)
+                if image is None:
+                    self.module.fail_json(
+                        msg="No such image on the seed host: {}".format(name))
+                    return
+                image_ids[name] = image.id
+                if present.get(name) == image.id:
+                    continue
+                saved = os.path.join(tmp, 'saved.tar')
+                with open(saved, 'wb') as f:
+                    for chunk in image.save(named=name):
+                        f.write(chunk)
+                filtered = os.path.join(tmp, 'filtered.tar')
+                chains, omitted = filter_archive(saved, filtered, skip)
+                # NOTE: Images are loaded in the order they are archived, so
+                # later images need not carry the layers of earlier ones.
+                skip.update(chains)
+                skipped_layers += omitted
+                bundle.add(filtered,
+                           arcname='{:04d}.tar'.format(len(exported)))
+                exported.append(name)
+
+        self.result['exported_images'] = exported
+        self.result['image_ids'] = image_ids
+        self.result['skipped_layers'] = skipped_layers
+        self.result['archive_bytes'] = os.path.getsize(archive)
+        self.result['changed'] = bool(exported)
+
+    def load(self):
+        """Handle when module is called with action load"""
+        archive = self.params.get('archive')
+        loaded = 0
+        with tempfile.TemporaryDirectory() as tmp, \
+                tarfile.open(archive) as bundle:
+            path = os.path.join(tmp, 'image.tar')
+            for member in bundle:
+                with bundle.extractfile(member) as src, \
+                        open(path, 'wb') as dest:
+                    shutil.copyfileobj(src, dest)
+                self._load(path)
+                loaded += 1
+        os.unlink(archive)
+        self.result['loaded_images'] = loaded
+        self.result['changed'] = bool(loaded)
+
+
+class DockerArchiveWorker(ImageArchiveWorker):
+    def __init__(self, module):
+        try:
+            import docker
+            import docker.errors as dockerError
+        except ImportError:
+            self.module.fail_json(
+                msg="The docker library could not be imported")
+        super().__init__(module)
+        self.client = docker.DockerClient(
+            base_url=(module.params.get('api_url') or
+                      'http+unix:/var/run/docker.sock'),
+            version=module.params.get('api_version'))
+        self.containerError = dockerError
+
+
+class PodmanArchiveWorker(ImageArchiveWorker):
+    def __init__(self, module):
+        try:
+            import podman.errors as podmanError
+            from podman import PodmanClient
+        except ImportError:
+            self.module.fail_json(
+                msg="The podman library could not be imported")
+        super().__init__(module)
+        self.client = PodmanClient(
+            base_url=(module.params.get('api_url') or
+                      'http+unix:/run/podman/podman.sock'))
+        self.containerError = podmanError
+
+    def _load(self, path):
+        for _ in self.client.images.load(file_path=path):
+            pass
+
+
+def main():
+    argument_spec = dict(
+        api_version=dict(required=False, type='str', default='auto'),
+        api_url=dict(required=False, type='str'),
+        container_engine=dict(required=True, type='str'),
+        action=dict(required=True, type='str',
+                    choices=['export',
+                             'layers',
+                             'load']),
+        archive=dict(required=False, type='str'),
+        images=dict(required=False, type='list', elements='str'),
+        present_images=dict(required=False, type='dict'),
+        skip_layers=dict(required=False, type='list', elements='str'),
+    )
+
+    required_if = [
+        ['action', 'export', ['archive', 'images']],
+        ['action', 'layers', ['images']],
+        ['action', 'load', ['archive']],
+    ]
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_if=required_if,
+        bypass_checks=False
+    )
+
+    iaw: ImageArchiveWorker = None
+    try:
+        if module.params.get('container_engine') == 'docker':
+            iaw = DockerArchiveWorker(module)
+        else:
+            iaw = PodmanArchiveWorker(module)
+
+        result = bool(getattr(iaw, module.params.get('action'))())
+        module.exit_json(result=result, **iaw.result)
+    except Exception:
+        module.fail_json(changed=True, msg=repr(format_exc()),
+                         **getattr(iaw, 'result', {}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,591 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent import futures
+
+from ansible.module_utils.basic import AnsibleModule
+from traceback import format_exc
+
+
+DOCUMENTATION = '''
+---
+module: kolla_keystone_catalog
+short_description: Module for reconciling the Keystone catalog
+description:
+  - A module used to register services, endpoints, projects, users, roles
+    and role assignments with Keystone in a single operation.
+  - The current state of Keystone is read once, with one list call per kind
+    of resource and one per user for its role assignments. Only the
+    differences with the desired catalog are applied, with a bounded number
+    of concurrent requests.
+  - Resources are only deleted when the desired catalog says so with
+    state absent, resources missing from it are left untouched.
+  - The module is run by the kolla_toolbox module, in the kolla_toolbox
+    container, and needs openstacksdk.
+options:
+  services:
+    description:
+      - Services to register, as service_ks_register_services. Services
+        with enabled false are left out.
+    required: False
+    type: list
+    elements: dict
+    default: []
+    suboptions:
+      name:
+        description: Name of the service
+        required: True
+        type: str
+      type:
+        description: Type of the service
+        required: True
+        type: str
+      description:
+        description: Description of the service
+        type: str
+      enabled:
+        description: Whether to manage the service at all
+        type: bool
+        default: True
+      state:
+        description: Whether the service should exist
+        type: str
+        choices: [present, absent]
+        default: present
+      endpoints:
+        description: Endpoints of the service
+        type: list
+        elements: dict
+        default: []
+        suboptions:
+          interface:
+            description: Interface of the endpoint
+            required: True
+            type: str
+          url:
+            description: URL of the endpoint
+            required: True
+            type: str
+          state:
+            description: Whether the endpoint should exist
+            type: str
+            choices: [present, absent]
+            default: present
+  users:
+    description:
+      - Users to register, as service_ks_register_users. Their projects
+        and roles are created and they are granted the role in the project.
+    required: False
+    type: list
+    elements: dict
+    default: []
+    suboptions:
+      user:
+        description: Name of the user
+        required: True
+        type: str
+      password:
+        description: Password of the user
+        type: str
+      project:
+        description: Default project of the user
+        required: True
+        type: str
+      role:
+        description: Role of the user in its project
+        required: True
+        type: str
+      state:
+        description: Whether the user should have the role
+        type: str
+        choices: [present, absent]
+        default: present
+  roles:
+    description:
+      - Roles to register, as service_ks_register_roles
+    required: False
+    type: list
+    elements: str
+    default: []
+  user_roles:
+    description:
+      - Roles to grant to existing users, as service_ks_register_user_roles.
+        The role is granted in the project, the domain or the system.
+    required: False
+    type: list
+    elements: dict
+    default: []
+    suboptions:
+      user:
+        description: Name of the user
+        required: True
+        type: str
+      role:
+        description: Name of the role
+        required: True
+        type: str
+      project:
+        description: Project to grant the role in
+        type: str
+      domain:
+        description: Domain to grant the role in
+        type: str
+      system:
+        description: System to grant the role in
+        type: str
+      state:
+        description: Whether the user should have the role
+        type: str
+        choices: [present, absent]
+        default: present
+  domain:
+    description:
+      - Domain of the projects and users
+    required: False
+    type: str
+    default: default
+  endpoint_region:
+    description:
+      - Region of the endpoints
+    required: True
+    type: str
+  update_password:
+    description:
+      - Whether to set the password of existing users with one
+    required: False
+    type: bool
+    default: False
+  concurrency:
+    description:
+      - Maximum number of concurrent requests to Keystone
+    required: False
+    type: int
+    default: 8
+  auth:
+    description:
+      - Authentication parameters, as for the openstack.cloud modules
+    required: False
+    type: dict
+  cloud:
+    description:
+      - Name of the cloud in clouds.yaml
+    required: False
+    type: str
+  region_name:
+    description:
+      - Region of the identity service
+    required: False
+    type: str
+  interface:
+    description:
+      - Interface of the identity service
+    required: False
+    type: str
+    default: public
+  cacert:
+    description:
+      - CA bundle to verify the identity service with
+    required: False
+    type: str
+author: Kolla Ansible team
+'''
+
+EXAMPLES = '''
+- hosts: localhost
+  tasks:
+    - name: Register glance with Keystone
+      kolla_toolbox:
+        container_engine: docker
+        module_name: kolla_keystone_catalog
+        module_args:
+          services:
+            - name: glance
+              type: image
+              description: Openstack Image
+              endpoints:
+                - interface: internal
+                  url: http://10.0.0.10:9292
+                - interface: public
+                  url: https://cloud.example.com:9292
+          users:
+            - project: service
+              user: glance
+              password: secret
+              role: admin
+          endpoint_region: RegionOne
+          cloud: kolla-admin
+'''
+
+
+def _change(action, kind, name):
+    return {'action': action, 'type': kind, 'name': name}
+
+
+def _assignment_label(item):
+    scope = item.get('project') or item.get('domain') or item.get('system')
+    return '{} -> {} -> {}'.format(item['user'], scope, item['role'])
+
+
+class CatalogReconciler(object):
+    """Reconcile Keystone with a desired catalog
+
+    read() lists the current state, plan() computes the changes and
+    apply() makes them, in phases so that the resources a change refers to
+    exist once its phase runs: services, projects and roles first, then
+    endpoints and users, then role assignments.
+    """
+
+    PHASES = 3
+
+    def __init__(self, identity, params):
+        self.identity = identity
+        self.params = params
+        self.services = [service for service in params.get('services') or []
+                         if service.get('enabled', True)]
+        self.users = params.get('users') or []
+        self.assignments = self.users + (params.get('user_roles') or [])
+        self.domains = {}
+
+    def _map(self, func, items):
+        workers = max(1, self.params.get('concurrency') or 1)
+        with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(func, items))
+
+    def _domain_id(self, name_or_id):
+        if name_or_id not in self.domains:
+            domain = self.identity.find_domain(name_or_id,
+                                               ignore_missing=False)
+            self.domains[name_or_id] = domain.id
+        return self.domains[name_or_id]
+
+    def read(self):
+        """Read the current state of the resources of the catalog"""
+        identity = self.identity
+        domain_id = self._domain_id(self.params.get('domain'))
+        self.current_services = {(s.name, s.type): s
+                                 for s in identity.services()}
+        self.current_endpoints = {
+            (e.service_id, e.interface, e.region_id): e
+            for e in identity.endpoints()}
+        self.current_projects = {}
+        for project in identity.projects():
+            # NOTE: Prefer the project of the service domain, others only
+            # matter for role assignments in projects of other domains.
+            if (project.name not in self.current_projects or
+                    project.domain_id == domain_id):
+                self.current_projects[project.name] = project
+        self.current_users = {u.name: u
+                              for u in identity.users(domain_id=domain_id)}
+        for name in {item['user'] for item in self.assignments}:
+            if name not in self.current_users:
+                user = identity.find_user(name)
+                if user is not None:
+                    self.current_users[name] = user
+        self.current_roles = {r.name: r for r in identity.roles()}
+
+        user_ids = [user.id for user in self.current_users.values()]
+        assignments = self._map(
+            lambda user_id: list(identity.role_assignments(user_id=user_id)),
+            user_ids)
+        self.current_assignments = set()
+        for assignment in sum(assignments, []):
+            scope = assignment.scope or {}
+            if 'project' in scope:
+                key = ('project', scope['project']['id'])
+            elif 'domain' in scope:
+                key = ('domain', scope['domain']['id'])
+            elif 'system' in scope:
+                key = ('system', 'all')
+            else:
+                continue
+            self.current_assignments.add(
+                (assignment.user['id'], assignment.role['id']) + key)
+
+    def plan(self):
+        """Return the changes to make, as lists of (change, func) by phase"""
+        phases = [[] for _ in range(self.PHASES)]
+        self._plan_services(phases)
+        self._plan_projects(phases)
+        self._plan_roles(phases)
+        self._plan_users(phases)
+        self._plan_assignments(phases)
+        return phases
+
+    def _plan_services(self, phases):
+        for service in self.services:
+            name = service['name']
+            current = self.current_services.get((name, service.get('type')))
+            if service.get('state', 'present') == 'absent':
+                # NOTE: Keystone deletes the endpoints of the service.
+                if current is not None:
+                    phases[0].append((
+                        _change('delete', 'service', name),
+                        lambda s=current: self.identity.delete_service(s)))
+                continue
+            if current is None:
+                phases[0].append((
+                    _change('create', 'service', name),
+                    lambda s=service: self._create_service(s)))
+            elif (service.get('description') is not None and
+                    service['description'] != current.description):
+                phases[0].append((
+                    _change('update', 'service', name),
+                    lambda s=service, c=current: self.identity.update_service(
+                        c, description=s['description'])))
+            self._plan_endpoints(phases, service, current)
+
+    def _create_service(self, service):
+        created = self.identity.create_service(
+            name=service['name'], type=service.get('type'),
+            description=service.get('description'))
+        self.current_services[(service['name'], service.get('type'))] = (
+            created)
+
+    def _plan_endpoints(self, phases, service, current_service):
+        region = self.params.get('endpoint_region')
+        for endpoint in service.get('endpoints') or []:
+            name = '{} -> {} -> {}'.format(service['name'], endpoint['url'],
+                                           endpoint['interface'])
+            current = None
+            if current_service is not None:
+                current = self.current_endpoints.get(
+                    (current_service.id, endpoint['interface'], region))
+            if endpoint.get('state', 'present') == 'absent':
+                if current is not None:
+                    phases[1].append((
+                        _change('delete', 'endpoint', name),
+                        lambda e=current: self.identity.delete_endpoint(e)))
+            elif current is None:
+                phases[1].append((
+                    _change('create', 'endpoint', name),
+                    lambda s=service, e=endpoint: self._create_endpoint(s, e)))
+            elif current.url != endpoint['url']:
+                phases[1].append((
+                    _change('update', 'endpoint', name),
+                    lambda e=endpoint, c=current:
+                        self.identity.update_endpoint(c, url=e['url'])))
+
+    def _create_endpoint(self, service, endpoint):
+        service_id = self.current_services[
+            (service['name'], service.get('type'))].id
+        self.identity.create_endpoint(
+            service_id=service_id, interface=endpoint['interface'],
+            url=endpoint['url'],
+            region_id=self.params.get('endpoint_region'))
+
+    def _plan_projects(self, phases):
+        domain_id = self._domain_id(self.params.get('domain'))
+        for name in dict.fromkeys(user['project'] for user in self.users):
+            if name not in self.current_projects:
+                phases[0].append((
+                    _change('create', 'project', name),
+                    lambda n=name: self.current_projects.__setitem__(
+                        n, self.identity.create_project(
+                            name=n, domain_id=domain_id))))
+
+    def _plan_roles(self, phases):
+        names = [user['role'] for user in self.users]
+        names += self.params.get('roles') or []
+        for name in dict.fromkeys(names):
+            if name not in self.current_roles:
+                phases[0].append((
+                    _change('create', 'role', name),
+                    lambda n=name: self.current_roles.__setitem__(
+                        n, self.identity.create_role(name=n))))
+
+    def _plan_users(self, phases):
+        domain_id = self._domain_id(self.params.get('domain'))
+        for user in {user['user']: user for user in self.users}.values():
+            name = user['user']
+            current = self.current_users.get(name)
+            project = self.current_projects.get(user['project'])
+            if current is None:
+                phases[1].append((
+                    _change('create', 'user', name),
+                    lambda u=user: self._create_user(u, domain_id)))
+                continue
+            attrs = {}
+            # NOTE: The ID of a project created in the first phase is only
+            # known when the change is made.
+            if project is None or current.default_project_id != project.id:
+                attrs['default_project_id'] = None
+            if (self.params.get('update_password') and
+                    user.get('password') is not None):
+                attrs['password'] = user['password']
+            if attrs:
+                phases[1].append((
+                    _change('update', 'user', name),
+                    lambda u=user, c=current, a=attrs: self._update_user(
+                        u, c, a)))
+
+    def _create_user(self, user, domain_id):
+        attrs = dict(name=user['user'], domain_id=domain_id,
+                     default_project_id=self.current_projects[
+                         user['project']].id)
+        if user.get('password') is not None:
+            attrs['password'] = user['password']
+        self.current_users[user['user']] = self.identity.create_user(**attrs)
+
+    def _update_user(self, user, current, attrs):
+        if 'default_project_id' in attrs:
+            attrs = dict(attrs, default_project_id=self.current_projects[
+                user['project']].id)
+        self.identity.update_user(current, **attrs)
+
+    def _scope(self, item):
+        """Return the scope of a role assignment, None if it does not exist"""
+        if item.get('project'):
+            project = self.current_projects.get(item['project'])
+            return ('project', project.id) if project else None
+        if item.get('domain'):
+            return ('domain', self._domain_id(item['domain']))
+        if item.get('system'):
+            return ('system', 'all')
+        raise ValueError('No project, domain or system to grant {} in'.format(
+            _assignment_label(item)))
+
+    def _plan_assignments(self, phases):
+        seen = set()
+        for item in self.assignments:
+            label = _assignment_label(item)
+            if label in seen:
+                continue
+            seen.add(label)
+            user = self.current_users.get(item['user'])
+            role = self.current_roles.get(item['role'])
+            scope = self._scope(item)
+            exists = (None not in (user, role, scope) and
+                      (user.id, role.id) + scope in self.current_assignments)
+            if item.get('state', 'present') == 'absent':
+                if exists:
+                    phases[2].append((
+                        _change('delete', 'role_assignment', label),
+                        lambda i=item: self._assign(i, revoke=True)))
+            elif not exists:
+                phases[2].append((
+                    _change('create', 'role_assignment', label),
+                    lambda i=item: self._assign(i)))
+
+    def _assign(self, item, revoke=False):
+        identity = self.identity
+        user = self.current_users.get(item['user'])
+        if user is None:
+            raise ValueError('User not found: {}'.format(item['user']))
+        role = self.current_roles[item['role']]
+        kind, scope_id = self._scope(item)
+        prefix = 'unassign' if revoke else 'assign'
+        direction = 'from' if revoke else 'to'
+        if kind == 'system':
+            getattr(identity, '{}_system_role_{}_user'.format(
+                prefix, direction))(user, role, 'all')
+        else:
+            getattr(identity, '{}_{}_role_{}_user'.format(
+                prefix, kind, direction))(scope_id, user, role)
+
+    def apply(self, phases):
+        """Make the changes, the changes of a phase concurrently"""
+        for phase in phases:
+            self._map(lambda change: change[1](), phase)
+
+
+def reconcile(identity, params, check_mode=False):
+    """Reconcile Keystone with the catalog in params, return the result"""
+    reconciler = CatalogReconciler(identity, params)
+    reconciler.read()
+    phases = reconciler.plan()
+    if not check_mode:
+        reconciler.apply(phases)
+    changes = [change for phase in phases for change, _ in phase]
+    return dict(changed=bool(changes), changes=changes)
+
+
+def connect(params):
+    import openstack
+
+    kwargs = {key: params[key]
+              for key in ('region_name', 'interface', 'cacert')
+              if params.get(key)}
+    if params.get('auth'):
+        kwargs['auth'] = params['auth']
+    return openstack.connect(cloud=params.get('cloud'), **kwargs)
+
+
+def main():
+    state = dict(required=False, type='str', default='present',
+                 choices=['present', 'absent'])
+    endpoint = dict(
+        interface=dict(required=True, type='str'),
+        url=dict(required=True, type='str'),
+        state=state,
+    )
+    service = dict(
+        name=dict(required=True, type='str'),
+        type=dict(required=True, type='str'),
+        description=dict(required=False, type='str'),
+        enabled=dict(required=False, type='bool', default=True),
+        state=state,
+        endpoints=dict(required=False, type='list', elements='dict',
+                       default=[], options=endpoint),
+    )
+    user = dict(
+        user=dict(required=True, type='str'),
+        password=dict(required=False, type='str', no_log=True),
+        project=dict(required=True, type='str'),
+        role=dict(required=True, type='str'),
+        state=state,
+    )
+    user_role = dict(
+        user=dict(required=True, type='str'),
+        role=dict(required=True, type='str'),
+        project=dict(required=False, type='str'),
+        domain=dict(required=False, type='str'),
+        system=dict(required=False, type='str'),
+        state=state,
+    )
+    argument_spec = dict(
+        services=dict(required=False, type='list', elements='dict',
+                      default=[], options=service),
+        users=dict(required=False, type='list', elements='dict',
+                   default=[], options=user),
+        roles=dict(required=False, type='list', elements='str', default=[]),
+        user_roles=dict(required=False, type='list', elements='dict',
+                        default=[], options=user_role),
+        domain=dict(required=False, type='str', default='default'),
+        endpoint_region=dict(required=True, type='str'),
+        update_password=dict(required=False, type='bool', default=False,
+                             no_log=False),
+        concurrency=dict(required=False, type='int', default=8),
+        auth=dict(required=False, type='dict', no_log=True),
+        cloud=dict(required=False, type='str'),
+        region_name=dict(required=False, type='str'),
+        interface=dict(required=False, type='str', default='public'),
+        cacert=dict(required=False, type='str'),
+    )
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+        bypass_checks=False
+    )
+
+    try:
+        conn = connect(module.params)
+    except ImportError:
+        module.fail_json(msg="The openstacksdk library could not be imported")
+    try:
+        result = reconcile(conn.identity, module.params, module.check_mode)
+        module.exit_json(**result)
+    except Exception:
+        module.fail_json(changed=True, msg=repr(format_exc()))
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,8 @@ import tarfile
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.kolla_toolbox_server import TaskClient
+from ansible.module_utils.kolla_toolbox_server import TaskServerError
 
 DOCUMENTATION = '''
 ---
@@ -29,6 +31,13 @@ short_description: >
 description:
   - A module targeting at invoking ansible module in kolla_toolbox
     container as used by Kolla project.
+  - When the task server of the kolla_toolbox container is running, the
+    modules are run by it, unless they have an action plugin or user is
+    set to another user than ansible. Otherwise they are run by
+    ansible-runner.
+  - When the Keystone token cache of the kolla_toolbox container is in
+    use, the number of tokens issued since it was last reset is returned
+    in auth_tokens_issued.
 options:
   container_engine:
     description:
@@ -38,14 +47,34 @@ options:
     choices: ['docker', 'podman']
   module_name:
     description:
-      - The module name to invoke
-    required: True
+      - The module name to invoke. Either this or tasks is required.
+    required: False
     type: str
   module_args:
     description:
       - The module args use by the module
     required: False
     type: dict
+  tasks:
+    description:
+      - List of modules to invoke in order, in a single ansible-runner
+        run. The first failing task fails the module and the tasks after
+        it are not run, as in a play. The result of each task is returned
+        in results.
+    required: False
+    type: list
+    elements: dict
+    suboptions:
+      module_name:
+        description:
+          - The module name to invoke
+        required: True
+        type: str
+      module_args:
+        description:
+          - The module args use by the module
+        required: False
+        type: dict
   module_extra_vars:
     description:
       - The extra variables used by the module
@@ -104,6 +133,26 @@ EXAMPLES = '''
             password: password
             project_name: "admin"
             domain_name: "default"
+    - name: Create roles in a single run
+      kolla_toolbox:
+        container_engine: docker
+        tasks:
+          - module_name: openstack.cloud.identity_role
+            module_args:
+              name: member
+              auth: "{{ '{{ openstack_keystone_auth }}' }}"
+          - module_name: openstack.cloud.identity_role
+            module_args:
+              name: reader
+              auth: "{{ '{{ openstack_keystone_auth }}' }}"
+        module_extra_vars:
+          openstack_keystone_auth:
+            auth_url: http://127.0.0.1:5000
+            username: admin
+            password: password
+            project_name: "admin"
+            domain_name: "default"
+      register: roles
 '''
 
 # NOTE(mnasiadka): Full path to Python inside the kolla_toolbox container
@@ -112,45 +161,108 @@ _PYTHON = '/opt/ansible/bin/python3'
 # NOTE(mnasiadka): Base directory for ansible-runner private_data_dir trees
 _PDD_BASEDIR = '/var/lib/ansible'
 
-# NOTE(mnasiadka): Script run inside kolla_toolbox to extract the terminal
-#                  ansible-runner vent from job_events and print it as JSON
-_PARSE_SCRIPT = """\
-import json, os, sys
-pdd = %r
-events_dir = None
-for root, dirs, files in os.walk(pdd):
-    if "job_events" in dirs:
-        events_dir = os.path.join(root, "job_events")
-        break
-if not events_dir:
-    print(json.dumps({"failed": True,
-                      "msg": "no job_events dir under " + pdd}))
-    sys.exit(1)
-terminal = {"runner_on_ok", "runner_on_failed",
+# NOTE: Driver run inside kolla_toolbox as root from the private_data_dir it
+#       is pushed into. It prepares the directory for the user, runs
+#       ansible-runner as that user, prints the terminal events from
+#       job_events as JSON, one line per task in the order they ran, and
+#       removes the directory, all in a single exec.
+_DRIVER_SCRIPT = """\
+import json
+import os
+import pwd
+import shutil
+import subprocess
+import sys
+
+RUNNER = "/opt/ansible/bin/ansible-runner"
+TERMINAL = {"runner_on_ok", "runner_on_failed",
             "runner_on_unreachable", "runner_on_async_failed",
             "runner_on_skipped"}
-for fname in sorted(os.listdir(events_dir)):
-    path = os.path.join(events_dir, fname)
-    with open(path) as f:
-        event = json.load(f)
-    event_type = event.get("event", "")
-    if event_type in terminal:
-        res = event.get("event_data", {}).get("res", {})
-        res.pop("_ansible_no_log", None)
-        res["_runner_status"] = event_type
+LIFECYCLE = {"runner_on_start", "runner_on_no_hosts",
+             "runner_on_async_poll", "runner_on_async_ok"}
+
+
+def fail(msg):
+    print(json.dumps({"failed": True, "msg": msg}))
+    sys.exit(1)
+
+
+def read_events(pdd):
+    events_dir = None
+    for root, dirs, files in os.walk(pdd):
+        if "job_events" in dirs:
+            events_dir = os.path.join(root, "job_events")
+            break
+    if not events_dir:
+        fail("no job_events dir under " + pdd)
+    results = []
+    for fname in sorted(os.listdir(events_dir),
+                        key=lambda name: int(name.split("-")[0])):
+        with open(os.path.join(events_dir, fname)) as f:
+            event = json.load(f)
+        event_type = event.get("event", "")
+        if event_type in TERMINAL:
+            res = event.get("event_data", {}).get("res", {})
+            res.pop("_ansible_no_log", None)
+            res["_runner_status"] = event_type
+            results.append(res)
+        elif event_type.startswith("runner_on_") and (
+                event_type not in LIFECYCLE):
+            fail("unhandled runner event: " + event_type)
+    if not results:
+        fail("no terminal event found")
+    return results
+
+
+def run(pdd, user, diff):
+    if not os.access(RUNNER, os.X_OK):
+        fail("The 'ansible-runner' binary was not found in the "
+             "kolla_toolbox container. Please ensure the container "
+             "image is up to date and includes ansible-runner.")
+    pw = pwd.getpwnam(user)
+    os.makedirs(os.path.join(pdd, "tmp"), exist_ok=True)
+    env = dict(os.environ, HOME=pw.pw_dir, USER=user, LOGNAME=user)
+    kwargs = {}
+    if pw.pw_uid != 0:
+        # NOTE: Chown pdd to the user so ansible-runner can create
+        #       artifacts/ even when the user has no shell (e.g. rabbitmq,
+        #       nova).
+        for root, dirs, files in os.walk(pdd):
+            for name in [root] + [os.path.join(root, f) for f in files]:
+                os.chown(name, pw.pw_uid, pw.pw_gid)
+        kwargs = dict(user=pw.pw_uid, group=pw.pw_gid,
+                      extra_groups=os.getgrouplist(user, pw.pw_gid))
+    if user == "ansible":
+        env["HOME"] = os.path.dirname(pdd)
+    if diff:
+        env["ANSIBLE_DIFF_MODE"] = "1"
+    runner = subprocess.run(
+        [RUNNER, "run", pdd, "--playbook", "main.json",
+         "--rotate-artifacts", "1"],
+        env=env, cwd=pdd, stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT, **kwargs)
+    # exit 2 = task failed/unreachable; handled via event below.
+    # Anything else is a runner-level failure.
+    if runner.returncode not in (0, 2):
+        fail("ansible-runner exited with code %d: %s"
+             % (runner.returncode,
+                runner.stdout.decode(errors="replace")))
+    results = read_events(pdd)
+    # NOTE: Tokens issued so far, when the Keystone token cache is in use.
+    issued = os.path.join(env["HOME"], ".cache", "kolla-auth", "issued")
+    if os.path.exists(issued):
+        with open(issued) as f:
+            results[-1]["_auth_tokens_issued"] = int(f.read() or 0)
+    for res in results:
         print(json.dumps(res))
-        sys.exit(0)
-    lifecycle_events = {"runner_on_start", "runner_on_no_hosts",
-                 "runner_on_async_poll", "runner_on_async_ok"}
-    if event_type.startswith("runner_on_") and (
-            event_type not in lifecycle_events):
-        print(json.dumps({"failed": True,
-                          "msg": "unhandled runner event: "
-                                 + event_type}))
-        sys.exit(1)
-print(json.dumps({"failed": True,
-                  "msg": "no terminal event found"}))
-sys.exit(1)
+
+
+if __name__ == "__main__":
+    pdd = os.path.dirname(os.path.abspath(__file__))
+    try:
+        run(pdd, sys.argv[1], sys.argv[2] == "1")
+    finally:
+        shutil.rmtree(pdd, ignore_errors=True)
 """
 
 
@@ -161,18 +273,24 @@ _ExecResult = collections.namedtuple(
     '_ExecResult', ['exit_code', 'output'])
 
 
-def _build_playbook(module_name, module_args, extra_vars, check_mode):
+def _build_playbook(module_name, module_args, extra_vars, check_mode,
+                    tasks=None):
     """Return a JSON playbook string for *module_name* / *module_args*.
 
     Both module_args and extra_vars are embedded as dicts so they live
     on disk inside the container and never appear on any CLI.
+    When *tasks* is given, a list of dicts with module_name and
+    module_args, they are run in order in the same play instead.
     """
+    if tasks is None:
+        tasks = [{'module_name': module_name, 'module_args': module_args}]
     play = {
         'name': 'kolla_toolbox',
         'hosts': 'localhost',
         'gather_facts': False,
         'tasks': [{'name': 'kolla_toolbox task',
-                   module_name: module_args}],
+                   task['module_name']: task.get('module_args') or {}}
+                  for task in tasks],
     }
     if extra_vars:
         play['vars'] = extra_vars
@@ -248,14 +366,11 @@ class KollaToolboxWorker():
             )
         return cont[0]
 
-    def _push_private_data_dir(self, kolla_toolbox, pdd, user):
+    def _push_private_data_dir(self, kolla_toolbox, pdd):
         """Push the ansible-runner private_data_dir tree into container.
 
-        Creates pdd (and pdd/tmp for Ansible's temp files) as root, then
-        chowns both to *user* if specified so ansible-runner can write
-        there even when the user has no shell (e.g. rabbitmq, nova).
-
-        Pushes inventory and playbook via a single put_archive() call —
+        Pushes the inventory, the playbook and the driver script via a
+        single put_archive() call into _PDD_BASEDIR, which creates pdd —
         one tar stream through the socket, no secrets in any argv.
         """
         params = self.module.params
@@ -265,36 +380,9 @@ class KollaToolboxWorker():
             params.get('module_args') or {},
             params.get('module_extra_vars') or {},
             self.module.check_mode,
+            params.get('tasks'),
         )
 
-        # NOTE(mnasiadka): Build and run the setup script as root so it
-        #                  can always write to _PDD_BASEDIR.
-        #                  Chown pdd to the effective exec user
-        #                  so ansible-runner can create artifacts/.
-        chown_user = user if user else 'ansible'
-        if chown_user == 'root':
-            setup = (
-                'import os\n'
-                'for p in [%r, %r + "/tmp"]:\n'
-                '    os.makedirs(p, exist_ok=True)\n'
-            ) % (pdd, pdd)
-        else:
-            setup = (
-                'import os, pwd\n'
-                'pw = pwd.getpwnam(%r)\n'
-                'for p in [%r, %r + "/tmp"]:\n'
-                '    os.makedirs(p, exist_ok=True)\n'
-                '    os.chown(p, pw.pw_uid, pw.pw_gid)\n'
-            ) % (chown_user, pdd, pdd)
-
-        mkdir_result = _exec_run(
-            kolla_toolbox, [_PYTHON, '-c', setup], user='root')
-        if mkdir_result.exit_code != 0:
-            self.module.fail_json(
-                msg='Failed to create pdd %s in kolla_toolbox: %s'
-                    % (pdd, mkdir_result.output.decode(errors='replace'))
-            )
-
         inventory = (
             'localhost'
             ' ansible_connection=local'
@@ -304,46 +392,66 @@ class KollaToolboxWorker():
             ' ansible_python_interpreter={python}\n'
         ).format(pdd=pdd, python=_PYTHON)
 
-        kolla_toolbox.put_archive(pdd, _make_tar({
-            'inventory/hosts': inventory,
-            'project/main.json': playbook_json,
+        name = pdd[len(_PDD_BASEDIR) + 1:]
+        kolla_toolbox.put_archive(_PDD_BASEDIR, _make_tar({
+            name + '/inventory/hosts': inventory,
+            name + '/project/main.json': playbook_json,
+            name + '/driver.py': _DRIVER_SCRIPT,
         }))
 
-    def _parse_runner_result(self, kolla_toolbox, pdd, user):
-        """Extract the module result from ansible-runner job_events.
+    def _run_driver(self, kolla_toolbox, pdd, user):
+        """Run the driver script and return the results of the tasks.
 
-        Runs _PARSE_SCRIPT inside the container via exec_run: it walks
-        job_events, finds the terminal event, and prints result as JSON.
-        No tar parsing, no path-prefix assumptions.
+        The driver runs as root so it can chown pdd to *user* and remove
+        it afterwards; it runs ansible-runner itself as *user*. Only pdd,
+        the user name and the diff flag are in argv, no secrets.
         """
-        parse_kwargs = {}
-        if user:
-            parse_kwargs['user'] = user
+        return self._driver_results(
+            self._exec_driver(kolla_toolbox, pdd, user))
 
-        result = _exec_run(
-            kolla_toolbox, [_PYTHON, '-c', _PARSE_SCRIPT % pdd],
-            **parse_kwargs
-        )
+    def _exec_driver(self, kolla_toolbox, pdd, user):
+        """Run the driver script and return its exec result."""
+        return _exec_run(
+            kolla_toolbox,
+            [_PYTHON, pdd + '/driver.py', user or 'ansible',
+             '1' if self.module._diff else '0'],
+            user='root')
 
-        if result.exit_code != 0:
-            self.module.fail_json(
-                msg='Failed to read ansible-runner result (exit %d): %s'
-                    % (result.exit_code,
-                       result.output.decode(errors='replace'))
-            )
+    def _driver_results(self, result):
+        """Return the results of the tasks from the output of the driver."""
+        output = result.output.decode('utf-8', errors='replace')
 
         try:
-            res = json.loads(result.output.decode('utf-8'))
+            results = [json.loads(line) for line in output.splitlines()
+                       if line.strip()]
         except json.JSONDecodeError:
             self.module.fail_json(
                 msg='Could not parse ansible-runner result output: %r'
                     % result.output
             )
 
+        if result.exit_code != 0:
+            msg = results[-1].get('msg') if results else output
+            self.module.fail_json(
+                msg='Failed to run ansible-runner (exit %d): %s'
+                    % (result.exit_code, msg)
+            )
+
+        return results
+
+    @staticmethod
+    def _task_failed(res):
+        """Strip runner metadata from a task result, return if it failed."""
         status = res.pop('_runner_status', 'runner_on_ok')
         res.pop('_ansible_no_log', None)
-        if res.get('failed') or status not in ['runner_on_ok',
-                                               'runner_on_skipped']:
+        return bool(res.get('failed')) or status not in ['runner_on_ok',
+                                                         'runner_on_skipped']
+
+    def _parse_runner_result(self, results):
+        """Return the module result from the task results of the driver."""
+        res = results[0]
+
+        if self._task_failed(res):
             msg = res.pop(
                 'msg',
                 'Module execution failed inside kolla_toolbox'
@@ -352,71 +460,114 @@ class KollaToolboxWorker():
 
         return res
 
+    def _parse_runner_results(self, results):
+        """Return the results of the tasks from the driver.
+
+        Like a play, the tasks stop at the first failure, which fails the
+        module with the results of the tasks run so far.
+        """
+        tasks = self.module.params['tasks']
+        for index, res in enumerate(results):
+            if self._task_failed(res):
+                res['failed'] = True
+                msg = res.get('msg',
+                              'Module execution failed inside kolla_toolbox')
+                self.module.fail_json(
+                    msg='Task %d (%s) failed: %s'
+                        % (index, tasks[index]['module_name'], msg),
+                    changed=any(r.get('changed') for r in results),
+                    results=results)
+
+        if len(results) != len(tasks):
+            self.module.fail_json(
+                msg='Expected %d task results from ansible-runner, got %d'
+                    % (len(tasks), len(results)),
+                changed=any(r.get('changed') for r in results),
+                results=results)
+
+        return dict(changed=any(r.get('changed') for r in results),
+                    results=results)
+
+    def _run_on_task_server(self):
+        """Run the tasks on the task server of kolla_toolbox.
+
+        Returns the results of the tasks, or None when no task server is
+        running or it cannot run the tasks, in which case they are left to
+        ansible-runner.
+        """
+        params = self.module.params
+        if params.get('user') not in (None, 'ansible'):
+            return None
+        client = TaskClient.connect(timeout=params.get('timeout'))
+        if client is None:
+            return None
+
+        tasks = params.get('tasks') or [
+            {'module_name': params['module_name'],
+             'module_args': params.get('module_args') or {}}]
+        try:
+            return client.run(tasks,
+                              params.get('module_extra_vars') or {},
+                              self.module.check_mode,
+                              self.module._diff)
+        except TaskServerError as e:
+            self.module.fail_json(
+                msg='kolla_toolbox task server failed: %s' % e)
+
+    def _parse_results(self, results):
+        issued = results[-1].pop('_auth_tokens_issued', None)
+        if self.module.params.get('tasks'):
+            result = self._parse_runner_results(results)
+        else:
+            result = self._parse_runner_result(results)
+        if issued is not None:
+            result['auth_tokens_issued'] = issued
+        return result
+
     def main(self) -> None:
         """Run the requested module inside the kolla_toolbox container.
 
+        The task server is used when it can run the module, otherwise:
+
         1. Generate a unique pdd name on the controller (no exec).
-        2. Push inventory + playbook via put_archive (secrets travel as
-           tar content, never in argv).
-        3. Run ansible-runner CLI (only pdd path in argv, no secrets).
-        4. Extract result via _PARSE_SCRIPT exec (walks job_events,
-           prints terminal event as JSON — no tar, no path assumptions).
-        5. Clean up pdd unconditionally in finally.
+        2. Push inventory, playbook and driver via put_archive (secrets
+           travel as tar content, never in argv).
+        3. Run the driver in a single exec: it prepares pdd, runs
+           ansible-runner, prints the terminal events as JSON and removes
+           pdd.
         """
+        results = self._run_on_task_server()
+        if results is not None:
+            self.result = self._parse_results(results)
+            return
+
         kolla_toolbox = self._get_toolbox_container()
         user = self.module.params.get('user')
 
-        check_runner = _exec_run(
-            kolla_toolbox, ['test', '-x', '/opt/ansible/bin/ansible-runner'])
-        if check_runner.exit_code != 0:
-            self.module.fail_json(
-                msg="The 'ansible-runner' binary was not found in the "
-                    "kolla_toolbox container. Please ensure the container "
-                    "image is up to date and includes ansible-runner."
-            )
-
         # NOTE(mnasiadka): Generate a unique pdd name without creating
         #                  anything locally.
         pdd = _PDD_BASEDIR + '/kolla_runner.' + secrets.token_urlsafe(8)
 
         try:
-            self._push_private_data_dir(kolla_toolbox, pdd, user)
-
-            exec_user = user or 'ansible'
-            runner_env = {}
-            if exec_user == 'ansible':
-                runner_env['HOME'] = _PDD_BASEDIR
-            if self.module._diff:
-                runner_env['ANSIBLE_DIFF_MODE'] = '1'
-
-            runner_result = _exec_run(
-                kolla_toolbox,
-                ['/opt/ansible/bin/ansible-runner', 'run', pdd,
-                 '--playbook', 'main.json',
-                 '--rotate-artifacts', '1'],
-                user=exec_user,
-                environment=runner_env
-            )
-            # exit 2 = task failed/unreachable; handled via event below.
-            # Anything else is a runner-level failure.
-            if runner_result.exit_code not in (0, 2):
-                self.module.fail_json(
-                    msg='ansible-runner exited with code %d: %s'
-                        % (runner_result.exit_code,
-                           runner_result.output.decode(errors='replace'))
+            self._push_private_data_dir(kolla_toolbox, pdd)
+            result = self._exec_driver(kolla_toolbox, pdd, user)
+        except BaseException:
+            # NOTE: Once it has run, the driver removes pdd, which holds the
+            #       module args and so credentials. Remove it here when the
+            #       push or the exec failed, possibly after a partial push.
+            try:
+                _exec_run(
+                    kolla_toolbox,
+                    [_PYTHON, '-c',
+                     'import shutil; shutil.rmtree(%r, ignore_errors=True)'
+                     % pdd],
+                    user='root',
                 )
+            except Exception:  # nosec B110
+                pass
+            raise
 
-            self.result = self._parse_runner_result(
-                kolla_toolbox, pdd, user)
-
-        finally:
-            _exec_run(
-                kolla_toolbox,
-                [_PYTHON, '-c',
-                 'import shutil; shutil.rmtree(%r, ignore_errors=True)'
-                 % pdd],
-                user='root',
-            )
+        self.result = self._parse_results(self._driver_results(result))
 
 
 def create_container_client(module: AnsibleModule):
@@ -479,11 +630,25 @@ class KollaAnsibleModule(AnsibleModule):
         }
     )
 
-    def _log_invocation(self):
-        for param in ('module_args', 'module_extra_vars'):
-            for key, value in (self.params.get(param) or {}).items():
+    def _add_no_log_values(self, params):
+        # Sensitive keys may be nested, such as the passwords of the users
+        # of kolla_keystone_catalog, so look through dicts and lists.
+        if isinstance(params, dict):
+            for key, value in params.items():
                 if key in self._NO_LOG_KEYS and value is not None:
                     self.no_log_values.add(str(value))
+                self._add_no_log_values(value)
+        elif isinstance(params, list):
+            for value in params:
+                self._add_no_log_values(value)
+
+    def _log_invocation(self):
+        args = [self.params.get('module_args'),
+                self.params.get('module_extra_vars')]
+        args.extend(task.get('module_args')
+                    for task in self.params.get('tasks') or [])
+        for params in args:
+            self._add_no_log_values(params)
         super()._log_invocation()
 
 
@@ -492,8 +657,12 @@ def create_ansible_module() -> KollaAnsibleModule:
         container_engine=dict(type='str',
                               choices=['podman', 'docker'],
                               required=True),
-        module_name=dict(type='str', required=True),
+        module_name=dict(type='str'),
         module_args=dict(type='dict', default=dict()),
+        tasks=dict(type='list', elements='dict', options=dict(
+            module_name=dict(type='str', required=True),
+            module_args=dict(type='dict', default=dict()),
+        )),
         module_extra_vars=dict(type='dict', default=dict()),
         api_version=dict(type='str', default='auto'),
         timeout=dict(type='int', default=180),
@@ -501,6 +670,8 @@ def create_ansible_module() -> KollaAnsibleModule:
     )
 
     return KollaAnsibleModule(argument_spec=argument_spec,
+                              mutually_exclusive=[('module_name', 'tasks')],
+                              required_one_of=[('module_name', 'tasks')],
                               supports_check_mode=True)
 
 
@@ -0,0 +1,152 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keystone token cache shared by the modules run in kolla_toolbox
+
+openstacksdk stores the authentication state of a connection in a keyring
+when the cache of clouds.yaml has auth set, and reuses it for the next
+connection with the same credentials, until the token is about to expire.
+FileKeyring is a keyring backend keeping that state in files, so the
+openstack.cloud modules of consecutive kolla_toolbox tasks share their
+tokens instead of authenticating to Keystone each time.
+
+The cache counts the tokens stored which differ from the one they replace,
+that is the tokens issued by Keystone while it is in use, in its
+"issued" file.
+
+Select the backend in keyringrc.cfg::
+
+    [backend]
+    default-keyring = kolla_auth_cache.FileKeyring
+    keyring-path = /usr/local/lib/kolla
+"""
+
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+try:
+    from keyring import backend
+except ImportError:
+    backend = None
+
+AUTH_CACHE_DIR = '~/.cache/kolla-auth'
+# NOTE: The minimum lifetime keystoneauth requires of a token to reuse it.
+MIN_TOKEN_LIFE = 120
+
+
+def _expires_at(state):
+    """Return when the token of an authentication state expires"""
+    try:
+        body = json.loads(state)['body']
+        if 'token' in body:
+            expires_at = body['token']['expires_at']
+        else:
+            expires_at = body['access']['token']['expires']
+    except (KeyError, TypeError, ValueError):
+        return None
+    expires_at = datetime.datetime.strptime(expires_at[:19],
+                                            '%Y-%m-%dT%H:%M:%S')
+    return expires_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def _auth_token(state):
+    try:
+        return json.loads(state).get('auth_token')
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class AuthCache(object):
+    """Authentication states in files, one per openstacksdk cache ID"""
+
+    def __init__(self, path=AUTH_CACHE_DIR):
+        self.path = os.path.expanduser(path)
+
+    def _entry(self, key):
+        return os.path.join(self.path,
+                            hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        """Return the state for key, None if missing or about to expire"""
+        try:
+            with open(self._entry(key)) as f:
+                state = f.read()
+        except OSError:
+            return None
+        expires_at = _expires_at(state)
+        if expires_at is None or expires_at - time.time() < MIN_TOKEN_LIFE:
+            return None
+        return state
+
+    def set(self, key, state):
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        entry = self._entry(key)
+        try:
+            with open(entry) as f:
+                previous = f.read()
+        except OSError:
+            previous = None
+        with tempfile.NamedTemporaryFile('w', dir=self.path,
+                                         delete=False) as f:
+            f.write(state)
+        os.replace(f.name, entry)
+        if _auth_token(state) != _auth_token(previous):
+            self._count_issued()
+
+    def delete(self, key):
+        try:
+            os.unlink(self._entry(key))
+        except FileNotFoundError:
+            pass
+
+    def _count_issued(self):
+        fd = os.open(os.path.join(self.path, 'issued'),
+                     os.O_RDWR | os.O_CREAT, 0o600)
+        with os.fdopen(fd, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            issued = int(f.read() or 0) + 1
+            f.seek(0)
+            f.truncate()
+            f.write(str(issued))
+
+    def tokens_issued(self):
+        """Return the number of tokens issued, None if never used"""
+        try:
+            with open(os.path.join(self.path, 'issued')) as f:
+                return int(f.read() or 0)
+        except OSError:
+            return None
+
+
+if backend is not None:
+    class FileKeyring(backend.KeyringBackend):
+        """Keyring backend for the openstacksdk authentication cache"""
+
+        priority = 1
+
+        def __init__(self):
+            super().__init__()
+            self.cache = AuthCache()
+
+        def get_password(self, service, username):
+            return self.cache.get('{}/{}'.format(service, username))
+
+        def set_password(self, service, username, password):
+            self.cache.set('{}/{}'.format(service, username), password)
+
+        def delete_password(self, service, username):
+            self.cache.delete('{}/{}'.format(service, username))
@@ -12,15 +12,259 @@
 
 from abc import ABC
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
 import logging
 import os
 import shlex
+import tempfile
+import time
 
+from ansible.module_utils.kolla_systemd_worker import create_unit_files
 from ansible.module_utils.kolla_systemd_worker import SystemdWorker
 
 COMPARE_CONFIG_CMD = ['/usr/local/bin/kolla_set_configs', '--check']
 LOG = logging.getLogger(__name__)
 
+# Host-local state kept by kolla_container between module runs.
+STATE_DIR = '/var/lib/kolla/kolla_container'
+# NOTE: Container engines only keep a bounded number of past events, so an
+# index which has not been verified against the event stream for this many
+# seconds is rebuilt rather than trusted.
+INDEX_MAX_AGE = 600
+# Label holding the hash of the desired configuration a container was created
+# with, see ContainerWorker.desired_fingerprint().
+FINGERPRINT_LABEL = 'kolla_fingerprint'
+# Module parameters covered by the fingerprint in addition to the image ID,
+# volumes and environment.
+FINGERPRINT_PARAMS = (
+    'cap_add', 'cgroupns_mode', 'command', 'dimensions', 'healthcheck',
+    'image', 'ipc_mode', 'labels', 'pid_mode', 'privileged', 'security_opt',
+    'tmpfs', 'volumes_from',
+)
+# NOTE: Config checks share the engine client, whose connection pool holds
+# 10 connections by default, so keep the number of concurrent execs below.
+CONFIG_CHECK_WORKERS = 8
+
+
+class InspectionSnapshot(ABC):
+    """Per-invocation cache of container engine inspection results
+
+    Each container and image is fetched from the engine at most once per
+    module run. Later lookups are served from the snapshot until an action
+    which changes the object (create, start, stop, remove, pull) forgets it.
+    Missing objects are cached as ``None`` so repeated negative lookups are
+    free as well.
+    """
+
+    def __init__(self, worker):
+        self.worker = worker
+        # Number of engine API calls made to populate the snapshot.
+        self.api_calls = 0
+        self._containers = {}
+        self._container_infos = {}
+        self._images = {}
+
+    def _call(self, func, *args, **kwargs):
+        self.api_calls += 1
+        return func(*args, **kwargs)
+
+    @abstractmethod
+    def _fetch_container(self, name):
+        pass
+
+    @abstractmethod
+    def _fetch_container_info(self, name):
+        pass
+
+    @abstractmethod
+    def _fetch_image(self, image):
+        pass
+
+    def container(self, name):
+        if name not in self._containers:
+            self._containers[name] = self._fetch_container(name)
+        return self._containers[name]
+
+    def load_containers(self, names):
+        """Look up several containers ahead of comparing them
+
+        Engines which can list all containers in one call override this.
+        """
+        for name in names:
+            self.container(name)
+
+    def container_info(self, name):
+        if name not in self._container_infos:
+            if not self.container(name):
+                return None
+            self._container_infos[name] = self._fetch_container_info(name)
+        return self._container_infos[name]
+
+    def image(self, image):
+        if image not in self._images:
+            self._images[image] = self._fetch_image(image)
+        return self._images[image]
+
+    def forget_container(self, name, removed=False):
+        """Drop a container from the snapshot
+
+        :param name: name of the container
+        :param removed: the container is known to be gone, so record it as
+                        missing instead of fetching it again on next lookup
+        """
+        self._container_infos.pop(name, None)
+        if removed:
+            self._containers[name] = None
+        else:
+            self._containers.pop(name, None)
+
+    def forget_images(self):
+        self._images.clear()
+
+
+class EngineIndex(ABC):
+    """Host-local index of image references and volume names
+
+    The index is persisted between module runs so that looking up a single
+    image or volume does not require listing all of them. The first time the
+    index is used in a run, engine events since it was last verified are
+    checked and every section with image or volume events is rebuilt from a
+    full listing when it is next needed.
+    """
+
+    version = 1
+    sections = ('images', 'volumes')
+
+    def __init__(self, worker, path):
+        self.worker = worker
+        # No persistence when path is None, the index then only lives for the
+        # duration of the module run.
+        self.path = path
+        self._data = None
+
+    @abstractmethod
+    def _list(self, section):
+        """Return all objects of a section keyed by their reference"""
+        pass
+
+    @abstractmethod
+    def _changed_sections(self, since, until):
+        """Return the sections with engine events between since and until"""
+        pass
+
+    def _load(self):
+        if not self.path:
+            return None
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return None
+        return data
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            LOG.warning('Failed to save container engine index %s: %s',
+                        self.path, e)
+
+    def _sync(self):
+        now = int(time.time())
+        data = self._load()
+        if data and 0 <= now - data.get('timestamp', 0) < INDEX_MAX_AGE:
+            # NOTE: Event timestamps have sub-second precision, so look one
+            # second further back to not miss events from the same second.
+            for section in self._changed_sections(data['timestamp'] - 1, now):
+                data[section] = None
+        else:
+            data = dict.fromkeys(self.sections)
+            data['version'] = self.version
+        data['timestamp'] = now
+        self._data = data
+        self._save()
+
+    def lookup(self, section, key):
+        if self._data is None:
+            self._sync()
+        if self._data.get(section) is None:
+            self._data[section] = self._list(section)
+            self._save()
+        return self._data[section].get(key)
+
+    def update(self, section, key, value=None):
+        """Record an object changed through the engine, None removes it"""
+        if self._data is None or self._data.get(section) is None:
+            return
+        if value is None:
+            self._data[section].pop(key, None)
+        else:
+            self._data[section][key] = value
+        self._save()
+
+    def invalidate(self, section):
+        """Mark a section as stale after changing it through the engine"""
+        if self._data is None:
+            # NOTE: The change will show up in the events checked by the next
+            # sync, so there is nothing to do yet.
+            return
+        self._data[section] = None
+        self._save()
+
+
+class PullProgress(object):
+    """Accounting of an image pull from its progress stream
+
+    The stream carries Docker style status messages, one per progress update
+    of a layer. Only the latest progress of each layer is kept, so memory
+    use does not depend on the length of the stream.
+    """
+
+    def __init__(self):
+        self.start = time.monotonic()
+        # Bytes downloaded per layer ID. Layers which already existed locally
+        # are recorded with 0 bytes.
+        self.layers = {}
+        self._totals = {}
+
+    def update(self, status):
+        layer = status.get('id')
+        if not layer:
+            return
+        detail = status.get('progressDetail') or {}
+        state = status.get('status', '')
+        if state == 'Downloading':
+            self.layers[layer] = max(self.layers.get(layer, 0),
+                                     detail.get('current', 0))
+            if detail.get('total'):
+                self._totals[layer] = detail['total']
+        elif state == 'Download complete':
+            self.layers[layer] = self._totals.get(layer,
+                                                  self.layers.get(layer, 0))
+        elif state == 'Already exists':
+            self.layers[layer] = 0
+
+    def report(self):
+        duration = time.monotonic() - self.start
+        total = sum(self.layers.values())
+        return {
+            'layers': dict(self.layers),
+            'total_bytes': total,
+            'duration': round(duration, 3),
+            'mb_per_sec': round(total / duration / 1e6, 2) if duration else 0,
+        }
+
 
 class ContainerWorker(ABC):
     def __init__(self, module):
@@ -32,6 +276,13 @@ class ContainerWorker(ABC):
         # Populated by compare_config() when config differs, so diff_config()
         # can surface the output without running the exec a second time.
         self._config_diff = None
+        # Results of config checks run ahead by check_configs(), consumed
+        # by compare_config().
+        self._config_checks = {}
+        # Set by the engine specific workers once their client exists.
+        self.snapshot = None
+        # Client of the resident host agent, if the engine uses one.
+        self.agent = None
 
         self.systemd = SystemdWorker(self.params)
 
@@ -59,7 +310,136 @@ class ContainerWorker(ABC):
     def check_container(self):
         pass
 
+    @abstractmethod
+    def _check_config(self, name):
+        """Run kolla_set_configs --check in a container
+
+        :returns: a tuple of whether the config changed and a description
+                  of the change
+        """
+        pass
+
+    def compare_config(self):
+        name = self.params['name']
+        if name in self._config_checks:
+            changed, diff = self._config_checks.pop(name)
+        else:
+            changed, diff = self._check_config(name)
+        if changed:
+            self._config_diff = diff
+        return changed
+
+    def check_configs(self, names):
+        """Run the config checks of several containers concurrently
+
+        The results are kept for compare_config() and the time taken by
+        each check is returned in ``config_check_latency``.
+        """
+        latency = {}
+
+        def check(name):
+            start = time.monotonic()
+            try:
+                return self._check_config(name)
+            finally:
+                latency[name] = round(time.monotonic() - start, 3)
+
+        if not names:
+            return
+        workers = min(CONFIG_CHECK_WORKERS, len(names))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            self._config_checks.update(
+                zip(names, executor.map(check, names)))
+        self.result['config_check_latency'] = latency
+
     def compare_container(self):
+        failures = self._compare_container()
+        if failures:
+            self.changed = True
+            self.result['comparison_failures'] = failures
+
+        return self.changed
+
+    def compare_containers(self):
+        """Compare several containers in one module run
+
+        Each entry of the ``containers`` parameter holds the options of one
+        container, as they would be passed to ``compare_container``. All
+        containers are checked against the same inspection snapshot and
+        failures are returned in ``comparison_failures`` keyed by container
+        name.
+        """
+        params = self.params
+        systemd = self.systemd
+        specs = [self._container_params(spec)
+                 for spec in params.get('containers')]
+        names = [spec['name'] for spec in specs]
+        self.snapshot.load_containers(names)
+        self.check_configs(
+            [name for name in names if self.snapshot.container(name)])
+
+        failures = {}
+        try:
+            for spec in specs:
+                self.params = spec
+                self.systemd = SystemdWorker(spec)
+                self._config_diff = None
+                container_failures = self._compare_container()
+                if container_failures:
+                    failures[spec['name']] = container_failures
+        finally:
+            self.params = params
+            self.systemd = systemd
+
+        if failures:
+            self.changed = True
+            self.result['comparison_failures'] = failures
+
+        return self.changed
+
+    def update_unit_files(self):
+        """Update the systemd units of several containers at once
+
+        Takes the same ``containers`` parameter as ``compare_containers``.
+        Changed unit files of existing containers are written together,
+        followed by a single daemon reload, so that restarting the
+        containers afterwards does not reload systemd for each of them.
+        Units are neither started nor restarted. Missing containers get
+        their unit when they are created and, like in ``create_container``,
+        containers with the oneshot restart policy have none.
+        """
+        specs = [self._container_params(spec)
+                 for spec in self.params.get('containers')]
+        specs = [spec for spec in specs
+                 if spec.get('restart_policy') != 'oneshot']
+        self.snapshot.load_containers([spec['name'] for spec in specs])
+        changed = create_unit_files([
+            SystemdWorker(spec) for spec in specs
+            if self.snapshot.container(spec['name'])])
+        if changed:
+            self.changed = True
+            self.result['changed_units'] = [
+                worker.container_dict['service_name'] for worker in changed]
+        return self.changed
+
+    def _container_params(self, spec):
+        """Merge options of a single container into the module parameters"""
+        if not spec.get('name'):
+            self.module.fail_json(
+                msg='Each entry of containers requires a name')
+        params = dict(self.params)
+        params.pop('containers', None)
+        environment = dict(params.get('environment') or {})
+        environment.update(spec.get('environment') or {})
+        params.update((k, v) for k, v in spec.items() if v is not None)
+        params['environment'] = environment
+        # Same as for the module parameters, empty modes are not compared.
+        for key in ('ipc_mode', 'pid_mode'):
+            if not params.get(key):
+                params.pop(key, None)
+        return params
+
+    def _compare_container(self):
         container = self.check_container()
         failures = []
 
@@ -78,12 +458,7 @@ class ContainerWorker(ABC):
                 failures.append({'name': 'systemd_unit',
                                  'current': 'out_of_date',
                                  'desired': 'up_to_date'})
-
-        if failures:
-            self.changed = True
-            self.result['comparison_failures'] = failures
-
-        return self.changed
+        return failures
 
     def check_container_differs(self, container_info=None):
         """Return a list of dicts describing differences from the desired state
@@ -101,24 +476,31 @@ class ContainerWorker(ABC):
             return [{'name': 'container_info_missing',
                      'current': None, 'desired': None}]
 
-        checks = [
-            'cap_add',
-            'security_opt',
-            'image',
-            'ipc_mode',
-            'labels',
-            'privileged',
-            'pid_mode',
-            'cgroupns_mode',
-            'tmpfs',
-            'volumes',
-            'volumes_from',
-            'environment',
-            'container_state',
-            'dimensions',
-            'command',
-            'healthcheck',
-        ]
+        labels = container_info['Config'].get('Labels') or {}
+        fingerprint = labels.get(FINGERPRINT_LABEL)
+        if fingerprint and fingerprint == self.desired_fingerprint():
+            # NOTE: The container was created with the desired configuration,
+            # only its state can have changed since.
+            checks = ['container_state']
+        else:
+            checks = [
+                'cap_add',
+                'security_opt',
+                'image',
+                'ipc_mode',
+                'labels',
+                'privileged',
+                'pid_mode',
+                'cgroupns_mode',
+                'tmpfs',
+                'volumes',
+                'volumes_from',
+                'environment',
+                'container_state',
+                'dimensions',
+                'command',
+                'healthcheck',
+            ]
 
         failures = []
         for name in checks:
@@ -129,6 +511,31 @@ class ContainerWorker(ABC):
                                  'desired': diff[1]})
         return failures
 
+    def desired_fingerprint(self):
+        """Return a hash of the desired container configuration
+
+        It is stamped on containers as a label when they are created, so an
+        unchanged container is recognised without running every comparison.
+        """
+        image = self.check_image() or {}
+        spec = {key: self.params.get(key) for key in FINGERPRINT_PARAMS}
+        spec.update({
+            'image_id': image.get('Id'),
+            'environment': self._format_env_vars(),
+            'volumes': [vol for vol in self.params.get('volumes') or []
+                        if vol],
+        })
+        for key in ('cap_add', 'security_opt'):
+            spec[key] = sorted(spec[key] or [])
+        data = json.dumps(spec, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def fingerprint_labels(self, labels):
+        """Return labels with the desired fingerprint added"""
+        labels = dict(labels or {})
+        labels[FINGERPRINT_LABEL] = self.desired_fingerprint()
+        return labels
+
     # ------------------------------------------------------------------
     # diff_* methods: return (current, desired) for each comparison.
     # These are only called when the corresponding compare_* has already
@@ -159,7 +566,8 @@ class ContainerWorker(ABC):
         return current, self.params.get('image')
 
     def diff_labels(self, container_info):
-        current = container_info['Config'].get('Labels', {})
+        current = dict(container_info['Config'].get('Labels') or {})
+        current.pop(FINGERPRINT_LABEL, None)
         desired = self.params.get('labels')
         return current, desired
 
@@ -316,7 +724,8 @@ class ContainerWorker(ABC):
 
     def compare_labels(self, container_info):
         new_labels = self.params.get('labels')
-        current_labels = container_info['Config'].get('Labels', dict())
+        current_labels = dict(container_info['Config'].get('Labels') or {})
+        current_labels.pop(FINGERPRINT_LABEL, None)
         image_labels = self.check_image().get('Labels', dict())
         for k, v in image_labels.items():
             if k in new_labels:
@@ -520,8 +929,8 @@ class ContainerWorker(ABC):
             if current_healthcheck:
                 return True
 
-    def parse_image(self):
-        full_image = self.params.get('image')
+    def parse_image(self, full_image=None):
+        full_image = full_image or self.params.get('image')
 
         if '/' in full_image:
             registry, image = full_image.split('/', 1)
@@ -534,9 +943,146 @@ class ContainerWorker(ABC):
             return full_image, 'latest'
 
     @abstractmethod
-    def pull_image(self):
+    def login(self):
         pass
 
+    @abstractmethod
+    def _request_pull(self, image):
+        """Pull a single image, without using the image caches
+
+        Returns a tuple of the pull statistics and the error reported by the
+        engine, which is None if the pull succeeded.
+        """
+        pass
+
+    @abstractmethod
+    def _image_id(self, image):
+        """Return the ID of an image, None if it is not present"""
+        pass
+
+    @abstractmethod
+    def _forget_images(self):
+        """Drop the images from the snapshot and the index"""
+        pass
+
+    @abstractmethod
+    def _pull_error(self, image, error, image_id):
+        """Return the error message of a pull, None if it succeeded
+
+        :param error: error reported by the engine, None if there was none
+        :param image_id: ID of the image after the pull
+        """
+        pass
+
+    def _pull_result(self, image, old_image_id, stats, error):
+        image_id = None if error else self._image_id(image)
+        error = self._pull_error(image, error, image_id)
+        if error:
+            return False, stats, error
+        return old_image_id != image_id, stats, None
+
+    def _pull(self, image):
+        """Pull a single image
+
+        Returns a tuple of whether the image changed, the pull statistics
+        and an error message, which is None if the pull succeeded.
+        """
+        old_image_id = self._image_id(image)
+        try:
+            stats, error = self._request_pull(image)
+        finally:
+            self._forget_images()
+        return self._pull_result(image, old_image_id, stats, error)
+
+    def pull_image(self):
+        self.login()
+        changed, stats, error = self._pull(self.params.get('image'))
+        self.result['pull_stats'] = stats
+        if error:
+            self.module.fail_json(msg=error, failed=True)
+            return
+        self.changed = changed
+
+    def pull_images(self):
+        """Pull several images concurrently
+
+        Duplicate references are pulled once. Each image is retried on
+        failure, including errors raised by the engine API, up to
+        ``pull_retries`` times, and at most ``pull_concurrency`` images are
+        pulled at a time.
+
+        The pulls do not use the image caches, which are not thread safe.
+        Image IDs are looked up once before and once after all the pulls.
+        """
+        images = list(dict.fromkeys(self.params.get('images')))
+        concurrency = self.params.get('pull_concurrency')
+        retries = self.params.get('pull_retries')
+        delay = self.params.get('pull_retry_delay')
+        if concurrency < 1 or retries < 0:
+            self.module.fail_json(
+                msg="pull_concurrency must be at least 1 and pull_retries "
+                    "at least 0")
+            return self.changed
+
+        def pull(image):
+            for attempt in range(retries + 1):
+                if attempt:
+                    time.sleep(delay)
+                try:
+                    stats, error = self._request_pull(image)
+                except Exception as e:
+                    # NOTE: Such as connection errors, which only fail the
+                    # image, like an error in the pull stream.
+                    stats, error = None, str(e) or repr(e)
+                if not error:
+                    break
+            return stats, error
+
+        if not images:
+            return self.changed
+        self.login()
+        old_image_ids = {image: self._image_id(image) for image in images}
+        workers = min(concurrency, len(images))
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pulls = dict(zip(images, executor.map(pull, images)))
+        finally:
+            self._forget_images()
+        results = {
+            image: self._pull_result(image, old_image_ids[image], stats,
+                                     error)
+            for image, (stats, error) in pulls.items()}
+
+        self.result['pull_stats'] = {
+            image: stats for image, (_, stats, _) in results.items()}
+        self.result['changed_images'] = [
+            image for image, (changed, _, _) in results.items() if changed]
+        self.changed = bool(self.result['changed_images'])
+        failed = {image: error for image, (_, _, error) in results.items()
+                  if error}
+        if failed:
+            self.module.fail_json(
+                changed=self.changed,
+                msg="Failed to pull images: {}".format(', '.join(failed)),
+                failed_images=failed,
+                **self.result)
+        return self.changed
+
+    def consume_pull_stream(self, stream):
+        """Follow the progress stream of an image pull
+
+        Stops at the first error status. Returns the error message, None if
+        there was none, and the pull statistics.
+        """
+        progress = PullProgress()
+        error = None
+        for status in stream:
+            if 'error' in status:
+                error = status['error']
+                break
+            progress.update(status)
+        return error, progress.report()
+
     @abstractmethod
     def remove_container(self):
         pass
@@ -13,17 +13,129 @@
 # limitations under the License.
 
 import docker
-import json
 import os
+import re
 
 from ansible.module_utils.kolla_container_worker import COMPARE_CONFIG_CMD
 from ansible.module_utils.kolla_container_worker import ContainerWorker
+from ansible.module_utils.kolla_container_worker import EngineIndex
+from ansible.module_utils.kolla_container_worker import InspectionSnapshot
+from ansible.module_utils.kolla_container_worker import STATE_DIR
+from ansible.module_utils.kolla_host_agent import AgentClient
+from ansible.module_utils.kolla_host_agent import AgentError
 
 
 def get_docker_client():
     return docker.APIClient
 
 
+class DockerSnapshot(InspectionSnapshot):
+
+    def __init__(self, worker):
+        super().__init__(worker)
+        # NOTE: The agent learns about changes from the engine events, which
+        # may lag behind changes made by this module run, so containers are
+        # looked up directly once the run changed any.
+        self.use_agent = True
+
+    def _query_agent(self, query, **args):
+        """Query the host agent, raises AgentError if it cannot be used"""
+        if not (self.use_agent and self.worker.agent):
+            raise AgentError('Host agent not used')
+        try:
+            return self.worker.agent.call(query, **args)
+        except AgentError:
+            self.use_agent = False
+            raise
+
+    def forget_container(self, name, removed=False):
+        self.use_agent = False
+        super().forget_container(name, removed)
+
+    def _fetch_container(self, name):
+        try:
+            return self._query_agent('lookup', section='containers', key=name)
+        except AgentError:
+            pass
+
+        # NOTE: The name filter is a regular expression matched by the engine
+        # so anchor it to avoid listing containers which only share a prefix.
+        # The exact match is still checked here in case the engine does not
+        # support anchors.
+        find_name = '/{}'.format(name)
+        filters = {'name': '^{}$'.format(re.escape(name))}
+        for cont in self._call(self.worker.dc.containers, all=True,
+                               filters=filters):
+            if find_name in cont['Names']:
+                return cont
+
+    def load_containers(self, names):
+        # NOTE: One unfiltered listing is cheaper than a filtered one per
+        # container once more than a couple of containers are compared.
+        wanted = set(names) - set(self._containers)
+        if len(wanted) < 2:
+            return super().load_containers(wanted)
+        found = dict.fromkeys(wanted)
+        for cont in self._call(self.worker.dc.containers, all=True):
+            for cont_name in cont['Names']:
+                if cont_name.lstrip('/') in found:
+                    found[cont_name.lstrip('/')] = cont
+        self._containers.update(found)
+
+    def _fetch_container_info(self, name):
+        try:
+            return self._query_agent('inspect_container', name=name)
+        except AgentError:
+            pass
+        return self._call(self.worker.dc.inspect_container, name)
+
+    def _fetch_image(self, image):
+        return self.worker.index.lookup('images', image)
+
+
+class DockerIndex(EngineIndex):
+
+    def __init__(self, worker, path):
+        super().__init__(worker, path)
+        # Sections served by the host agent, see DockerSnapshot.use_agent.
+        self.agent_sections = set(self.sections)
+
+    def lookup(self, section, key):
+        if self.worker.agent and section in self.agent_sections:
+            try:
+                return self.worker.agent.call('lookup', section=section,
+                                              key=key)
+            except AgentError:
+                self.agent_sections.clear()
+        return super().lookup(section, key)
+
+    def update(self, section, key, value=None):
+        self.agent_sections.discard(section)
+        super().update(section, key, value)
+
+    def invalidate(self, section):
+        self.agent_sections.discard(section)
+        super().invalidate(section)
+
+    def _list(self, section):
+        call = self.worker.snapshot._call
+        if section == 'images':
+            images = dict()
+            for image in call(self.worker.dc.images):
+                for repo_tag in image.get('RepoTags') or list():
+                    images[repo_tag] = image
+            return images
+        return {vol['Name']: vol
+                for vol in call(self.worker.dc.volumes)['Volumes'] or list()}
+
+    def _changed_sections(self, since, until):
+        events = self.worker.snapshot._call(
+            self.worker.dc.events, since=since, until=until,
+            filters={'type': ['image', 'volume']}, decode=True)
+        return set('images' if event.get('Type') == 'image' else 'volumes'
+                   for event in events)
+
+
 class DockerWorker(ContainerWorker):
 
     def __init__(self, module):
@@ -35,6 +147,10 @@ class DockerWorker(ContainerWorker):
         }
 
         self.dc = get_docker_client()(**options)
+        self.agent = AgentClient.connect()
+        self.snapshot = DockerSnapshot(self)
+        self.index = DockerIndex(self, os.path.join(STATE_DIR,
+                                                    'docker_index.json'))
 
         self._dimensions_kernel_memory_removed = True
         self.dimension_map.pop('kernel_memory', None)
@@ -69,31 +185,20 @@ class DockerWorker(ContainerWorker):
             )
 
     def check_image(self):
-        find_image = ':'.join(self.parse_image())
-        for image in self.dc.images():
-            repo_tags = image.get('RepoTags')
-            if not repo_tags:
-                continue
-            for image_name in repo_tags:
-                if image_name == find_image:
-                    return image
+        return self.snapshot.image(':'.join(self.parse_image()))
 
-    def check_volume(self):
-        for vol in self.dc.volumes()['Volumes'] or list():
-            if vol['Name'] == self.params.get('name'):
-                return vol
+    def check_volume(self, name=None):
+        volume_name = name if name else self.params.get('name')
+        return self.index.lookup('volumes', volume_name)
 
     def check_container(self):
-        find_name = '/{}'.format(self.params.get('name'))
-        for cont in self.dc.containers(all=True):
-            if find_name in cont['Names']:
-                return cont
+        return self.snapshot.container(self.params.get('name'))
 
     def get_container_info(self):
         container = self.check_container()
         if not container:
             return None
-        return self.dc.inspect_container(self.params.get('name'))
+        return self.snapshot.container_info(self.params.get('name'))
 
     def compare_pid_mode(self, container_info):
         new_pid_mode = self.params.get('pid_mode')
@@ -143,10 +248,10 @@ class DockerWorker(ContainerWorker):
         if set(new_binds).symmetric_difference(set(current_binds)):
             return True
 
-    def compare_config(self):
+    def _check_config(self, name):
         try:
             job = self.dc.exec_create(
-                self.params['name'],
+                name,
                 COMPARE_CONFIG_CMD,
                 user='root',
             )
@@ -158,8 +263,7 @@ class DockerWorker(ContainerWorker):
             # in the mean time) - assume config is stale = return True.
             # Else, propagate the server error back.
             if e.is_client_error():
-                self._config_diff = 'container unavailable for config check'
-                return True
+                return True, 'container unavailable for config check'
             else:
                 raise
         # Exit codes:
@@ -168,17 +272,15 @@ class DockerWorker(ContainerWorker):
         # 137: abrupt exit -> changed
         # else: error
         if exec_inspect['ExitCode'] == 0:
-            return False
+            return False, None
         elif exec_inspect['ExitCode'] == 1:
-            self._config_diff = (output.decode('utf-8') if
-                                 isinstance(output, bytes) else output)
-            return True
+            return True, (output.decode('utf-8') if
+                          isinstance(output, bytes) else output)
         elif exec_inspect['ExitCode'] == 137:
             # NOTE(yoctozepto): This is Docker's command exit due to container
             # exit. It means the container is unstable so we are better off
             # marking it as requiring a restart due to config update.
-            self._config_diff = 'container exited abruptly during config check'
-            return True
+            return True, 'container exited abruptly during config check'
         else:
             raise Exception('Failed to compare container configuration: '
                             'ExitCode: %s Message: %s' %
@@ -192,13 +294,11 @@ class DockerWorker(ContainerWorker):
 
         return super().dimensions_differ(a, b, key)
 
-    def get_image_id(self):
-        full_image = self.params.get('image')
+    def get_image_id(self, image=None):
+        image = self.index.lookup('images', ':'.join(self.parse_image(image)))
+        return image['Id'] if image else None
 
-        image = self.dc.images(name=full_image, quiet=True)
-        return image[0] if len(image) == 1 else None
-
-    def pull_image(self):
+    def login(self):
         if self.params.get('auth_username'):
             self.dc.login(
                 username=self.params.get('auth_username'),
@@ -207,32 +307,26 @@ class DockerWorker(ContainerWorker):
                 email=self.params.get('auth_email')
             )
 
-        image, tag = self.parse_image()
-        old_image_id = self.get_image_id()
+    def _request_pull(self, full_image):
+        image, tag = self.parse_image(full_image)
+        error, stats = self.consume_pull_stream(self.dc.pull(
+            repository=image, tag=tag, stream=True, decode=True))
+        return stats, error
 
-        statuses = [
-            json.loads(line.strip().decode('utf-8')) for line in self.dc.pull(
-                repository=image, tag=tag, stream=True
-            )
-        ]
+    def _image_id(self, image):
+        return self.get_image_id(image)
 
-        for status in reversed(statuses):
-            if 'error' in status:
-                if status['error'].endswith('not found'):
-                    self.module.fail_json(
-                        msg="The requested image does not exist: {}:{}".format(
-                            image, tag),
-                        failed=True
-                    )
-                else:
-                    self.module.fail_json(
-                        msg="Unknown error message: {}".format(
-                            status['error']),
-                        failed=True
-                    )
+    def _forget_images(self):
+        self.snapshot.forget_images()
+        self.index.invalidate('images')
 
-        new_image_id = self.get_image_id()
-        self.changed = old_image_id != new_image_id
+    def _pull_error(self, full_image, error, image_id):
+        if not error:
+            return None
+        if error.endswith('not found'):
+            return "The requested image does not exist: {}:{}".format(
+                *self.parse_image(full_image))
+        return "Unknown error message: {}".format(error)
 
     def remove_container(self):
         self.changed |= self.systemd.remove_unit_file()
@@ -247,8 +341,11 @@ class DockerWorker(ContainerWorker):
                     container=self.params.get('name'),
                     force=True
                 )
+                self.snapshot.forget_container(self.params.get('name'),
+                                               removed=True)
                 self.systemd.remove_unit_file()
             except docker.errors.APIError:
+                self.snapshot.forget_container(self.params.get('name'))
                 if self.check_container():
                     raise
 
@@ -349,6 +446,7 @@ class DockerWorker(ContainerWorker):
         self.create_container_volumes()
 
         options = self.build_container_options()
+        options['labels'] = self.fingerprint_labels(options['labels'])
         self.dc.create_container(**options)
         if self.params.get('restart_policy') != 'oneshot':
             self.changed |= self.systemd.create_unit_file()
@@ -389,10 +487,12 @@ class DockerWorker(ContainerWorker):
 
         if not container:
             self.create_container()
+            self.snapshot.forget_container(self.params.get('name'))
             container = self.check_container()
 
         if not container['Status'].startswith('Up '):
             self.changed = True
+            self.snapshot.forget_container(self.params.get('name'))
             if self.params.get('restart_policy') == 'oneshot':
                 self.dc.start(container=self.params.get('name'))
             else:
@@ -440,6 +540,7 @@ class DockerWorker(ContainerWorker):
                     msg="No such container: {} to stop".format(name))
         elif not container['Status'].startswith('Exited '):
             self.changed = True
+            self.snapshot.forget_container(name)
             if not self.systemd.check_unit_file():
                 self.dc.stop(name, timeout=graceful_timeout)
             else:
@@ -462,6 +563,7 @@ class DockerWorker(ContainerWorker):
                 msg="No such container: {}".format(name))
         else:
             self.changed = True
+            self.snapshot.forget_container(name)
             if self.params.get('restart_policy') != 'oneshot':
                 self.systemd.create_unit_file()
                 if not self.systemd.restart():
@@ -475,10 +577,11 @@ class DockerWorker(ContainerWorker):
 
     def create_volume(self, name=None):
         volume_name = name if name else self.params.get('name')
-        if not self.check_volume():
+        if not self.check_volume(name=volume_name):
             self.changed = True
-            self.dc.create_volume(name=volume_name, driver='local',
-                                  labels={'kolla_managed': 'true'})
+            volume = self.dc.create_volume(name=volume_name, driver='local',
+                                           labels={'kolla_managed': 'true'})
+            self.index.update('volumes', volume_name, volume)
 
     def create_container_volumes(self):
         volumes = self.params.get('volumes')
@@ -496,6 +599,7 @@ class DockerWorker(ContainerWorker):
     def remove_volume(self):
         if self.check_volume():
             self.changed = True
+            self.index.invalidate('volumes')
             try:
                 self.dc.remove_volume(name=self.params.get('name'))
             except docker.errors.APIError as e:
@@ -511,6 +615,8 @@ class DockerWorker(ContainerWorker):
     def remove_image(self):
         if self.check_image():
             self.changed = True
+            self.snapshot.forget_images()
+            self.index.invalidate('images')
             try:
                 self.dc.remove_image(image=self.params.get('image'))
             except docker.errors.APIError as e:
@@ -0,0 +1,285 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resident host agent serving cached Docker engine state
+
+The agent keeps a single connection to the Docker engine and answers
+container, image and volume lookups over a local unix socket. Its state is
+kept current from the engine event stream, so a lookup does not reach the
+engine unless something changed since the last one. Each request carries the
+time it was made at, and the agent applies the engine events up to then
+before answering, so an answer reflects every change made before the
+request even when the event stream has not delivered it yet.
+
+Modules use AgentClient.connect(), which returns None when no agent is
+running, and fall back to querying the engine directly in that case.
+
+Run the agent with::
+
+    python3 kolla_host_agent.py [--socket PATH]
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+AGENT_SOCKET = '/run/kolla/host-agent.sock'
+LOG = logging.getLogger(__name__)
+
+# NOTE: Container events which do not change anything the agent serves. Exec
+# events are emitted for every healthcheck run.
+IGNORED_CONTAINER_EVENTS = ('exec_create', 'exec_start', 'exec_die',
+                            'exec_detach', 'top')
+
+
+class AgentError(Exception):
+    pass
+
+
+class AgentClient(object):
+    """Client for the host agent, one request per connection"""
+
+    def __init__(self, path=AGENT_SOCKET, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        # Number of requests answered by the agent.
+        self.calls = 0
+
+    @classmethod
+    def connect(cls, path=AGENT_SOCKET):
+        """Return a client if an agent is listening, None otherwise"""
+        if not os.path.exists(path):
+            return None
+        client = cls(path)
+        try:
+            client.call('ping')
+        except AgentError:
+            return None
+        return client
+
+    def call(self, query, **args):
+        request = json.dumps({'query': query, 'args': args,
+                              'until': time.time()}) + '\n'
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(request.encode('utf-8'))
+                with sock.makefile('rb') as f:
+                    response = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            raise AgentError('Host agent unavailable: {}'.format(e))
+        if 'error' in response:
+            raise AgentError(response['error'])
+        self.calls += 1
+        return response['result']
+
+
+class EngineState(object):
+    """Docker engine state kept current from the event stream
+
+    Each section is listed from the engine when first needed and again
+    after an event shows it changed. Container inspection results are
+    cached per container and dropped on events for that container.
+    """
+
+    sections = ('containers', 'images', 'volumes')
+
+    def __init__(self, client):
+        self.dc = client
+        self.lock = threading.Lock()
+        self.data = dict.fromkeys(self.sections)
+        self.inspected = {}
+        # Time up to which engine events have been applied by sync().
+        self.synced = time.time()
+        self.sync_lock = threading.Lock()
+        # Time up to which engine events have been applied by watch().
+        self.watched = 0
+        # Number of engine API calls made, for diagnostics.
+        self.api_calls = 0
+
+    def _call(self, func, *args, **kwargs):
+        self.api_calls += 1
+        return func(*args, **kwargs)
+
+    def _list(self, section):
+        if section == 'containers':
+            containers = {}
+            for cont in self._call(self.dc.containers, all=True):
+                for name in cont['Names']:
+                    containers[name.lstrip('/')] = cont
+            return containers
+        if section == 'images':
+            images = {}
+            for image in self._call(self.dc.images):
+                for repo_tag in image.get('RepoTags') or []:
+                    images[repo_tag] = image
+            return images
+        return {vol['Name']: vol
+                for vol in self._call(self.dc.volumes)['Volumes'] or []}
+
+    def lookup(self, section, key):
+        return self.list(section).get(key)
+
+    def list(self, section):
+        with self.lock:
+            if self.data[section] is None:
+                self.data[section] = self._list(section)
+            return self.data[section]
+
+    def inspect_container(self, name):
+        with self.lock:
+            if name not in self.inspected:
+                self.inspected[name] = self._call(self.dc.inspect_container,
+                                                  name)
+            return self.inspected[name]
+
+    def invalidate(self, section=None):
+        with self.lock:
+            if section:
+                self.data[section] = None
+            else:
+                self.data = dict.fromkeys(self.sections)
+                self.inspected.clear()
+
+    def applied(self):
+        """Time up to which engine events have been applied"""
+        return max(self.synced, self.watched)
+
+    def sync(self, until):
+        """Apply the engine events up to until
+
+        The event stream delivers events asynchronously, so a request made
+        right after a change may arrive before the event of that change.
+        Nothing is read when the watcher has already applied events past
+        until. Otherwise the events it has not applied yet are read again
+        up to now, so that requests waiting for this sync do not need their
+        own. Applying an event twice is harmless.
+        """
+        if until <= self.applied():
+            return
+        with self.sync_lock:
+            since = self.applied()
+            if until <= since:
+                return
+            until = max(until, time.time())
+            for event in self._call(self.dc.events, since=since,
+                                    until=until, decode=True):
+                self.handle_event(event)
+            self.synced = until
+
+    def handle_event(self, event):
+        event_type = event.get('Type')
+        action = event.get('Action', '')
+        with self.lock:
+            if event_type == 'container':
+                if action.split(':')[0] in IGNORED_CONTAINER_EVENTS:
+                    return
+                name = event.get('Actor', {}).get('Attributes', {}).get('name')
+                self.inspected.pop(name, None)
+                # NOTE: The listed Status includes the health too.
+                self.data['containers'] = None
+            elif event_type == 'image':
+                self.data['images'] = None
+            elif event_type == 'volume':
+                self.data['volumes'] = None
+
+    def follow(self):
+        """Apply the engine events until the event stream ends"""
+        connected = time.time()
+        events = self.dc.events(decode=True)
+        # NOTE: Anything may have changed while not watching.
+        self.invalidate()
+        self.watched = connected
+        for event in events:
+            self.handle_event(event)
+            # NOTE: The stream delivers events in order, so those up to
+            # this one have all been applied.
+            if 'timeNano' in event:
+                self.watched = event['timeNano'] / 1e9
+            elif 'time' in event:
+                self.watched = event['time']
+
+    def watch(self):
+        """Follow the engine event stream, never returns"""
+        while True:
+            try:
+                self.follow()
+            except Exception as e:
+                LOG.warning('Engine event stream failed: %s', e)
+            time.sleep(1)
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        state = self.server.state
+        try:
+            request = json.loads(self.rfile.readline())
+            query = request['query']
+            args = request.get('args') or {}
+            if query != 'ping' and request.get('until'):
+                state.sync(request['until'])
+            if query == 'ping':
+                result = 'pong'
+            elif query == 'list':
+                result = state.list(args['section'])
+            elif query == 'lookup':
+                result = state.lookup(args['section'], args['key'])
+            elif query == 'inspect_container':
+                result = state.inspect_container(args['name'])
+            else:
+                raise AgentError('Unknown query: {}'.format(query))
+            response = {'result': result}
+        except Exception as e:
+            response = {'error': '{}: {}'.format(type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class AgentServer(socketserver.ThreadingMixIn,
+                  socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, state):
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        super().__init__(path, AgentRequestHandler)
+        os.chmod(path, 0o600)
+        self.state = state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=AGENT_SOCKET,
+                        help='Path of the unix socket to listen on')
+    parser.add_argument('--docker-url', default='unix://var/run/docker.sock',
+                        help='URL of the Docker engine API')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    import docker
+    state = EngineState(docker.APIClient(base_url=args.docker_url,
+                                         version='auto'))
+    watcher = threading.Thread(target=state.watch, daemon=True)
+    watcher.start()
+    with AgentServer(args.socket, state) as server:
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
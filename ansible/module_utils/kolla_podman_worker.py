@@ -11,13 +11,17 @@
 # limitations under the License.
 
 from podman.errors import APIError
+from podman.errors import NotFound
 from podman import PodmanClient
 
+import base64
+import json
 import os
 import shlex
 
 from ansible.module_utils.kolla_container_worker import COMPARE_CONFIG_CMD
 from ansible.module_utils.kolla_container_worker import ContainerWorker
+from ansible.module_utils.kolla_container_worker import InspectionSnapshot
 
 uri = "http+unix:/run/podman/podman.sock"
 
@@ -66,12 +70,45 @@ CONTAINER_PARAMS = [
 ]
 
 
+class PodmanSnapshot(InspectionSnapshot):
+
+    def _fetch_container(self, name):
+        try:
+            cont = self._call(self.worker.pc.containers.get, name)
+        except NotFound:
+            return None
+        # NOTE: Podman falls back to resolving the key as an ID prefix, so
+        # only accept the container if its name is an exact match.
+        if cont.name == name:
+            return cont
+
+    def _fetch_container_info(self, name):
+        # NOTE: containers.get() inspects the container, so its attrs already
+        # hold the full inspect output.
+        return self.container(name).attrs
+
+    def _fetch_image(self, image):
+        try:
+            return self._call(self.worker.pc.images.get, image).attrs
+        except APIError as e:
+            if e.status_code == 404:
+                return {}
+            else:
+                self.worker.module.fail_json(
+                    failed=True,
+                    msg="Internal error: {}".format(
+                        e.explanation
+                    )
+                )
+
+
 class PodmanWorker(ContainerWorker):
 
     def __init__(self, module) -> None:
         super().__init__(module)
 
         self.pc = PodmanClient(base_url=uri)
+        self.snapshot = PodmanSnapshot(self)
 
     def prepare_container_args(self):
         args = dict(
@@ -241,14 +278,13 @@ class PodmanWorker(ContainerWorker):
 
         return hc
 
-    def prepare_image_args(self):
-        image, tag = self.parse_image()
+    def prepare_image_args(self, full_image=None):
+        image, tag = self.parse_image(full_image)
 
         args = dict(
             repository=image,
             tag=tag,
-            tls_verify=self.params.get('tls_verify', False),
-            stream=False
+            tls_verify=self.params.get('tls_verify', False)
         )
 
         if self.params.get('auth_username', False):
@@ -261,20 +297,8 @@ class PodmanWorker(ContainerWorker):
             args['image'] = self.params['auth_registry'] + '/' + image
         return args
 
-    def check_image(self):
-        try:
-            image = self.pc.images.get(self.params.get('image'))
-            return image.attrs
-        except APIError as e:
-            if e.status_code == 404:
-                return {}
-            else:
-                self.module.fail_json(
-                    failed=True,
-                    msg="Internal error: {}".format(
-                        e.explanation
-                    )
-                )
+    def check_image(self, image=None):
+        return self.snapshot.image(image or self.params.get('image'))
 
     def check_volume(self, name=None):
         volume_name = name if name else self.params.get('name')
@@ -286,11 +310,7 @@ class PodmanWorker(ContainerWorker):
                 return {}
 
     def check_container(self):
-        name = self.params.get("name")
-        for cont in self.pc.containers.list(all=True):
-            cont.reload()
-            if name == cont.name:
-                return cont
+        return self.snapshot.container(self.params.get('name'))
 
     def get_container_info(self):
         container = self.check_container()
@@ -513,13 +533,13 @@ class PodmanWorker(ContainerWorker):
                 # supported resources are '' or 0 - both falsey.
                 return True
 
-    def compare_config(self):
+    def _check_config(self, name):
         try:
-            container = self.pc.containers.get(self.params['name'])
-            container.reload()
+            container = self.snapshot.container(name)
+            if not container:
+                return True, 'container unavailable for config check'
             if container.status != 'running':
-                self._config_diff = 'container not running during config check'
-                return True
+                return True, 'container not running during config check'
 
             rc, raw_output = container.exec_run(COMPARE_CONFIG_CMD,
                                                 user='root')
@@ -528,8 +548,7 @@ class PodmanWorker(ContainerWorker):
         # expect that config is stale so we return True and recreate container
         except APIError as e:
             if e.is_client_error():
-                self._config_diff = 'container unavailable for config check'
-                return True
+                return True, 'container unavailable for config check'
             else:
                 raise
         # Exit codes:
@@ -537,40 +556,67 @@ class PodmanWorker(ContainerWorker):
         # 1: changed
         # else: error
         if rc == 0:
-            return False
+            return False, None
         elif rc == 1:
             try:
-                self._config_diff = (raw_output.decode('utf-8') if
-                                     isinstance(raw_output, bytes) else
-                                     raw_output)
+                return True, (raw_output.decode('utf-8') if
+                              isinstance(raw_output, bytes) else raw_output)
             except UnicodeDecodeError:
-                self._config_diff = 'container changed during config check'
-            return True
+                return True, 'container changed during config check'
         else:
             raise Exception('Failed to compare container configuration: '
                             'ExitCode: %s Message: %s' %
                             (rc, raw_output.decode('utf-8')))
 
-    def pull_image(self):
-        args = self.prepare_image_args()
-        old_image = self.check_image()
-
+    def _pull_stream(self, args):
+        """Start an image pull and return its progress stream
+
+        The pull is requested in compat mode, in which Podman reports the
+        progress of each layer in the same format as Docker. The client
+        only uses that mode to draw a progress bar, so call the API directly.
+        """
+        headers = {}
+        if args.get('auth_config'):
+            headers['X-Registry-Auth'] = base64.urlsafe_b64encode(
+                json.dumps(args['auth_config']).encode('utf-8'))
+        params = {
+            'reference': '{}:{}'.format(args['repository'], args['tag']),
+            'tlsVerify': args['tls_verify'],
+            'compatMode': True,
+        }
+        response = self.pc.api.post('/images/pull', params=params,
+                                    headers=headers, stream=True)
+        response.raise_for_status()
+        return (json.loads(line) for line in response.iter_lines() if line)
+
+    def login(self):
+        # NOTE: Credentials are passed with each pull request instead.
+        pass
+
+    def _request_pull(self, full_image):
+        args = self.prepare_image_args(full_image)
         try:
-            image = self.pc.images.pull(**args)
-
-            if image.attrs == {}:
-                self.module.fail_json(
-                    msg="The requested image does not exist: {}".format(
-                        self.params['image']),
-                    failed=True
-                )
-            self.changed = old_image != image.attrs
+            error, stats = self.consume_pull_stream(self._pull_stream(args))
+        except NotFound:
+            error, stats = 'not found', None
         except APIError as e:
-            self.module.fail_json(
-                msg="Unknown error message: {}".format(
-                    str(e)),
-                failed=True
-            )
+            error, stats = str(e), None
+        return stats, error
+
+    def _image_id(self, image):
+        return (self.check_image(image) or {}).get('Id')
+
+    def _forget_images(self):
+        self.snapshot.forget_images()
+
+    def _pull_error(self, full_image, error, image_id):
+        if not image_id and (not error or error.endswith('not found') or
+                             'manifest unknown' in error):
+            return "The requested image does not exist: {}".format(
+                full_image)
+        if error:
+            return "Unknown error message: {}".format(error)
+        return None
 
     def remove_container(self):
         self.changed |= self.systemd.remove_unit_file()
@@ -578,7 +624,10 @@ class PodmanWorker(ContainerWorker):
         if container:
             try:
                 container.remove(force=True)
+                self.snapshot.forget_container(self.params.get('name'),
+                                               removed=True)
             except APIError:
+                self.snapshot.forget_container(self.params.get('name'))
                 if self.check_container():
                     raise
 
@@ -598,7 +647,11 @@ class PodmanWorker(ContainerWorker):
         self.create_container_volumes()
         self.create_missing_bind_directories()
 
+        # NOTE: prepare_container_args() consumes some of the parameters, so
+        # the fingerprint has to be taken first.
+        labels = self.fingerprint_labels(self.params.get('labels'))
         args = self.prepare_container_args()
+        args['labels'] = labels
         container = self.pc.containers.create(**args)
         if container.attrs == {}:
             data = container.to_dict()
@@ -637,10 +690,12 @@ class PodmanWorker(ContainerWorker):
 
         if not container:
             self.create_container()
+            self.snapshot.forget_container(self.params.get('name'))
             container = self.check_container()
 
         if container.status != 'running':
             self.changed = True
+            self.snapshot.forget_container(self.params.get('name'))
             if self.params.get('restart_policy') == 'oneshot':
                 container = self.check_container()
                 container.start()
@@ -689,6 +744,7 @@ class PodmanWorker(ContainerWorker):
         elif not (container.status == 'exited' or
                   container.status == 'stopped'):
             self.changed = True
+            self.snapshot.forget_container(name)
             if self.params.get('restart_policy') != 'oneshot':
                 self.systemd.create_unit_file()
                 self.systemd.stop()
@@ -711,6 +767,7 @@ class PodmanWorker(ContainerWorker):
             )
         else:
             self.changed = True
+            self.snapshot.forget_container(self.params.get('name'))
             self.systemd.create_unit_file()
 
             if not self.systemd.restart():
@@ -785,6 +842,7 @@ class PodmanWorker(ContainerWorker):
         if self.check_image():
             image = self.pc.images.get(self.params['image'])
             self.changed = True
+            self.snapshot.forget_images()
             try:
                 image.remove()
             except APIError as e:
@@ -40,6 +40,27 @@ WantedBy=multi-user.target
 '''
 
 
+def create_unit_files(workers):
+    """Write the unit files of several containers at once
+
+    systemd is reloaded once and the changed units are enabled in a single
+    call, rather than once per unit.
+
+    :param workers: SystemdWorker of each container
+    :returns: the workers whose unit file changed
+    """
+    changed = [worker for worker in workers if worker.write_unit_file()]
+    if changed:
+        changed[0].reload()
+        changed[0].perform_action(
+            'EnableUnitFiles',
+            [worker.container_dict['service_name'] for worker in changed],
+            False,
+            True
+        )
+    return changed
+
+
 class SystemdWorker(object):
     def __init__(self, params):
         name = params.get('name', None)
@@ -88,8 +109,8 @@ class SystemdWorker(object):
         self.template = Template(TEMPLATE)
 
     def get_manager(self):
-        sysbus = dbus.SystemBus()
-        systemd1 = sysbus.get_object(
+        self.bus = dbus.SystemBus()
+        systemd1 = self.bus.get_object(
             'org.freedesktop.systemd1',
             '/org/freedesktop/systemd1'
         )
@@ -170,7 +191,8 @@ class SystemdWorker(object):
     def generate_unit_file(self):
         return self.template.substitute(self.container_dict)
 
-    def create_unit_file(self):
+    def write_unit_file(self):
+        """Write the unit file if it changed, without reloading systemd"""
         file_content = self.generate_unit_file()
 
         if self.check_unit_change(file_content):
@@ -178,7 +200,12 @@ class SystemdWorker(object):
                 self.sysdir + self.container_dict['service_name'], 'w'
             ) as f:
                 f.write(file_content)
+            return True
+
+        return False
 
+    def create_unit_file(self):
+        if self.write_unit_file():
             self.reload()
             self.enable()
             return True
@@ -195,23 +222,32 @@ class SystemdWorker(object):
             return False
 
     def get_unit_state(self):
-        unit_list = self.manager.ListUnits()
-
-        for service in unit_list:
-            if str(service[0]) == self.container_dict['service_name']:
-                return str(service[4])
+        """Return the sub-state of the unit, None if it is not loaded"""
+        try:
+            path = self.manager.GetUnit(self.container_dict['service_name'])
+        except dbus.exceptions.DBusException:
+            return None
 
-        return None
+        unit = self.bus.get_object('org.freedesktop.systemd1', path)
+        properties = dbus.Interface(unit, 'org.freedesktop.DBus.Properties')
+        return str(properties.Get('org.freedesktop.systemd1.Unit',
+                                  'SubState'))
 
     def wait_for_unit(self, timeout, state='running'):
-        delay = 5
+        # NOTE: Waiting for PropertiesChanged signals needs a main loop, which
+        # the module does not run, so poll the unit with a short delay that
+        # grows up to one second instead.
+        delay = 0.1
         elapsed = 0
 
         while True:
-            if self.get_unit_state() == state:
+            current = self.get_unit_state()
+            # systemd unloads stopped units which nothing refers to.
+            if current == state or (current is None and state == 'dead'):
                 return True
-            elif elapsed > timeout:
+            elif elapsed >= timeout:
                 return False
             else:
                 sleep(delay)
                 elapsed += delay
+                delay = min(delay * 2, 1)
@@ -0,0 +1,326 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Resident task server for the kolla_toolbox container
+
+The server runs as the main process of the kolla_toolbox container and
+keeps Ansible, its collections and openstacksdk imported. It runs the
+modules requested by the kolla_toolbox module over a unix socket on the
+/run volume shared with the host, each request in a process forked from
+the server, so a module call does not pay for starting Python and
+importing them again.
+
+Requests and their module arguments travel over the socket only, never in
+argv. Modules with an action plugin need the controller side of Ansible
+and are left to ansible-runner, as are requests to run as another user
+than the one of the server.
+
+The kolla_toolbox module uses TaskClient.connect(), which returns None
+when no server is running, and falls back to ansible-runner in that case.
+
+Run the server with::
+
+    python3 kolla_toolbox_server.py [--socket PATH]
+"""
+
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import logging
+import os
+import pwd
+import socket
+import socketserver
+
+TASK_SERVER_SOCKET = '/run/kolla-toolbox/task-server.sock'
+LOG = logging.getLogger(__name__)
+
+
+class TaskServerError(Exception):
+    pass
+
+
+class TaskClient(object):
+    """Client for the task server, one request per connection"""
+
+    def __init__(self, path=TASK_SERVER_SOCKET, timeout=None):
+        self.path = path
+        self.timeout = timeout
+
+    @classmethod
+    def connect(cls, path=TASK_SERVER_SOCKET, timeout=None):
+        """Return a client if a server is listening, None otherwise"""
+        if not os.path.exists(path):
+            return None
+        client = cls(path, timeout)
+        try:
+            client.call('ping')
+        except TaskServerError:
+            return None
+        return client
+
+    def call(self, query, **args):
+        request = json.dumps({'query': query, 'args': args}) + '\n'
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall(request.encode('utf-8'))
+                with sock.makefile('rb') as f:
+                    response = json.loads(f.readline())
+        except (OSError, ValueError) as e:
+            raise TaskServerError('Task server unavailable: {}'.format(e))
+        if 'error' in response:
+            raise TaskServerError(response['error'])
+        return response['result']
+
+    def run(self, tasks, extra_vars=None, check_mode=False, diff=False,
+            user=None):
+        """Run the tasks in order, stopping at the first failure
+
+        Returns the results of the tasks run, each with the ansible-runner
+        event it corresponds to in _runner_status, or None when the server
+        cannot run these tasks and the caller should use ansible-runner.
+        """
+        return self.call('run', tasks=tasks, extra_vars=extra_vars or {},
+                         check_mode=check_mode, diff=diff, user=user)
+
+
+def _trust(data):
+    """Mark the strings of data as templates, as a playbook would"""
+    try:
+        from ansible.template import trust_as_template
+    except ImportError:
+        # NOTE: ansible-core before 2.19 templates any string.
+        return data
+    if isinstance(data, dict):
+        return {key: _trust(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_trust(value) for value in data]
+    if isinstance(data, str):
+        return trust_as_template(data)
+    return data
+
+
+def render_args(module_args, extra_vars):
+    """Template the module arguments with the extra vars"""
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.template import Templar
+
+    templar = Templar(loader=DataLoader(), variables=_trust(extra_vars))
+    return templar.template(_trust(module_args))
+
+
+def find_module(module_name):
+    """Return the path of a module, None if it has an action plugin"""
+    from ansible.plugins.loader import action_loader
+    from ansible.plugins.loader import module_loader
+
+    context = module_loader.find_plugin_with_context(module_name)
+    if not context.resolved:
+        raise TaskServerError('Module not found: {}'.format(module_name))
+    if action_loader.has_plugin(context.resolved_fqcn):
+        return None
+    return context.plugin_resolved_path
+
+
+@contextlib.contextmanager
+def _exit_handlers():
+    """Run the exit handlers registered in the block at its end
+
+    A request process ends with os._exit(), which skips exit handlers,
+    while openstacksdk stores the token of a connection in the Keystone
+    token cache in one.
+    """
+    handlers = []
+    register = atexit.register
+
+    def _register(func, *args, **kwargs):
+        handlers.append((func, args, kwargs))
+        return func
+
+    atexit.register = _register
+    try:
+        yield
+    finally:
+        atexit.register = register
+        for func, args, kwargs in reversed(handlers):
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                LOG.exception('Exit handler %s failed', func)
+
+
+def tokens_issued(path='~/.cache/kolla-auth/issued'):
+    """Return the tokens issued per the Keystone token cache, if in use"""
+    try:
+        with open(os.path.expanduser(path)) as f:
+            return int(f.read() or 0)
+    except OSError:
+        return None
+
+
+@contextlib.contextmanager
+def _module_args(args):
+    """Pass args to the AnsibleModule of a module run in this process
+
+    AnsibleModule loads its parameters from basic._ANSIBLE_ARGS when set,
+    which is how the AnsiballZ wrapper of Ansible passes them too.
+    """
+    from ansible.module_utils import basic
+
+    saved = basic._ANSIBLE_ARGS, getattr(basic, '_ANSIBLE_PROFILE', None)
+    basic._ANSIBLE_ARGS = json.dumps(
+        {'ANSIBLE_MODULE_ARGS': args}).encode('utf-8')
+    if hasattr(basic, '_ANSIBLE_PROFILE'):
+        # NOTE: ansible-core 2.19 and later also read the profile the
+        # parameters were serialized with, plain JSON is the legacy one.
+        basic._ANSIBLE_PROFILE = 'legacy'
+    try:
+        yield
+    finally:
+        basic._ANSIBLE_ARGS = saved[0]
+        if hasattr(basic, '_ANSIBLE_PROFILE'):
+            basic._ANSIBLE_PROFILE = saved[1]
+
+
+def run_module(path, module_args, check_mode, diff):
+    """Run a module in this process and return its result"""
+    from ansible.module_utils.json_utils import _filter_non_json_lines
+
+    args = dict(module_args,
+                _ansible_check_mode=check_mode,
+                _ansible_diff=diff)
+    with open(path, 'rb') as f:
+        code = compile(f.read(), path, 'exec')
+    # NOTE: Not runpy.run_path(), the path hook of the Ansible collection
+    # loader makes it take the module for a package.
+    stdout = io.StringIO()
+    namespace = {'__name__': '__main__', '__file__': path}
+    with _module_args(args), contextlib.redirect_stdout(stdout), \
+            _exit_handlers():
+        try:
+            # NOTE: path is a module installed in the container, found by
+            # find_module(), which Ansible would run the same.
+            exec(code, namespace)  # nosec B102
+        except SystemExit:
+            pass
+    try:
+        output, _ = _filter_non_json_lines(stdout.getvalue())
+        return json.loads(output)
+    except ValueError:
+        return {'failed': True,
+                'msg': 'Module returned no result',
+                'module_stdout': stdout.getvalue()}
+
+
+def run_tasks(tasks, extra_vars, check_mode, diff):
+    """Run tasks in order like a play, return None if any is unsupported"""
+    paths = [find_module(task['module_name']) for task in tasks]
+    if None in paths:
+        return None
+    results = []
+    for task, path in zip(tasks, paths):
+        module_args = render_args(task.get('module_args') or {}, extra_vars)
+        res = run_module(path, module_args, check_mode, diff)
+        if res.get('failed'):
+            res['_runner_status'] = 'runner_on_failed'
+        elif res.get('skipped'):
+            res['_runner_status'] = 'runner_on_skipped'
+        else:
+            res['_runner_status'] = 'runner_on_ok'
+        results.append(res)
+        if res.get('failed'):
+            break
+    issued = tokens_issued()
+    if issued is not None:
+        results[-1]['_auth_tokens_issued'] = issued
+    return results
+
+
+class TaskRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            query = request['query']
+            args = request.get('args') or {}
+            if query == 'ping':
+                result = 'pong'
+            elif query == 'run':
+                user = args.get('user')
+                if user and user != pwd.getpwuid(os.getuid()).pw_name:
+                    result = None
+                else:
+                    result = run_tasks(args['tasks'], args['extra_vars'],
+                                       args['check_mode'], args['diff'])
+            else:
+                raise TaskServerError('Unknown query: {}'.format(query))
+            response = {'result': result}
+        except Exception as e:
+            response = {'error': '{}: {}'.format(type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class TaskServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """Server handling each request in a forked process
+
+    Modules change the state of the process they run in, which must not
+    leak into the next request.
+    """
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        super().__init__(path, TaskRequestHandler)
+        os.chmod(path, 0o600)
+
+
+def preload():
+    """Import what the requests would import, to be shared by them"""
+    import ansible.module_utils.basic  # noqa: F401
+    import ansible.parsing.dataloader  # noqa: F401
+    import ansible.template  # noqa: F401
+    try:
+        from ansible.plugins.loader import init_plugin_loader
+    except ImportError:
+        # NOTE: ansible-core before 2.15.
+        from ansible.cli import CLI
+        CLI._configure_collection_loader()
+    else:
+        init_plugin_loader()
+    for name in ('openstack',
+                 'ansible_collections.openstack.cloud.plugins.module_utils.'
+                 'openstack'):
+        try:
+            __import__(name)
+        except ImportError as e:
+            LOG.info('Not preloading %s: %s', name, e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', default=TASK_SERVER_SOCKET,
+                        help='Path of the unix socket to listen on')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    preload()
+    with TaskServer(args.socket) as server:
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -232,11 +232,14 @@ def _get_vars_files(config_path: os.path) -> List[str]:
 def build_args(parsed_args,
                playbooks: list,
                extra_vars: dict = {},
-               verbose_level: int = None) -> Tuple[str, List[str]]:
+               verbose_level: int = None,
+               forks: int = None) -> Tuple[str, List[str]]:
     """Build arguments required for running Ansible playbooks."""
     args = list()
     if verbose_level:
         args += ["-" + "v" * verbose_level]
+    if forks:
+        args += ["--forks", str(forks)]
     if parsed_args.list_tasks:
         args += ["--list-tasks"]
     inventories = _get_inventory_paths(parsed_args)
@@ -283,7 +286,8 @@ def build_args(parsed_args,
 
 
 def run_playbooks(parsed_args, playbooks: list, extra_vars: dict = {},
-                  quiet: bool = False, verbose_level: int = 0) -> None:
+                  quiet: bool = False, verbose_level: int = 0,
+                  forks: int = None) -> None:
     """Run a Kolla Ansible playbook."""
     LOG.debug("Parsed arguments: %s" % parsed_args)
     _validate_args(parsed_args, playbooks)
@@ -292,6 +296,7 @@ def run_playbooks(parsed_args, playbooks: list, extra_vars: dict = {},
         playbooks,
         extra_vars=extra_vars,
         verbose_level=verbose_level,
+        forks=forks,
     )
 
     try:
@@ -10,6 +10,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import getpass
+import grp
+import os
 import sys
 
 from cliff.command import Command
@@ -36,6 +39,24 @@ def _choose_playbooks(parsed_args, kolla_playbook="site"):
     return playbooks
 
 
+def _render_to_vars(render_to):
+    """Return extra vars rendering the configuration on the controller
+
+    Every host is reached with the local connection and has its
+    configuration written to its own directory in render_to, as the user
+    running Kolla Ansible.
+    """
+    return {
+        "kolla_render_to": os.path.abspath(render_to),
+        "node_config_directory": "{{kolla_render_to}}/{{inventory_hostname}}",
+        "ansible_connection": "local",
+        "ansible_become": "false",
+        "ansible_python_interpreter": "{{ansible_playbook_python}}",
+        "config_owner_user": getpass.getuser(),
+        "config_owner_group": grp.getgrgid(os.getgid()).gr_name,
+    }
+
+
 class KollaAnsibleMixin:
     """Mixin class for commands running Kolla Ansible."""
 
@@ -128,16 +149,34 @@ class Prechecks(KollaAnsibleMixin, Command):
 class GenConfig(KollaAnsibleMixin, Command):
     """Generate configuration files for services. No container changes!"""
 
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        group = parser.add_argument_group("Genconfig action")
+        group.add_argument(
+            "--render-to",
+            metavar="DIR",
+            help="Render the configuration files of every host on this "
+            "host only, into DIR/<host>/<service>, without connecting to "
+            "the hosts. Requires their facts to be cached",
+        )
+        return parser
+
     def take_action(self, parsed_args):
         self.app.LOG.info(
             "Generate configuration files for enabled OpenStack services")
 
         extra_vars = {}
         extra_vars["kolla_action"] = "config"
+        forks = None
+        if parsed_args.render_to:
+            os.makedirs(parsed_args.render_to, exist_ok=True)
+            extra_vars.update(_render_to_vars(parsed_args.render_to))
+            forks = os.cpu_count()
 
         playbooks = _choose_playbooks(parsed_args)
 
-        self.run_playbooks(parsed_args, playbooks, extra_vars=extra_vars)
+        self.run_playbooks(parsed_args, playbooks, extra_vars=extra_vars,
+                           forks=forks)
 
 
 class Reconfigure(KollaAnsibleMixin, Command):
@@ -188,11 +227,25 @@ class BootstrapServers(KollaAnsibleMixin, Command):
 class Pull(KollaAnsibleMixin, Command):
     """Pull all images for containers. Only pulls, no container changes."""
 
+    def get_parser(self, prog_name):
+        parser = super().get_parser(prog_name)
+        group = parser.add_argument_group("Pull action")
+        group.add_argument(
+            "--image-distribution",
+            choices=["registry", "seed"],
+            help="Pull images on every host from the registry, or only on "
+                 "seed hosts which then copy them to the other hosts",
+        )
+        return parser
+
     def take_action(self, parsed_args):
         self.app.LOG.info("Pulling Docker images")
 
         extra_vars = {}
         extra_vars["kolla_action"] = "pull"
+        if parsed_args.image_distribution:
+            extra_vars["kolla_image_distribution"] = (
+                parsed_args.image_distribution)
 
         playbooks = _choose_playbooks(parsed_args)
 
@@ -29,6 +29,13 @@ BASE64_ENCODING = (string.ascii_uppercase + string.ascii_lowercase +
 BCRYPT_ENCODING = ('./' + string.ascii_uppercase + string.ascii_lowercase +
                    string.digits)
 
+# Service definition attributes which are kolla_container options.
+CONTAINER_SPEC_KEYS = (
+    'cap_add', 'cgroupns_mode', 'command', 'dimensions', 'environment',
+    'healthcheck', 'image', 'ipc_mode', 'labels', 'pid_mode', 'privileged',
+    'security_opt', 'tmpfs', 'volumes', 'volumes_from',
+)
+
 
 def _bcrypt_b64encode(s):
     b64_s = base64.b64encode(s)
@@ -127,6 +134,29 @@ def select_services_enabled_and_mapped_to_host(context, services):
             if service_enabled_and_mapped_to_host(context, service)}
 
 
+@jinja2.pass_context
+def extract_container_specs(context, services):
+    """Return kolla_container specs for the containers of services.
+
+    Services which are iterated are skipped, as their container names depend
+    on the iteration.
+
+    :param context: Jinja2 Context object.
+    :param services: Service definitions, dict.
+    :returns: A list of dicts, each with the container name and the
+              kolla_container options set in the service definition.
+    """
+    specs = []
+    for service in services.values():
+        if _call_bool_filter(context, service.get('iterate', False)):
+            continue
+        spec = {key: service[key]
+                for key in CONTAINER_SPEC_KEYS if key in service}
+        spec['name'] = service['container_name']
+        specs.append(spec)
+    return specs
+
+
 @jinja2.pass_context
 def bcrypt_hash(context, password, salt=None):
     """Provide bcrypt hash.
@@ -152,6 +182,7 @@ def bcrypt_hash(context, password, salt=None):
 def get_filters():
     return {
         "bcrypt_hash": bcrypt_hash,
+        "extract_container_specs": extract_container_specs,
         "extract_haproxy_services": extract_haproxy_services,
         "service_enabled": service_enabled,
         "service_mapped_to_host": service_mapped_to_host,
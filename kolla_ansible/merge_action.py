@@ -0,0 +1,78 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ansible.utils.hashing import checksum_s
+
+# Arguments of the merge_configs and merge_yaml action plugins an up to date
+# destination is known to satisfy, with any other the copy action always
+# runs. Each plugin adds its own arguments.
+UNCHANGED_ARGS = frozenset(('dest', 'mode', 'owner', 'group', 'sources'))
+
+
+def octal_mode(mode):
+    """Return a numeric file mode, None if it is symbolic or missing"""
+    if isinstance(mode, int):
+        return mode
+    if isinstance(mode, str) and mode.isdigit():
+        return int(mode, 8)
+    return None
+
+
+def attributes_match(args, stat):
+    """Whether a file has the mode, owner and group requested in args"""
+    if 'mode' in args:
+        mode = octal_mode(args['mode'])
+        if mode is None or mode != int(stat['mode'], 8):
+            return False
+    if 'owner' in args and str(args['owner']) not in (
+            stat.get('pw_name'), str(stat.get('uid'))):
+        return False
+    if 'group' in args and str(args['group']) not in (
+            stat.get('gr_name'), str(stat.get('gid'))):
+        return False
+    return True
+
+
+class MergeActionMixin(object):
+    """Skip the copy of a merged file when its destination is up to date
+
+    Mixed into the merge_configs and merge_yaml action plugins, which set
+    _UNCHANGED_ARGS to the arguments they accept.
+    """
+
+    _UNCHANGED_ARGS = UNCHANGED_ARGS
+
+    def _unchanged_result(self, content, task_vars):
+        """Return the result of the task if dest is already up to date
+
+        A single stat of dest tells whether it already has the merged content
+        and the requested mode, owner and group, in which case there is
+        nothing to transfer or copy. Returns None when the copy action has
+        to run.
+        """
+        args = self._task.args
+        dest = args.get('dest')
+        if (not isinstance(dest, str) or dest.endswith('/') or
+                not self._UNCHANGED_ARGS.issuperset(args)):
+            return None
+        stat = self._execute_remote_stat(dest, all_vars=task_vars,
+                                         follow=False)
+        if (not stat['exists'] or not stat.get('isreg') or
+                stat['checksum'] != checksum_s(content) or
+                not attributes_match(args, stat)):
+            return None
+        self._remove_tmp_path(self._connection._shell.tmpdir)
+        return dict(changed=False, dest=dest, path=dest, state='file',
+                    checksum=stat['checksum'], size=stat.get('size'),
+                    mode=stat['mode'], owner=stat.get('pw_name'),
+                    group=stat.get('gr_name'), uid=stat.get('uid'),
+                    gid=stat.get('gid'))
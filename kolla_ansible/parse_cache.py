@@ -0,0 +1,111 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import os
+import tempfile
+
+TEMPLATE_MARKERS = ('{{', '{%', '{#')
+# A first line overriding the Jinja delimiters, as Ansible supports.
+TEMPLATE_HEADER = '#jinja2:'
+
+
+def is_template(data):
+    """Whether data has to be rendered with Jinja"""
+    return (data.startswith(TEMPLATE_HEADER) or
+            any(marker in data for marker in TEMPLATE_MARKERS))
+
+
+class ParseCache(object):
+    """Cache of the parsed content of config sources without Jinja
+
+    The merge_configs and merge_yaml action plugins render their sources once
+    per host, although custom config overrides seldom use Jinja and then
+    render the same for every host. Their parsed content is cached here, keyed
+    by path, modification time and size, so they are parsed once per run
+    rather than once per host.
+
+    Ansible runs each task of each host in a forked worker process, so
+    entries are kept in memory for the items of a loop and stored as JSON in
+    directory, which all the workers of a run share. Parsed content which
+    JSON does not represent as is, such as YAML with non-string keys, is not
+    cached.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._memory = {}
+
+    @staticmethod
+    def _key(path):
+        st = os.stat(path)
+        key = '{}\0{}\0{}'.format(os.path.abspath(path), st.st_mtime_ns,
+                                  st.st_size)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _load(self, key):
+        try:
+            with open(os.path.join(self.directory, key), 'r') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _store(self, key, data):
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            with tempfile.NamedTemporaryFile('w', dir=self.directory,
+                                             delete=False) as f:
+                f.write(data)
+            os.replace(f.name, os.path.join(self.directory, key))
+        except OSError:
+            # NOTE: The cache is only an optimisation, parsing again is fine.
+            pass
+
+    @staticmethod
+    def _dumps(parsed):
+        """Return parsed as JSON, None if it does not load back the same"""
+        try:
+            data = json.dumps(parsed)
+        except (TypeError, ValueError):
+            return None
+        return data if json.loads(data) == parsed else None
+
+    def read(self, path, parse):
+        """Return the parsed content of path and its content
+
+        The parsed content is parse() of the content, from the cache when
+        possible, and None if the content has to be rendered with Jinja
+        first. The content is returned along in that case only.
+        """
+        key = self._key(path)
+        data = self._memory.get(key)
+        if data is None:
+            data = self._load(key)
+        if data is not None:
+            try:
+                # NOTE: Load on every read, callers may modify what they get.
+                parsed = json.loads(data)
+            except ValueError:
+                data = None
+        if data is None:
+            with open(path, 'r') as f:
+                content = f.read()
+            if is_template(content):
+                return None, content
+            parsed = parse(content)
+            data = self._dumps(parsed)
+            if data is None:
+                return parsed, None
+            self._store(key, data)
+        self._memory[key] = data
+        return parsed, None
@@ -0,0 +1,124 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import getpass
+import grp
+import os
+from unittest import mock
+
+import fixtures
+from oslotest import base
+
+from kolla_ansible import ansible
+from kolla_ansible.cli import commands
+
+
+class TestRenderToVars(base.BaseTestCase):
+
+    def test_render_to_vars(self):
+        render_to = self.useFixture(fixtures.TempDir()).path
+
+        self.assertEqual({
+            'kolla_render_to': render_to,
+            'node_config_directory':
+                '{{kolla_render_to}}/{{inventory_hostname}}',
+            'ansible_connection': 'local',
+            'ansible_become': 'false',
+            'ansible_python_interpreter': '{{ansible_playbook_python}}',
+            'config_owner_user': getpass.getuser(),
+            'config_owner_group': grp.getgrgid(os.getgid()).gr_name,
+        }, commands._render_to_vars(render_to))
+
+    def test_render_to_vars_relative(self):
+        cwd = self.useFixture(fixtures.TempDir()).path
+        self.useFixture(fixtures.MonkeyPatch('os.getcwd', lambda: cwd))
+
+        result = commands._render_to_vars('rendered/config')
+
+        self.assertEqual(os.path.join(cwd, 'rendered', 'config'),
+                         result['kolla_render_to'])
+        self.assertTrue(os.path.isabs(result['kolla_render_to']))
+
+
+class TestGenConfig(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestGenConfig, self).setUp()
+        self.app = mock.Mock()
+        self.app.options.verbose_level = 1
+        self.command = commands.GenConfig(self.app, None)
+        self.run_playbooks = self.useFixture(fixtures.MockPatch(
+            'kolla_ansible.ansible.run_playbooks')).mock
+
+    def _take_action(self, *argv):
+        parser = self.command.get_parser('kolla-ansible genconfig')
+        self.command.take_action(parser.parse_args(list(argv)))
+        self.run_playbooks.assert_called_once()
+        return self.run_playbooks.call_args[1]
+
+    def test_genconfig(self):
+        kwargs = self._take_action()
+
+        self.assertIsNone(kwargs['forks'])
+        self.assertEqual({'kolla_action': 'config'}, kwargs['extra_vars'])
+
+    def test_genconfig_render_to(self):
+        render_to = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'rendered')
+
+        kwargs = self._take_action('--render-to', render_to)
+
+        self.assertTrue(os.path.isdir(render_to))
+        self.assertEqual(os.cpu_count(), kwargs['forks'])
+        self.assertEqual('config', kwargs['extra_vars']['kolla_action'])
+        self.assertEqual(render_to, kwargs['extra_vars']['kolla_render_to'])
+        self.assertEqual('local',
+                         kwargs['extra_vars']['ansible_connection'])
+
+
+class TestBuildArgs(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBuildArgs, self).setUp()
+        self.parsed_args = argparse.Namespace(
+            list_tasks=False, inventory=['/etc/kolla/inventory'],
+            kolla_config_path=self.useFixture(fixtures.TempDir()).path,
+            vault_id=[], vault_password_file=[], ask_vault_password=False,
+            extra_vars=None, become=False, check=False, diff=False,
+            limit=None, skip_tags=None, tags=None)
+
+    def test_build_args_forks(self):
+        executable, args = ansible.build_args(
+            self.parsed_args, ['site.yml'], forks=8)
+
+        self.assertEqual('ansible-playbook', executable)
+        self.assertEqual(['--forks', '8'],
+                         args[args.index('--forks'):args.index('--forks') + 2])
+        self.assertEqual(1, args.count('--forks'))
+
+    def test_build_args_no_forks(self):
+        for forks in (None, 0):
+            executable, args = ansible.build_args(
+                self.parsed_args, ['site.yml'], forks=forks)
+
+            self.assertNotIn('--forks', args)
+
+    def test_build_args_render_to(self):
+        extra_vars = commands._render_to_vars('rendered')
+
+        executable, args = ansible.build_args(
+            self.parsed_args, ['site.yml'], extra_vars=extra_vars)
+
+        self.assertIn('kolla_render_to=%s' % os.path.abspath('rendered'),
+                      args)
+        self.assertIn('ansible_connection=local', args)
@@ -471,6 +471,54 @@ class TestFilters(unittest.TestCase):
         mock_enabled.assert_called_once_with(self.context, service)
         mock_mapped.assert_called_once_with(self.context, service)
 
+    def test_extract_container_specs(self):
+        services = {
+            'keystone': {
+                'container_name': 'keystone',
+                'enabled': True,
+                'group': 'keystone',
+                'image': 'keystone:latest',
+                'volumes': ['/etc/localtime:/etc/localtime:ro', ''],
+                'dimensions': {},
+                'haproxy': {'keystone_internal': {}},
+            },
+            'keystone-ssh': {
+                'container_name': 'keystone_ssh',
+                'enabled': True,
+                'group': 'keystone',
+                'image': 'keystone-ssh:latest',
+                'privileged': True,
+            },
+        }
+        expected = [
+            {'name': 'keystone',
+             'image': 'keystone:latest',
+             'volumes': ['/etc/localtime:/etc/localtime:ro', ''],
+             'dimensions': {}},
+            {'name': 'keystone_ssh',
+             'image': 'keystone-ssh:latest',
+             'privileged': True},
+        ]
+        self.assertEqual(expected, filters.extract_container_specs(
+            self.context, services))
+
+    def test_extract_container_specs_skips_iterated(self):
+        services = {
+            'ovn-sb-db-relay': {
+                'container_name': 'ovn_sb_db_relay',
+                'image': 'ovn-sb-db-relay:latest',
+                'iterate': 'yes',
+            },
+            'ovn-sb-db': {
+                'container_name': 'ovn_sb_db',
+                'image': 'ovn-sb-db:latest',
+                'iterate': False,
+            },
+        }
+        expected = [{'name': 'ovn_sb_db', 'image': 'ovn-sb-db:latest'}]
+        self.assertEqual(expected, filters.extract_container_specs(
+            self.context, services))
+
     @mock.patch.object(filters, 'service_enabled_and_mapped_to_host')
     def test_select_services_enabled_and_mapped_to_host(self, mock_seamth):
         services = {
@@ -0,0 +1,104 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from unittest import mock
+
+import fixtures
+from oslotest import base
+
+from kolla_ansible import parse_cache
+
+
+class TestParseCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestParseCache, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.directory = os.path.join(tmp, 'cache')
+        self.path = os.path.join(tmp, 'nova.conf')
+        self._write('debug = True\n')
+        self.parse = mock.Mock(side_effect=lambda content: [content])
+
+    def _write(self, content, mtime=1000000000):
+        with open(self.path, 'w') as f:
+            f.write(content)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_is_template(self):
+        for data in ('{{ foo }}', '{% if foo %}', '{# foo #}',
+                     '#jinja2: variable_start_string:"[%"\nfoo = [% bar %]'):
+            self.assertTrue(parse_cache.is_template(data))
+        self.assertFalse(parse_cache.is_template('foo = {bar}'))
+        self.assertFalse(parse_cache.is_template('# jinja2 is used\n'))
+
+    def test_read_static(self):
+        cache = parse_cache.ParseCache(self.directory)
+
+        self.assertEqual((['debug = True\n'], None),
+                         cache.read(self.path, self.parse))
+        self.assertEqual((['debug = True\n'], None),
+                         cache.read(self.path, self.parse))
+        self.parse.assert_called_once_with('debug = True\n')
+
+    def test_read_shared(self):
+        parse_cache.ParseCache(self.directory).read(self.path, self.parse)
+        # Another worker process finds the parsed content on disk.
+        cache = parse_cache.ParseCache(self.directory)
+
+        self.assertEqual((['debug = True\n'], None),
+                         cache.read(self.path, self.parse))
+        self.parse.assert_called_once_with('debug = True\n')
+
+    def test_read_copies(self):
+        cache = parse_cache.ParseCache(self.directory)
+        cache.read(self.path, self.parse)[0].append('modified')
+
+        self.assertEqual((['debug = True\n'], None),
+                         cache.read(self.path, self.parse))
+
+    def test_read_modified(self):
+        cache = parse_cache.ParseCache(self.directory)
+        cache.read(self.path, self.parse)
+        self._write('debug = False\n', mtime=1000000001)
+
+        self.assertEqual((['debug = False\n'], None),
+                         cache.read(self.path, self.parse))
+
+    def test_read_template(self):
+        self._write('debug = {{ debug }}\n')
+        cache = parse_cache.ParseCache(self.directory)
+
+        self.assertEqual((None, 'debug = {{ debug }}\n'),
+                         cache.read(self.path, self.parse))
+        self.parse.assert_not_called()
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_read_not_json(self):
+        parse = mock.Mock(return_value={1: 'debug'})
+        cache = parse_cache.ParseCache(self.directory)
+
+        self.assertEqual(({1: 'debug'}, None), cache.read(self.path, parse))
+        self.assertEqual(({1: 'debug'}, None), cache.read(self.path, parse))
+        self.assertEqual(2, parse.call_count)
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_read_corrupt(self):
+        parse_cache.ParseCache(self.directory).read(self.path, self.parse)
+        for name in os.listdir(self.directory):
+            with open(os.path.join(self.directory, name), 'w') as f:
+                f.write('[')
+        cache = parse_cache.ParseCache(self.directory)
+
+        self.assertEqual((['debug = True\n'], None),
+                         cache.read(self.path, self.parse))
+        self.assertEqual(2, self.parse.call_count)
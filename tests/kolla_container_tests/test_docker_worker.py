@@ -14,14 +14,18 @@
 # limitations under the License.
 
 
+from concurrent.futures import ThreadPoolExecutor
 import copy
 from importlib.machinery import SourceFileLoader
+import json
 import os
+import re
 import sys
 from unittest import mock
 
 from docker import errors as docker_error
 from docker.types import Ulimit
+import fixtures
 from oslotest import base
 
 sys.modules['dbus'] = mock.MagicMock()
@@ -189,13 +193,23 @@ def get_DockerWorker(mod_param, docker_api_version='1.40'):
 
     module.params = new_args
 
-    with mock.patch("docker.APIClient") as MockedDockerClientClass:
+    with mock.patch("docker.APIClient") as MockedDockerClientClass, \
+            mock.patch.object(dwm.AgentClient, 'connect', return_value=None):
         MockedDockerClientClass.return_value._version = docker_api_version
         dw = dwm.DockerWorker(module)
         dw.systemd = mock.MagicMock()
+        dw.index.path = None
         return dw
 
 
+CONTAINER_WORKER = 'ansible.module_utils.kolla_container_worker'
+SYSTEMD_WORKER = CONTAINER_WORKER + '.SystemdWorker'
+
+
+def name_filter(name):
+    return {'name': '^{}$'.format(re.escape(name))}
+
+
 def inject_env_when_create_container(container_data, tz='UTC'):
     container_env = container_data.get('environment', dict()) or dict()
     container_svc_name = container_data.get('name').replace('_', '-')
@@ -203,6 +217,12 @@ def inject_env_when_create_container(container_data, tz='UTC'):
     container_data['environment'] = container_env
 
 
+def inject_fingerprint_when_create_container(container_data, worker):
+    labels = dict(container_data.get('labels') or {})
+    labels['kolla_fingerprint'] = worker.desired_fingerprint()
+    container_data['labels'] = labels
+
+
 class TestMainModule(base.BaseTestCase):
 
     def setUp(self):
@@ -240,9 +260,10 @@ class TestMainModule(base.BaseTestCase):
             kc.main()
             mock_dw.assert_called_once_with(module_mock)
             mock_dw.return_value.check_image.assert_called_once_with()
-        module_mock.exit_json.assert_called_once_with(changed=False,
-                                                      result=False,
-                                                      some_key="some_value")
+        module_mock.exit_json.assert_called_once_with(
+            changed=False, result=False, some_key="some_value",
+            engine_api_calls=mock_dw.return_value.snapshot.api_calls,
+            agent_calls=mock_dw.return_value.agent.calls)
 
     def test_sets_dimensions_kernelmemory_supported_false(self):
         self.dw = get_DockerWorker(self.fake_data['params'])
@@ -317,6 +338,8 @@ class TestContainer(base.BaseTestCase):
             return_value=self.fake_data['params']['host_config'])
         self.dw.create_container()
         inject_env_when_create_container(self.fake_data['params'])
+        inject_fingerprint_when_create_container(self.fake_data['params'],
+                                                 self.dw)
         self.assertTrue(self.dw.changed)
         self.fake_data['params'].pop('dimensions')
         self.fake_data['params']['host_config']['blkio_weight'] = '10'
@@ -348,6 +371,8 @@ class TestContainer(base.BaseTestCase):
             return_value=self.fake_data['params']['host_config'])
         self.dw.create_container()
         inject_env_when_create_container(self.fake_data['params'])
+        inject_fingerprint_when_create_container(self.fake_data['params'],
+                                                 self.dw)
         self.assertTrue(self.dw.changed)
         expected_args = {'command', 'detach', 'environment', 'host_config',
                          'healthcheck', 'image', 'labels', 'name', 'tty',
@@ -363,6 +388,8 @@ class TestContainer(base.BaseTestCase):
             return_value=self.fake_data['params']['host_config'])
         self.dw.create_container()
         inject_env_when_create_container(self.fake_data['params'])
+        inject_fingerprint_when_create_container(self.fake_data['params'],
+                                                 self.dw)
         self.assertTrue(self.dw.changed)
         expected_args = {'command', 'detach', 'environment', 'host_config',
                          'image', 'labels', 'name', 'tty',
@@ -568,7 +595,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.systemd.stop.assert_called_once()
         self.dw.dc.stop.assert_not_called()
         self.dw.module.fail_json.assert_not_called()
@@ -582,7 +610,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.systemd.stop.assert_not_called()
         self.dw.dc.stop.assert_called_once_with(
             'my_container', timeout=10)
@@ -595,7 +624,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_container()
 
         self.assertFalse(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('exited_container'))
         self.dw.module.fail_json.assert_not_called()
         self.dw.dc.stop.assert_not_called()
 
@@ -606,7 +636,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_container()
 
         self.assertFalse(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('fake_container'))
         self.dw.dc.stop.assert_not_called()
         self.dw.module.fail_json.assert_called_once_with(
             msg="No such container: fake_container to stop")
@@ -619,7 +650,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_container()
 
         self.assertFalse(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('fake_container'))
         self.dw.dc.stop.assert_not_called()
         self.dw.module.fail_json.assert_not_called()
 
@@ -630,7 +662,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_and_remove_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_with(all=True)
+        self.dw.dc.containers.assert_called_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.systemd.stop.assert_called_once()
         self.dw.dc.remove_container.assert_called_once_with(
             container='my_container', force=True)
@@ -642,7 +675,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.stop_and_remove_container()
 
         self.assertFalse(self.dw.changed)
-        self.dw.dc.containers.assert_called_with(all=True)
+        self.dw.dc.containers.assert_called_with(
+            all=True, filters=name_filter('fake_container'))
         self.assertFalse(self.dw.systemd.stop.called)
         self.assertFalse(self.dw.dc.remove_container.called)
 
@@ -657,7 +691,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.restart_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.systemd.restart.assert_called_once_with()
 
     def test_restart_container_no_systemd(self):
@@ -672,7 +707,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.restart_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.dc.stop.assert_called_once_with(
             'my_container', timeout=10)
         self.dw.dc.start.assert_called_once_with('my_container')
@@ -685,7 +721,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.restart_container()
 
         self.assertFalse(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('fake-container'))
         self.dw.module.fail_json.assert_called_once_with(
             msg="No such container: fake-container")
 
@@ -701,7 +738,8 @@ class TestContainer(base.BaseTestCase):
         self.dw.restart_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_with(all=True)
+        self.dw.dc.containers.assert_called_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.systemd.restart.assert_called_once_with()
         self.dw.module.fail_json.assert_called_once_with(
             changed=True, msg="Container timed out",
@@ -714,12 +752,384 @@ class TestContainer(base.BaseTestCase):
         self.dw.remove_container()
 
         self.assertTrue(self.dw.changed)
-        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
         self.dw.dc.remove_container.assert_called_once_with(
             container='my_container',
             force=True
         )
 
+    def test_remove_container_forgets_container(self):
+        self.dw = get_DockerWorker({'name': 'my_container',
+                                    'action': 'remove_container'})
+        self.dw.dc.containers.return_value = self.fake_data['containers']
+        self.dw.remove_container()
+
+        self.assertIsNone(self.dw.check_container())
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
+
+    def test_compare_container_inspects_once(self):
+        self.fake_data['params'].update({'name': 'my_container',
+                                         'dimensions': {}})
+        self.dw = get_DockerWorker(self.fake_data['params'])
+        self.dw.dc.containers.return_value = self.fake_data['containers']
+        self.dw.dc.images.return_value = self.fake_data['images']
+        self.dw.dc.inspect_container.return_value = {
+            'Image': 'sha256:c5f1cf30',
+            'Path': '/bin/sh',
+            'Args': [],
+            'Config': {'Image': 'myregistrydomain.com:5000/ubuntu:16.04',
+                       'Labels': {}, 'Env': [], 'Volumes': None,
+                       'Healthcheck': None},
+            'HostConfig': {'CapAdd': None, 'SecurityOpt': None,
+                           'IpcMode': '', 'Privileged': False,
+                           'PidMode': '', 'CgroupnsMode': 'host',
+                           'Tmpfs': None, 'Binds': None,
+                           'VolumesFrom': None},
+            'State': {'Status': 'running'},
+        }
+        self.dw.compare_config = mock.Mock(return_value=False)
+        self.dw.systemd.check_unit_change.return_value = False
+
+        self.dw.compare_container()
+        self.dw.check_container_differs()
+
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
+        self.dw.dc.inspect_container.assert_called_once_with('my_container')
+        self.dw.dc.images.assert_called_once_with()
+        self.assertEqual(3, self.dw.snapshot.api_calls)
+
+    def _container_info(self, name, image, privileged=False):
+        env = ['KOLLA_SERVICE_NAME=' + name.replace('_', '-'), 'TZ=UTC']
+        return {
+            'Image': 'sha256:c5f1cf30',
+            'Path': '/bin/sh',
+            'Args': [],
+            'Config': {'Image': image, 'Labels': {}, 'Env': env,
+                       'Volumes': None, 'Healthcheck': None},
+            'HostConfig': {'CapAdd': None, 'SecurityOpt': None,
+                           'IpcMode': '', 'Privileged': privileged,
+                           'PidMode': '', 'CgroupnsMode': 'host',
+                           'Tmpfs': None, 'Binds': None,
+                           'VolumesFrom': None},
+            'State': {'Status': 'running'},
+        }
+
+    def test_compare_containers(self):
+        image = 'myregistrydomain.com:5000/ubuntu:16.04'
+        self.dw = get_DockerWorker({
+            'action': 'compare_containers',
+            'environment': {'TZ': 'UTC'},
+            'dimensions': {},
+            'labels': {},
+            'privileged': False,
+            'state': 'running',
+            'containers': [
+                {'name': 'my_container', 'image': image},
+                {'name': 'other_container', 'image': image,
+                 'privileged': True},
+                {'name': 'missing_container', 'image': image},
+            ]})
+        self.dw.dc.containers.return_value = [
+            {'Names': ['/my_container'], 'Status': 'Up 2 hours'},
+            {'Names': ['/other_container'], 'Status': 'Up 2 hours'},
+        ]
+        self.dw.dc.images.return_value = self.fake_data['images']
+        self.dw.dc.inspect_container.side_effect = [
+            self._container_info('my_container', image),
+            self._container_info('other_container', image),
+        ]
+        self.dw._check_config = mock.Mock(side_effect=lambda name: {
+            'my_container': (False, None),
+            'other_container': (True, 'config.json changed'),
+        }[name])
+
+        with mock.patch(SYSTEMD_WORKER) as mock_systemd:
+            mock_systemd.return_value.check_unit_change.return_value = False
+            self.assertTrue(self.dw.compare_containers())
+
+        self.assertEqual(
+            {'other_container': [{'name': 'privileged',
+                                  'current': False,
+                                  'desired': True},
+                                 {'name': 'config',
+                                  'current': 'config.json changed',
+                                  'desired': 'up_to_date'}],
+             'missing_container': [{'name': 'container_missing',
+                                    'current': None,
+                                    'desired': 'missing_container'}]},
+            self.dw.result['comparison_failures'])
+        self.dw.dc.containers.assert_called_once_with(all=True)
+        self.assertEqual(2, self.dw.dc.inspect_container.call_count)
+        self.assertEqual(2, self.dw._check_config.call_count)
+        self.assertEqual({'my_container', 'other_container'},
+                         set(self.dw.result['config_check_latency']))
+        self.assertEqual(
+            ['my_container', 'other_container', 'missing_container'],
+            [c[0][0]['name'] for c in mock_systemd.call_args_list])
+        self.assertNotIn('name', self.dw.params)
+
+    def test_compare_containers_unchanged(self):
+        image = 'myregistrydomain.com:5000/ubuntu:16.04'
+        self.dw = get_DockerWorker({
+            'action': 'compare_containers',
+            'environment': {'TZ': 'UTC'},
+            'dimensions': {},
+            'labels': {},
+            'privileged': False,
+            'state': 'running',
+            'containers': [{'name': 'my_container', 'image': image}]})
+        self.dw.dc.containers.return_value = [
+            {'Names': ['/my_container'], 'Status': 'Up 2 hours'}]
+        self.dw.dc.images.return_value = self.fake_data['images']
+        self.dw.dc.inspect_container.return_value = (
+            self._container_info('my_container', image))
+        self.dw._check_config = mock.Mock(return_value=(False, None))
+
+        with mock.patch(SYSTEMD_WORKER) as mock_systemd:
+            mock_systemd.return_value.check_unit_change.return_value = False
+            self.assertFalse(self.dw.compare_containers())
+
+        self.assertNotIn('comparison_failures', self.dw.result)
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
+
+    def test_check_configs(self):
+        self.dw = get_DockerWorker({'name': 'container_0'})
+        names = ['container_%d' % i for i in range(20)]
+        self.dw.dc.exec_create.side_effect = lambda name, *a, **kw: name
+        self.dw.dc.exec_start.side_effect = lambda job: job.encode()
+        self.dw.dc.exec_inspect.side_effect = lambda job: {
+            'ExitCode': 1 if job == 'container_1' else 0}
+
+        self.dw.check_configs(names)
+
+        self.assertEqual(len(names), self.dw.dc.exec_create.call_count)
+        self.assertEqual(set(names),
+                         set(self.dw.result['config_check_latency']))
+        self.assertFalse(self.dw.compare_config())
+        self.dw.params['name'] = 'container_1'
+        self.assertTrue(self.dw.compare_config())
+        self.assertEqual('container_1', self.dw._config_diff)
+        # Checks run ahead are only used once.
+        self.assertEqual(len(names), self.dw.dc.exec_create.call_count)
+        self.assertNotIn('container_1', self.dw._config_checks)
+
+    def test_check_configs_server_error(self):
+        self.dw = get_DockerWorker({})
+        self.dw.dc.exec_create.side_effect = docker_error.APIError(
+            'server error', response=mock.Mock(status_code=500))
+
+        self.assertRaises(docker_error.APIError,
+                          self.dw.check_configs, ['container_0'])
+
+    def _unit_worker(self, params):
+        worker = mock.Mock()
+        worker.container_dict = {
+            'name': params['name'],
+            'service_name': 'kolla-%s-container.service' % params['name']}
+        return worker
+
+    def test_update_unit_files(self):
+        self.dw = get_DockerWorker({
+            'action': 'update_unit_files',
+            'containers': [{'name': 'my_container'},
+                           {'name': 'other_container'},
+                           {'name': 'missing_container'}]})
+        self.dw.dc.containers.return_value = [
+            {'Names': ['/my_container'], 'Status': 'Up 2 hours'},
+            {'Names': ['/other_container'], 'Status': 'Exited (0) 2 hours'},
+        ]
+
+        with mock.patch(SYSTEMD_WORKER, side_effect=self._unit_worker), \
+                mock.patch(CONTAINER_WORKER + '.create_unit_files',
+                           side_effect=lambda workers: [
+                               w for w in workers
+                               if w.container_dict['name'] !=
+                               'other_container']) as mock_create:
+            self.assertTrue(self.dw.update_unit_files())
+
+        # Missing containers get their unit when they are created.
+        self.assertEqual(['my_container', 'other_container'],
+                         [w.container_dict['name']
+                          for w in mock_create.call_args[0][0]])
+        self.assertEqual(['kolla-my_container-container.service'],
+                         self.dw.result['changed_units'])
+        for worker in mock_create.call_args[0][0]:
+            worker.start.assert_not_called()
+            worker.restart.assert_not_called()
+            worker.perform_action.assert_not_called()
+
+    def test_update_unit_files_unchanged(self):
+        self.dw = get_DockerWorker({
+            'action': 'update_unit_files',
+            'containers': [{'name': 'my_container'}]})
+        self.dw.dc.containers.return_value = [
+            {'Names': ['/my_container'], 'Status': 'Up 2 hours'}]
+
+        with mock.patch(SYSTEMD_WORKER, side_effect=self._unit_worker), \
+                mock.patch(CONTAINER_WORKER + '.create_unit_files',
+                           return_value=[]):
+            self.assertFalse(self.dw.update_unit_files())
+
+        self.assertNotIn('changed_units', self.dw.result)
+
+    def test_update_unit_files_oneshot(self):
+        self.dw = get_DockerWorker({
+            'action': 'update_unit_files',
+            'containers': [{'name': 'my_container'},
+                           {'name': 'bootstrap',
+                            'restart_policy': 'oneshot'}]})
+        self.dw.dc.containers.return_value = [
+            {'Names': ['/my_container'], 'Status': 'Up 2 hours'},
+            {'Names': ['/bootstrap'], 'Status': 'Up 2 hours'}]
+
+        with mock.patch(SYSTEMD_WORKER, side_effect=self._unit_worker), \
+                mock.patch(CONTAINER_WORKER + '.create_unit_files',
+                           return_value=[]) as mock_create:
+            self.assertFalse(self.dw.update_unit_files())
+
+        self.assertEqual(['my_container'],
+                         [w.container_dict['name']
+                          for w in mock_create.call_args[0][0]])
+
+    def _fingerprint_worker(self, **params):
+        worker_params = {'name': 'my_container',
+                         'image': 'myregistrydomain.com:5000/ubuntu:16.04',
+                         'environment': {'TZ': 'UTC'},
+                         'volumes': ['/etc/localtime:/etc/localtime:ro', ''],
+                         'labels': {},
+                         'state': 'running'}
+        worker_params.update(params)
+        dw = get_DockerWorker(worker_params)
+        dw.dc.images.return_value = self.fake_data['images']
+        return dw
+
+    def test_desired_fingerprint(self):
+        fingerprint = self._fingerprint_worker().desired_fingerprint()
+
+        self.assertEqual(64, len(fingerprint))
+        self.assertEqual(
+            fingerprint,
+            self._fingerprint_worker(
+                volumes=['', '/etc/localtime:/etc/localtime:ro'],
+            ).desired_fingerprint())
+        for params in ({'privileged': True},
+                       {'environment': {'TZ': 'UTC', 'FOO': 'bar'}},
+                       {'image': 'myregistrydomain.com:5000/centos:7.0'},
+                       {'dimensions': {'mem_limit': '1g'}},
+                       {'command': '/bin/true'}):
+            self.assertNotEqual(
+                fingerprint,
+                self._fingerprint_worker(**params).desired_fingerprint())
+
+    def test_desired_fingerprint_image_id(self):
+        dw = self._fingerprint_worker()
+        fingerprint = dw.desired_fingerprint()
+        self.fake_data['images'][0]['Id'] = 'sha256:d1e2f3'
+
+        self.assertNotEqual(
+            fingerprint, self._fingerprint_worker().desired_fingerprint())
+
+    def test_create_container_stamps_fingerprint(self):
+        self.dw = self._fingerprint_worker()
+
+        self.dw.create_container()
+
+        labels = self.dw.dc.create_container.call_args.kwargs['labels']
+        self.assertEqual({'kolla_fingerprint':
+                          self.dw.desired_fingerprint()}, labels)
+        self.assertEqual({}, self.dw.params['labels'])
+
+    def test_check_container_differs_fingerprint_match(self):
+        self.dw = self._fingerprint_worker()
+        container_info = {
+            'Config': {'Labels': {
+                'kolla_fingerprint': self.dw.desired_fingerprint()}},
+            'State': {'Status': 'running'},
+        }
+        self.dw.compare_volumes = mock.Mock()
+        self.dw.compare_environment = mock.Mock()
+
+        self.assertEqual([],
+                         self.dw.check_container_differs(container_info))
+
+        self.dw.compare_volumes.assert_not_called()
+        self.dw.compare_environment.assert_not_called()
+
+    def test_check_container_differs_fingerprint_match_state(self):
+        self.dw = self._fingerprint_worker()
+        container_info = {
+            'Config': {'Labels': {
+                'kolla_fingerprint': self.dw.desired_fingerprint()}},
+            'State': {'Status': 'exited'},
+        }
+
+        self.assertEqual([{'name': 'container_state',
+                           'current': 'exited',
+                           'desired': 'running'}],
+                         self.dw.check_container_differs(container_info))
+
+    def test_check_container_differs_fingerprint_mismatch(self):
+        self.dw = self._fingerprint_worker()
+        container_info = {
+            'Config': {'Labels': {'kolla_fingerprint': 'stale'}},
+            'State': {'Status': 'running'},
+        }
+        for check in ('cap_add', 'security_opt', 'image', 'ipc_mode',
+                      'labels', 'privileged', 'pid_mode', 'cgroupns_mode',
+                      'tmpfs', 'volumes', 'volumes_from', 'environment',
+                      'container_state', 'dimensions', 'command',
+                      'healthcheck'):
+            setattr(self.dw, 'compare_' + check,
+                    mock.Mock(return_value=False))
+
+        self.assertEqual([],
+                         self.dw.check_container_differs(container_info))
+
+        self.dw.compare_volumes.assert_called_once_with(container_info)
+        self.dw.compare_environment.assert_called_once_with(container_info)
+
+    def test_compare_labels_ignores_fingerprint(self):
+        self.dw = self._fingerprint_worker(labels={'foo': 'bar'})
+        container_info = {'Config': {'Labels': {'foo': 'bar',
+                                                'kolla_fingerprint': 'x'}}}
+
+        self.assertFalse(self.dw.compare_labels(container_info))
+        self.assertEqual(({'foo': 'bar'}, {'foo': 'bar'}),
+                         self.dw.diff_labels(container_info))
+
+    def test_compare_containers_merges_environment(self):
+        self.dw = get_DockerWorker({
+            'action': 'compare_containers',
+            'common_options': {'environment': {'KOLLA_CONFIG_STRATEGY':
+                                               'COPY_ALWAYS'}},
+            'containers': [{'name': 'my_container', 'pid_mode': '',
+                            'environment': {'FOO': 'bar'}}]})
+
+        params = self.dw._container_params(self.dw.params['containers'][0])
+
+        self.assertEqual({'KOLLA_CONFIG_STRATEGY': 'COPY_ALWAYS',
+                          'FOO': 'bar'}, params['environment'])
+        self.assertEqual('my_container', params['name'])
+        self.assertNotIn('pid_mode', params)
+        self.assertNotIn('containers', params)
+
+    def test_compare_containers_unset_options(self):
+        self.dw = get_DockerWorker({
+            'action': 'compare_containers',
+            'privileged': False,
+            'graceful_timeout': 10,
+            'containers': [{'name': 'my_container', 'privileged': None,
+                            'graceful_timeout': None}]})
+
+        params = self.dw._container_params(self.dw.params['containers'][0])
+
+        self.assertIs(False, params['privileged'])
+        self.assertEqual(10, params['graceful_timeout'])
+
     def test_recreate_or_restart_container_not_container(self):
         self.dw = get_DockerWorker({
             'environment': dict(KOLLA_CONFIG_STRATEGY='COPY_ALWAYS')})
@@ -794,6 +1204,56 @@ class TestContainer(base.BaseTestCase):
         self.dw.start_container.assert_called_once_with()
 
 
+class FakeDockerEngine(object):
+    """Stand-in for docker.APIClient holding many containers
+
+    Counts how many container entries it hands back to the client so tests
+    can tell how much of the container table a lookup transferred.
+    """
+
+    def __init__(self, count):
+        self.returned = 0
+        self._containers = [
+            {'Id': '%064x' % i,
+             'Names': ['/container_%d' % i],
+             'Status': 'Up 2 hours'}
+            for i in range(count)]
+
+    def containers(self, all=False, filters=None):
+        pattern = (filters or {}).get('name')
+        result = [c for c in self._containers
+                  if pattern is None or
+                  any(re.search(pattern, n[1:]) for n in c['Names'])]
+        self.returned += len(result)
+        return result
+
+
+class TestContainerLookupScale(base.BaseTestCase):
+
+    def _lookup(self, count, name):
+        self.dw = get_DockerWorker({'name': name})
+        self.dw.dc = FakeDockerEngine(count)
+        return self.dw.check_container()
+
+    def test_lookup_cost_independent_of_container_count(self):
+        for count in (5, 500):
+            container = self._lookup(count, 'container_3')
+            self.assertEqual(['/container_3'], container['Names'])
+            self.assertEqual(1, self.dw.dc.returned)
+            self.assertEqual(1, self.dw.snapshot.api_calls)
+
+    def test_lookup_does_not_match_prefix(self):
+        # container_1 is a prefix of container_10 ... container_199
+        container = self._lookup(500, 'container_1')
+        self.assertEqual(['/container_1'], container['Names'])
+        self.assertEqual(1, self.dw.dc.returned)
+
+    def test_lookup_missing(self):
+        self.assertIsNone(self._lookup(500, 'container_500'))
+        self.assertEqual(0, self.dw.dc.returned)
+        self.assertEqual(1, self.dw.snapshot.api_calls)
+
+
 class TestImage(base.BaseTestCase):
 
     def setUp(self):
@@ -954,10 +1414,10 @@ class TestImage(base.BaseTestCase):
     def test_get_image_id_exists(self):
         self.dw = get_DockerWorker(
             {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
-        self.dw.dc.images.return_value = ['sha256:47c3bdbcf99f0c1a36e4db']
+        self.dw.dc.images.return_value = self.fake_data['images']
 
         return_data = self.dw.get_image_id()
-        self.assertEqual('sha256:47c3bdbcf99f0c1a36e4db', return_data)
+        self.assertEqual('sha256:c5f1cf30', return_data)
 
     def test_pull_image_new(self):
         self.dw = get_DockerWorker(
@@ -968,53 +1428,69 @@ class TestImage(base.BaseTestCase):
              'auth_email': 'fake_mail@foogle.com'
              })
         self.dw.dc.pull.return_value = [
-            b'{"status":"Pull complete","progressDetail":{},"id":"22f7"}\r\n',
-            b'{"status":"Digest: sha256:47c3bdbcf99f0c1a36e4db"}\r\n',
-            b'{"status":"Downloaded newer image for ubuntu:16.04"}\r\n'
+            {'status': 'Pulling fs layer', 'progressDetail': {},
+             'id': '22f7'},
+            {'status': 'Downloading', 'id': '22f7',
+             'progressDetail': {'current': 1000, 'total': 3000}},
+            {'status': 'Downloading', 'id': '22f7',
+             'progressDetail': {'current': 2000, 'total': 3000}},
+            {'status': 'Download complete', 'progressDetail': {},
+             'id': '22f7'},
+            {'status': 'Already exists', 'progressDetail': {}, 'id': '9c1a'},
+            {'status': 'Pull complete', 'progressDetail': {}, 'id': '22f7'},
+            {'status': 'Digest: sha256:47c3bdbcf99f0c1a36e4db'},
+            {'status': 'Downloaded newer image for ubuntu:16.04'}
         ]
         self.dw.dc.images.side_effect = [
             [],
-            ['sha256:47c3bdbcf99f0c1a36e4db']
+            self.fake_data['images']
         ]
 
         self.dw.pull_image()
         self.dw.dc.pull.assert_called_once_with(
             repository='myregistrydomain.com:5000/ubuntu',
             tag='16.04',
-            stream=True)
+            stream=True,
+            decode=True)
         self.assertTrue(self.dw.changed)
+        stats = self.dw.result['pull_stats']
+        self.assertEqual({'22f7': 3000, '9c1a': 0}, stats['layers'])
+        self.assertEqual(3000, stats['total_bytes'])
+        self.assertIn('duration', stats)
+        self.assertIn('mb_per_sec', stats)
 
     def test_pull_image_exists(self):
         self.dw = get_DockerWorker(
             {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
         self.dw.dc.pull.return_value = [
-            b'{"status":"Pull complete","progressDetail":{},"id":"22f7"}\r\n',
-            b'{"status":"Digest: sha256:47c3bdbf0c1a36e4db"}\r\n',
-            b'{"status":"mage is up to date for ubuntu:16.04"}\r\n'
+            {'status': 'Digest: sha256:47c3bdbf0c1a36e4db'},
+            {'status': 'Image is up to date for ubuntu:16.04'}
         ]
         self.dw.dc.images.side_effect = [
-            ['sha256:47c3bdbcf99f0c1a36e4db'],
-            ['sha256:47c3bdbcf99f0c1a36e4db']
+            self.fake_data['images'],
+            self.fake_data['images']
         ]
 
         self.dw.pull_image()
         self.dw.dc.pull.assert_called_once_with(
             repository='myregistrydomain.com:5000/ubuntu',
             tag='16.04',
-            stream=True)
+            stream=True,
+            decode=True)
         self.assertFalse(self.dw.changed)
 
     def test_pull_image_not_exists(self):
         self.dw = get_DockerWorker(
             {'image': 'unknown:16.04'})
         self.dw.dc.pull.return_value = [
-            b'{"error": "image unknown not found"}\r\n']
+            {'error': 'image unknown not found'}]
 
         self.dw.pull_image()
         self.dw.dc.pull.assert_called_once_with(
             repository='unknown',
             tag='16.04',
-            stream=True)
+            stream=True,
+            decode=True)
         self.assertFalse(self.dw.changed)
         self.dw.module.fail_json.assert_called_once_with(
             msg="The requested image does not exist: unknown:16.04",
@@ -1023,18 +1499,163 @@ class TestImage(base.BaseTestCase):
     def test_pull_image_error(self):
         self.dw = get_DockerWorker(
             {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
-        self.dw.dc.pull.return_value = [
-            b'{"error": "unexpected error"}\r\n']
+        self.dw.dc.pull.return_value = iter([
+            {'status': 'Pulling fs layer', 'progressDetail': {},
+             'id': '22f7'},
+            {'error': 'unexpected error'},
+            {'status': 'Pull complete', 'progressDetail': {}, 'id': '22f7'},
+        ])
 
         self.dw.pull_image()
         self.dw.dc.pull.assert_called_once_with(
             repository='myregistrydomain.com:5000/ubuntu',
             tag='16.04',
-            stream=True)
+            stream=True,
+            decode=True)
         self.assertFalse(self.dw.changed)
         self.dw.module.fail_json.assert_called_once_with(
             msg="Unknown error message: unexpected error",
             failed=True)
+        # The stream is not read past the first error.
+        self.assertEqual(
+            'Pull complete',
+            next(self.dw.dc.pull.return_value)['status'])
+
+    def _get_pull_images_worker(self, images, **params):
+        self.dw = get_DockerWorker(dict(
+            {'action': 'pull_images', 'images': images,
+             'pull_concurrency': 4, 'pull_retries': 3,
+             'pull_retry_delay': 5}, **params))
+        registry = {
+            'myregistrydomain.com:5000/ubuntu': self.fake_data['images'][0],
+            'myregistrydomain.com:5000/centos': self.fake_data['images'][1],
+        }
+        present = [self.fake_data['images'][1]]
+
+        def pull(repository, tag, stream, decode):
+            if repository not in registry:
+                return [{'error': 'image {} not found'.format(repository)}]
+            if registry[repository] not in present:
+                present.append(registry[repository])
+                return [{'status': 'Downloaded newer image'}]
+            return [{'status': 'Image is up to date'}]
+        self.dw.dc.pull.side_effect = pull
+        self.dw.dc.images.side_effect = lambda: list(present)
+
+    @mock.patch('time.sleep')
+    def test_pull_images(self, mock_sleep):
+        self._get_pull_images_worker(
+            ['myregistrydomain.com:5000/ubuntu:16.04',
+             'myregistrydomain.com:5000/centos:7.0',
+             'myregistrydomain.com:5000/ubuntu:16.04'],
+            pull_concurrency=8)
+
+        with mock.patch(CONTAINER_WORKER + '.ThreadPoolExecutor',
+                        wraps=ThreadPoolExecutor) as mock_executor:
+            self.assertTrue(self.dw.pull_images())
+        mock_executor.assert_called_once_with(max_workers=2)
+        self.assertEqual(2, self.dw.dc.pull.call_count)
+        # Images are listed once before and once after all the pulls.
+        self.assertEqual(2, self.dw.dc.images.call_count)
+        self.assertEqual(['myregistrydomain.com:5000/ubuntu:16.04'],
+                         self.dw.result['changed_images'])
+        self.assertEqual(
+            ['myregistrydomain.com:5000/ubuntu:16.04',
+             'myregistrydomain.com:5000/centos:7.0'],
+            list(self.dw.result['pull_stats']))
+        self.dw.module.fail_json.assert_not_called()
+        mock_sleep.assert_not_called()
+
+    @mock.patch('time.sleep')
+    def test_pull_images_retry(self, mock_sleep):
+        self._get_pull_images_worker(
+            ['myregistrydomain.com:5000/ubuntu:16.04'])
+        pull = self.dw.dc.pull.side_effect
+        failures = [[{'error': 'unexpected error'}]]
+        self.dw.dc.pull.side_effect = (
+            lambda **kwargs: failures.pop() if failures else pull(**kwargs))
+
+        self.assertTrue(self.dw.pull_images())
+        self.assertEqual(2, self.dw.dc.pull.call_count)
+        mock_sleep.assert_called_once_with(5)
+        self.dw.module.fail_json.assert_not_called()
+
+    @mock.patch('time.sleep')
+    def test_pull_images_failed(self, mock_sleep):
+        self._get_pull_images_worker(
+            ['myregistrydomain.com:5000/centos:7.0',
+             'myregistrydomain.com:5000/missing:1.0'],
+            pull_retries=1)
+
+        self.dw.pull_images()
+        self.assertEqual(3, self.dw.dc.pull.call_count)
+        self.assertFalse(self.dw.changed)
+        self.dw.module.fail_json.assert_called_once_with(
+            changed=False,
+            msg='Failed to pull images: '
+                'myregistrydomain.com:5000/missing:1.0',
+            failed_images={
+                'myregistrydomain.com:5000/missing:1.0':
+                    'The requested image does not exist: '
+                    'myregistrydomain.com:5000/missing:1.0'},
+            changed_images=[],
+            pull_stats=mock.ANY)
+
+    @mock.patch('time.sleep')
+    def test_pull_images_exception(self, mock_sleep):
+        self._get_pull_images_worker(
+            ['myregistrydomain.com:5000/ubuntu:16.04',
+             'myregistrydomain.com:5000/centos:7.0'],
+            pull_retries=1)
+        pull = self.dw.dc.pull.side_effect
+
+        def failing_pull(repository, **kwargs):
+            if repository.endswith('centos'):
+                raise docker_error.APIError('connection refused')
+            return pull(repository=repository, **kwargs)
+        self.dw.dc.pull.side_effect = failing_pull
+
+        self.dw.pull_images()
+        self.assertEqual(3, self.dw.dc.pull.call_count)
+        mock_sleep.assert_called_once_with(5)
+        self.assertEqual(['myregistrydomain.com:5000/ubuntu:16.04'],
+                         self.dw.result['changed_images'])
+        self.dw.module.fail_json.assert_called_once_with(
+            changed=True,
+            msg='Failed to pull images: '
+                'myregistrydomain.com:5000/centos:7.0',
+            failed_images={
+                'myregistrydomain.com:5000/centos:7.0':
+                    'Unknown error message: connection refused'},
+            changed_images=['myregistrydomain.com:5000/ubuntu:16.04'],
+            pull_stats=mock.ANY)
+
+    @mock.patch('time.sleep')
+    def test_pull_images_exception_retry(self, mock_sleep):
+        self._get_pull_images_worker(
+            ['myregistrydomain.com:5000/ubuntu:16.04'])
+        pull = self.dw.dc.pull.side_effect
+        failures = [docker_error.APIError('connection refused')]
+
+        def failing_pull(**kwargs):
+            if failures:
+                raise failures.pop()
+            return pull(**kwargs)
+        self.dw.dc.pull.side_effect = failing_pull
+
+        self.assertTrue(self.dw.pull_images())
+        self.assertEqual(2, self.dw.dc.pull.call_count)
+        self.dw.module.fail_json.assert_not_called()
+
+    def test_pull_images_no_concurrency(self):
+        self._get_pull_images_worker(
+            ['myregistrydomain.com:5000/ubuntu:16.04'], pull_concurrency=0)
+
+        self.assertFalse(self.dw.pull_images())
+        self.dw.dc.pull.assert_not_called()
+        self.dw.module.fail_json.assert_called_once_with(
+            msg='pull_concurrency must be at least 1 and pull_retries at '
+                'least 0')
 
     def test_remove_image(self):
         self.dw = get_DockerWorker(
@@ -1165,6 +1786,171 @@ class TestVolume(base.BaseTestCase):
         )
 
 
+class TestEngineIndex(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEngineIndex, self).setUp()
+        self.fake_data = copy.deepcopy(FAKE_DATA)
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'docker_index.json')
+        self.volumes = {'Volumes': [{'Driver': 'local',
+                                     'Labels': None,
+                                     'Name': 'mariadb'}]}
+
+    def _get_worker(self, events=()):
+        dw = get_DockerWorker({'name': 'mariadb',
+                               'image': 'myregistrydomain.com:5000/'
+                                        'ubuntu:16.04'})
+        dw.index.path = self.path
+        dw.dc.images.return_value = self.fake_data['images']
+        dw.dc.volumes.return_value = self.volumes
+        dw.dc.events.return_value = list(events)
+        return dw
+
+    def _populate(self):
+        dw = self._get_worker()
+        self.assertEqual(self.fake_data['images'][0], dw.check_image())
+        self.assertEqual(self.volumes['Volumes'][0], dw.check_volume())
+        dw.dc.events.assert_not_called()
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_lookup_served_from_persisted_index(self):
+        self._populate()
+        dw = self._get_worker()
+
+        self.assertEqual(self.fake_data['images'][0], dw.check_image())
+        self.assertEqual('sha256:c5f1cf30', dw.get_image_id())
+        self.assertEqual(self.volumes['Volumes'][0], dw.check_volume())
+        self.assertIsNone(dw.check_volume(name='missing'))
+        dw.dc.events.assert_called_once_with(
+            since=mock.ANY, until=mock.ANY,
+            filters={'type': ['image', 'volume']}, decode=True)
+        dw.dc.images.assert_not_called()
+        dw.dc.volumes.assert_not_called()
+        self.assertEqual(1, dw.snapshot.api_calls)
+
+    def test_image_event_rebuilds_images(self):
+        self._populate()
+        dw = self._get_worker(events=[{'Type': 'image', 'Action': 'pull'}])
+
+        dw.check_image()
+        dw.check_volume()
+        dw.dc.images.assert_called_once_with()
+        dw.dc.volumes.assert_not_called()
+
+    def test_volume_event_rebuilds_volumes(self):
+        self._populate()
+        dw = self._get_worker(events=[{'Type': 'volume',
+                                       'Action': 'destroy'}])
+
+        dw.check_image()
+        dw.check_volume()
+        dw.dc.images.assert_not_called()
+        dw.dc.volumes.assert_called_once_with()
+
+    def test_expired_index_rebuilt(self):
+        self._populate()
+        with open(self.path) as f:
+            data = json.load(f)
+        data['timestamp'] -= 24 * 3600
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+        dw = self._get_worker()
+
+        dw.check_image()
+        dw.dc.events.assert_not_called()
+        dw.dc.images.assert_called_once_with()
+
+    def test_corrupt_index_rebuilt(self):
+        with open(self.path, 'w') as f:
+            f.write('{')
+        dw = self._get_worker()
+
+        self.assertEqual(self.fake_data['images'][0], dw.check_image())
+        dw.dc.events.assert_not_called()
+        dw.dc.images.assert_called_once_with()
+
+    def test_create_volume_updates_index(self):
+        dw = self._get_worker()
+        new_volume = {'Driver': 'local', 'Labels': {'kolla_managed': 'true'},
+                      'Name': 'rabbitmq'}
+        dw.dc.create_volume.return_value = new_volume
+
+        dw.create_volume(name='rabbitmq')
+        self.assertEqual(new_volume, dw.check_volume(name='rabbitmq'))
+        dw.dc.volumes.assert_called_once_with()
+
+    def test_pull_image_invalidates_images(self):
+        dw = self._get_worker()
+        dw.dc.pull.return_value = [
+            {'status': 'Downloaded newer image for ubuntu:16.04'}]
+
+        dw.check_image()
+        dw.pull_image()
+        dw.check_image()
+        self.assertEqual(2, dw.dc.images.call_count)
+
+
+class TestHostAgent(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestHostAgent, self).setUp()
+        self.fake_data = copy.deepcopy(FAKE_DATA)
+        self.dw = get_DockerWorker({'name': 'my_container',
+                                    'image': 'myregistrydomain.com:5000/'
+                                             'ubuntu:16.04'})
+        self.dw.agent = mock.Mock()
+
+    def test_container_lookup_served_by_agent(self):
+        self.dw.agent.call.return_value = self.fake_data['containers'][0]
+
+        self.assertEqual(self.fake_data['containers'][0],
+                         self.dw.check_container())
+        self.dw.agent.call.assert_called_once_with(
+            'lookup', section='containers', key='my_container')
+        self.dw.dc.containers.assert_not_called()
+        self.assertEqual(0, self.dw.snapshot.api_calls)
+
+    def test_agent_error_falls_back(self):
+        self.dw.agent.call.side_effect = dwm.AgentError('Host agent gone')
+        self.dw.dc.containers.return_value = self.fake_data['containers']
+
+        self.dw.check_container()
+        self.dw.snapshot.container_info('my_container')
+        self.dw.agent.call.assert_called_once_with(
+            'lookup', section='containers', key='my_container')
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
+        self.dw.dc.inspect_container.assert_called_once_with('my_container')
+
+    def test_agent_not_used_after_change(self):
+        self.dw.agent.call.return_value = self.fake_data['containers'][0]
+        self.dw.dc.containers.return_value = self.fake_data['containers']
+
+        self.dw.check_container()
+        self.dw.snapshot.forget_container('my_container')
+        self.dw.check_container()
+        self.dw.agent.call.assert_called_once_with(
+            'lookup', section='containers', key='my_container')
+        self.dw.dc.containers.assert_called_once_with(
+            all=True, filters=name_filter('my_container'))
+
+    def test_image_lookup_served_by_agent(self):
+        self.dw.agent.call.return_value = self.fake_data['images'][0]
+
+        self.assertEqual(self.fake_data['images'][0], self.dw.check_image())
+        self.dw.agent.call.assert_called_once_with(
+            'lookup', section='images',
+            key='myregistrydomain.com:5000/ubuntu:16.04')
+        self.dw.dc.images.assert_not_called()
+
+        self.dw.index.invalidate('images')
+        self.dw.dc.images.return_value = self.fake_data['images']
+        self.dw.index.lookup('images', 'ubuntu:16.04')
+        self.dw.dc.images.assert_called_once_with()
+        self.assertEqual(1, self.dw.agent.call.call_count)
+
+
 class TestAttrComp(base.BaseTestCase):
 
     def setUp(self):
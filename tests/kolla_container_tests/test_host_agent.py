@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from importlib.machinery import SourceFileLoader
+import os
+import sys
+import threading
+from unittest import mock
+
+import fixtures
+from oslotest import base
+
+this_dir = os.path.dirname(sys.modules[__name__].__file__)
+ansible_dir = os.path.join(this_dir, '..', '..', 'ansible')
+host_agent_file = os.path.join(ansible_dir,
+                               'module_utils', 'kolla_host_agent.py')
+ham = SourceFileLoader('kolla_host_agent', host_agent_file).load_module()
+
+CONTAINERS = [
+    {'Names': ['/my_container'], 'State': 'running', 'Id': '1'},
+    {'Names': ['/exited_container'], 'State': 'exited', 'Id': '2'},
+]
+
+
+def get_state():
+    dc = mock.Mock()
+    dc.containers.return_value = CONTAINERS
+    dc.images.return_value = [{'Id': 'sha256:1',
+                               'RepoTags': ['ubuntu:24.04']}]
+    dc.volumes.return_value = {'Volumes': [{'Name': 'mariadb'}]}
+    dc.inspect_container.side_effect = lambda name: {'Name': '/' + name}
+    dc.events.return_value = []
+    return ham.EngineState(dc)
+
+
+class TestEngineState(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestEngineState, self).setUp()
+        self.state = get_state()
+
+    def test_lookup_cached(self):
+        self.assertEqual(CONTAINERS[0],
+                         self.state.lookup('containers', 'my_container'))
+        self.assertIsNone(self.state.lookup('containers', 'missing'))
+        self.assertEqual({'Name': 'mariadb'},
+                         self.state.lookup('volumes', 'mariadb'))
+        self.assertEqual('sha256:1',
+                         self.state.lookup('images', 'ubuntu:24.04')['Id'])
+        self.state.dc.containers.assert_called_once_with(all=True)
+        self.assertEqual(3, self.state.api_calls)
+
+    def test_inspect_container_cached(self):
+        self.state.inspect_container('my_container')
+        self.state.inspect_container('my_container')
+        self.state.dc.inspect_container.assert_called_once_with(
+            'my_container')
+
+    def test_container_event(self):
+        self.state.list('containers')
+        self.state.list('images')
+        self.state.inspect_container('my_container')
+        self.state.handle_event({
+            'Type': 'container', 'Action': 'start',
+            'Actor': {'Attributes': {'name': 'my_container'}}})
+
+        self.assertIsNone(self.state.data['containers'])
+        self.assertIsNotNone(self.state.data['images'])
+        self.assertNotIn('my_container', self.state.inspected)
+
+    def test_health_status_event(self):
+        self.state.list('containers')
+        self.state.inspect_container('my_container')
+        self.state.handle_event({
+            'Type': 'container', 'Action': 'health_status: unhealthy',
+            'Actor': {'Attributes': {'name': 'my_container'}}})
+
+        self.assertIsNone(self.state.data['containers'])
+        self.assertNotIn('my_container', self.state.inspected)
+
+    def test_exec_event_ignored(self):
+        self.state.list('containers')
+        self.state.inspect_container('my_container')
+        self.state.handle_event({
+            'Type': 'container', 'Action': 'exec_start: healthcheck_curl',
+            'Actor': {'Attributes': {'name': 'my_container'}}})
+
+        self.assertIsNotNone(self.state.data['containers'])
+        self.assertIn('my_container', self.state.inspected)
+
+    def test_sync(self):
+        self.state.list('containers')
+        self.state.inspect_container('my_container')
+        since = self.state.synced
+        self.state.dc.events.return_value = [{
+            'Type': 'container', 'Action': 'stop',
+            'Actor': {'Attributes': {'name': 'my_container'}}}]
+
+        self.state.sync(since + 10)
+
+        self.state.dc.events.assert_called_once_with(
+            since=since, until=since + 10, decode=True)
+        self.assertIsNone(self.state.data['containers'])
+        self.assertNotIn('my_container', self.state.inspected)
+        self.assertEqual(since + 10, self.state.synced)
+        # Events up to then have been applied already.
+        self.state.sync(since + 5)
+        self.state.dc.events.assert_called_once()
+
+    def test_sync_watched(self):
+        until = self.state.synced + 10
+        self.state.dc.events.return_value = iter([
+            {'Type': 'container', 'Action': 'stop',
+             'Actor': {'Attributes': {'name': 'my_container'}},
+             'time': int(until), 'timeNano': int(until * 1e9)},
+            {'Type': 'image', 'Action': 'pull',
+             'time': int(until) + 1},
+        ])
+
+        self.state.follow()
+        self.state.sync(until)
+
+        self.assertEqual(int(until) + 1, self.state.watched)
+        # The watcher has applied events past until already.
+        self.state.dc.events.assert_called_once_with(decode=True)
+        self.assertEqual(0, self.state.api_calls)
+
+    def test_sync_watcher_lagging(self):
+        self.state.dc.events.return_value = iter([])
+        self.state.follow()
+        since = self.state.watched
+        self.state.dc.events.return_value = []
+
+        self.state.sync(since + 10)
+
+        self.state.dc.events.assert_called_with(
+            since=since, until=since + 10, decode=True)
+        self.assertEqual(since + 10, self.state.synced)
+
+    def test_image_and_volume_events(self):
+        for section in ('containers', 'images', 'volumes'):
+            self.state.list(section)
+        self.state.handle_event({'Type': 'image', 'Action': 'pull'})
+        self.state.handle_event({'Type': 'volume', 'Action': 'create'})
+
+        self.assertIsNotNone(self.state.data['containers'])
+        self.assertIsNone(self.state.data['images'])
+        self.assertIsNone(self.state.data['volumes'])
+
+
+class TestAgentServer(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestAgentServer, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'agent', 'host-agent.sock')
+        self.state = get_state()
+        server = ham.AgentServer(self.path, self.state)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+    def test_connect(self):
+        client = ham.AgentClient.connect(self.path)
+        self.assertIsNotNone(client)
+        self.assertEqual(1, client.calls)
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+
+    def test_connect_no_agent(self):
+        self.assertIsNone(ham.AgentClient.connect(self.path + '.missing'))
+
+    def test_queries(self):
+        client = ham.AgentClient.connect(self.path)
+
+        self.assertEqual(CONTAINERS[1],
+                         client.call('lookup', section='containers',
+                                     key='exited_container'))
+        self.assertEqual(['my_container', 'exited_container'],
+                         list(client.call('list', section='containers')))
+        self.assertEqual({'Name': '/my_container'},
+                         client.call('inspect_container',
+                                     name='my_container'))
+        self.assertEqual(4, client.calls)
+        # One listing, one inspection and one read of the events per query.
+        self.assertEqual(5, self.state.api_calls)
+
+    def test_query_after_change(self):
+        client = ham.AgentClient.connect(self.path)
+        client.call('inspect_container', name='my_container')
+        # The change is made but its event not streamed to the agent yet.
+        self.state.dc.inspect_container.side_effect = (
+            lambda name: {'Name': '/' + name, 'State': 'exited'})
+        self.state.dc.events.return_value = [{
+            'Type': 'container', 'Action': 'die',
+            'Actor': {'Attributes': {'name': 'my_container'}}}]
+
+        self.assertEqual({'Name': '/my_container', 'State': 'exited'},
+                         client.call('inspect_container',
+                                     name='my_container'))
+
+    def test_sync_error(self):
+        client = ham.AgentClient.connect(self.path)
+        self.state.dc.events.side_effect = Exception('Engine unavailable')
+
+        self.assertRaises(ham.AgentError, client.call, 'list',
+                          section='containers')
+
+    def test_error(self):
+        client = ham.AgentClient.connect(self.path)
+        self.state.dc.inspect_container.side_effect = Exception('No such')
+
+        self.assertRaises(ham.AgentError, client.call, 'inspect_container',
+                          name='missing')
+        self.assertRaises(ham.AgentError, client.call, 'unknown')
+        self.assertEqual(1, client.calls)
@@ -13,8 +13,10 @@
 # limitations under the License.
 
 
+import base64
 import copy
 from importlib.machinery import SourceFileLoader
+import json
 import os
 import sys
 import unittest
@@ -160,6 +162,24 @@ def get_containers(override=None):
     return containers
 
 
+def containers_get(*cont_lists):
+    """Return a side effect for containers.get() over the given lists
+
+    Each call looks the name up in the next list. The last list is reused
+    once the others are exhausted.
+    """
+    lists = list(cont_lists)
+
+    def get(name):
+        conts = lists.pop(0) if len(lists) > 1 else lists[0]
+        for cont in conts:
+            if cont.name == name:
+                return cont
+        raise podman_error.NotFound(
+            'no container with name or ID "{}" found'.format(name))
+    return get
+
+
 class TestMainModule(base.BaseTestCase):
     def setUp(self):
         super(TestMainModule, self).setUp()
@@ -176,13 +196,14 @@ class TestMainModule(base.BaseTestCase):
         ) as mock_pw:
             mock_pw.return_value.check_image.return_value = False
             mock_pw.return_value.changed = False
+            mock_pw.return_value.agent = None
             mock_pw.return_value.result = {"some_key": "some_value"}
             kc.main()
             mock_pw.assert_called_once_with(module_mock)
             mock_pw.return_value.check_image.assert_called_once_with()
-        module_mock.exit_json.assert_called_once_with(changed=False,
-                                                      result=False,
-                                                      some_key="some_value")
+        module_mock.exit_json.assert_called_once_with(
+            changed=False, result=False, some_key="some_value",
+            engine_api_calls=mock_pw.return_value.snapshot.api_calls)
 
 
 class TestContainer(base.BaseTestCase):
@@ -224,6 +245,21 @@ class TestContainer(base.BaseTestCase):
         self.pw.pc.containers.create.assert_called_once()
         self.assertIn(('blkio_weight', 10), podman_create_kwargs)
 
+    def test_create_container_stamps_fingerprint(self):
+        self.fake_data['params']['volumes'] = [
+            'kolla_logs:/var/log/kolla/']
+        self.pw = get_PodmanWorker(self.fake_data['params'].copy())
+        self.pw.pc.images.get.return_value = construct_image(
+            self.fake_data['images'][0])
+        fingerprint = self.pw.desired_fingerprint()
+
+        self.pw.create_container()
+
+        labels = self.pw.pc.containers.create.call_args.kwargs['labels']
+        expected = dict(self.fake_data['params']['labels'])
+        expected['kolla_fingerprint'] = fingerprint
+        self.assertEqual(expected, labels)
+
     def test_create_container_wrong_dimensions(self):
         self.fake_data['params']['dimensions'] = {'random': 10}
         self.pw = get_PodmanWorker(self.fake_data['params'])
@@ -310,14 +346,12 @@ class TestContainer(base.BaseTestCase):
         self.pw = get_PodmanWorker(self.fake_data['params'].copy())
         self.pw.pc.images = mock.MagicMock(
             return_value=self.fake_data['images'])
-        self.pw.pc.containers.list = mock.MagicMock(params={'all': 'True'})
-
         containers = get_containers()
         new_container = mock.Mock()
         new_container.name = 'test_container'
         new_container.status = 'running'
-        self.pw.pc.containers.list.side_effect = [containers,
-                                                  [*containers, new_container]]
+        self.pw.pc.containers.get.side_effect = containers_get(
+            containers, [*containers, new_container])
         self.pw.check_container_differs = mock.MagicMock(return_value=False)
         self.pw.create_container = mock.MagicMock()
 
@@ -337,16 +371,8 @@ class TestContainer(base.BaseTestCase):
         self.pw = get_PodmanWorker(self.fake_data['params'])
         self.pw.pc.images = mock.MagicMock(
             return_value=self.fake_data['images'])
-        self.pw.pc.containers.list = mock.MagicMock(params={'all': 'True'})
         full_cont_list = get_containers()
-        updated_cont_list = full_cont_list[1:]
-        self.pw.pc.containers.list.side_effect = [
-            full_cont_list,
-            full_cont_list,
-            full_cont_list,
-            updated_cont_list,
-            full_cont_list
-        ]
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.check_container_differs = mock.MagicMock(return_value=True)
         self.pw.create_container = mock.MagicMock()
         self.pw.start_container()
@@ -367,8 +393,8 @@ class TestContainer(base.BaseTestCase):
             return_value=self.fake_data['images'])
         self.fake_data['containers'][0].update(
             {'State': {'Status': 'exited'}})
-        self.pw.pc.containers.list = mock.MagicMock(
-            return_value=get_containers(self.fake_data['containers']))
+        self.pw.pc.containers.get.side_effect = containers_get(
+            get_containers(self.fake_data['containers']))
         self.pw.check_container_differs = mock.MagicMock(return_value=False)
         container = mock.Mock()
         self.pw.check_container = mock.Mock(return_value=container)
@@ -387,13 +413,8 @@ class TestContainer(base.BaseTestCase):
 
         self.pw.pc.images = mock.MagicMock(
             return_value=self.fake_data['images'])
-        self.pw.pc.containers.list = mock.MagicMock(side_effect=[
-            [],
-            full_cont_list,
-            full_cont_list,
-            full_cont_list,
-            full_cont_list
-        ])
+        self.pw.pc.containers.get.side_effect = containers_get(
+            [], full_cont_list)
         my_container.remove = mock.Mock()
         my_container.wait = mock.MagicMock(return_value=0)
         my_container.logs = mock.MagicMock(side_effect=[
@@ -426,8 +447,8 @@ class TestContainer(base.BaseTestCase):
             return_value=self.fake_data['images'])
         self.fake_data['containers'][0].update(
             {'State': {'Status': 'exited'}})
-        self.pw.pc.containers.list = mock.MagicMock(
-            return_value=get_containers(self.fake_data['containers']))
+        self.pw.pc.containers.get.side_effect = containers_get(
+            get_containers(self.fake_data['containers']))
         self.pw.check_container_differs = mock.MagicMock(return_value=False)
         container = mock.Mock()
         self.pw.check_container = mock.Mock(return_value=container)
@@ -451,8 +472,8 @@ class TestContainer(base.BaseTestCase):
             return_value=self.fake_data['images'])
         self.fake_data['containers'][0].update(
             {'State': {'Status': 'exited'}})
-        self.pw.pc.containers.list = mock.MagicMock(
-            return_value=get_containers(self.fake_data['containers']))
+        self.pw.pc.containers.get.side_effect = containers_get(
+            get_containers(self.fake_data['containers']))
         self.pw.check_container_differs = mock.MagicMock(return_value=False)
         container = mock.Mock()
         container.attrs = {'some': 'value'}
@@ -471,11 +492,11 @@ class TestContainer(base.BaseTestCase):
                                     'action': 'stop_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
         container = full_cont_list[0]
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.stop_container()
 
         self.assertTrue(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
         self.pw.systemd.stop.assert_called_once()
         container.stop.assert_not_called()
         self.pw.module.fail_json.assert_not_called()
@@ -486,11 +507,11 @@ class TestContainer(base.BaseTestCase):
                                     'restart_policy': 'oneshot'})
         full_cont_list = get_containers(self.fake_data['containers'])
         container = full_cont_list[0]
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.stop_container()
 
         self.assertTrue(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
         self.pw.systemd.stop.assert_not_called()
         container.stop.assert_called_once()
         self.pw.module.fail_json.assert_not_called()
@@ -499,12 +520,12 @@ class TestContainer(base.BaseTestCase):
         self.pw = get_PodmanWorker({'name': 'exited_container',
                                     'action': 'stop_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         exited_container = full_cont_list[1]
         self.pw.stop_container()
 
         self.assertFalse(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('exited_container')
         self.pw.module.fail_json.assert_not_called()
         exited_container.stop.assert_not_called()
 
@@ -512,11 +533,11 @@ class TestContainer(base.BaseTestCase):
         self.pw = get_PodmanWorker({'name': 'fake_container',
                                     'action': 'stop_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.stop_container()
 
         self.assertFalse(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('fake_container')
         for cont in full_cont_list:
             cont.stop.assert_not_called()
         self.pw.systemd.stop.assert_not_called()
@@ -528,11 +549,11 @@ class TestContainer(base.BaseTestCase):
                                     'action': 'stop_container',
                                     'ignore_missing': True})
         full_cont_list = get_containers(self.fake_data['containers'])
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.stop_container()
 
         self.assertFalse(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('fake_container')
         for cont in full_cont_list:
             cont.stop.assert_not_called()
         self.pw.systemd.stop.assert_not_called()
@@ -543,15 +564,11 @@ class TestContainer(base.BaseTestCase):
                                     'action': 'stop_and_remove_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
         my_container = full_cont_list[0]
-        self.pw.pc.containers.list.side_effect = [
-            full_cont_list,
-            full_cont_list,
-            full_cont_list
-        ]
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.stop_and_remove_container()
 
         self.assertTrue(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_with(all=True)
+        self.pw.pc.containers.get.assert_called_with('my_container')
         self.pw.systemd.stop.assert_called_once()
         my_container.remove.assert_called_once_with(force=True)
 
@@ -559,11 +576,11 @@ class TestContainer(base.BaseTestCase):
         self.pw = get_PodmanWorker({'name': 'fake_container',
                                     'action': 'stop_and_remove_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.stop_and_remove_container()
 
         self.assertFalse(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_with(all=True)
+        self.pw.pc.containers.get.assert_called_with('fake_container')
         self.assertFalse(self.pw.systemd.stop.called)
         for cont in full_cont_list:
             self.assertFalse(cont.remove.called)
@@ -571,23 +588,23 @@ class TestContainer(base.BaseTestCase):
     def test_restart_container(self):
         self.pw = get_PodmanWorker({'name': 'my_container',
                                     'action': 'restart_container'})
-        self.pw.pc.containers.list.return_value = get_containers(
-            self.fake_data['containers'])
+        self.pw.pc.containers.get.side_effect = containers_get(
+            get_containers(self.fake_data['containers']))
         self.pw.restart_container()
 
         self.assertTrue(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
         self.pw.systemd.restart.assert_called_once_with()
 
     def test_restart_container_not_exists(self):
         self.pw = get_PodmanWorker({'name': 'fake-container',
                                     'action': 'restart_container'})
-        self.pw.pc.containers.list.return_value = get_containers(
-            self.fake_data['containers'])
+        self.pw.pc.containers.get.side_effect = containers_get(
+            get_containers(self.fake_data['containers']))
         self.pw.restart_container()
 
         self.assertFalse(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('fake-container')
         self.pw.module.fail_json.assert_called_once_with(
             msg="No such container: fake-container")
 
@@ -596,12 +613,12 @@ class TestContainer(base.BaseTestCase):
                                     'action': 'restart_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
         my_container = full_cont_list[0]
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         self.pw.systemd.restart = mock.Mock(return_value=False)
         self.pw.restart_container()
 
         self.assertTrue(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
         self.pw.systemd.restart.assert_called_once_with()
         self.pw.module.fail_json.assert_called_once_with(
             changed=True, msg="Container timed out", **my_container.attrs)
@@ -610,14 +627,69 @@ class TestContainer(base.BaseTestCase):
         self.pw = get_PodmanWorker({'name': 'my_container',
                                     'action': 'remove_container'})
         full_cont_list = get_containers(self.fake_data['containers'])
-        self.pw.pc.containers.list.return_value = full_cont_list
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
         my_container = full_cont_list[0]
         self.pw.remove_container()
 
         self.assertTrue(self.pw.changed)
-        self.pw.pc.containers.list.assert_called_once_with(all=True)
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
         my_container.remove.assert_called_once_with(force=True)
 
+    def test_remove_container_forgets_container(self):
+        self.pw = get_PodmanWorker({'name': 'my_container',
+                                    'action': 'remove_container'})
+        full_cont_list = get_containers(self.fake_data['containers'])
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
+        self.pw.remove_container()
+
+        self.assertIsNone(self.pw.check_container())
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
+
+    def test_lookups_served_from_snapshot(self):
+        self.pw = get_PodmanWorker({'name': 'my_container',
+                                    'image': 'myregistrydomain.com:5000/'
+                                             'ubuntu:16.04'})
+        full_cont_list = get_containers(self.fake_data['containers'])
+        self.pw.pc.containers.get.side_effect = containers_get(full_cont_list)
+        self.pw.pc.images.get.return_value = construct_image(
+            self.fake_data['images'][0])
+
+        for _ in range(2):
+            self.assertEqual(full_cont_list[0].attrs,
+                             self.pw.get_container_info())
+            self.assertEqual(self.fake_data['images'][0],
+                             self.pw.check_image())
+
+        self.pw.pc.containers.get.assert_called_once_with('my_container')
+        self.pw.pc.images.get.assert_called_once_with(
+            'myregistrydomain.com:5000/ubuntu:16.04')
+        self.assertEqual(2, self.pw.snapshot.api_calls)
+
+    def test_compare_containers(self):
+        self.pw = get_PodmanWorker({
+            'action': 'compare_containers',
+            'containers': [{'name': 'my_container'},
+                           {'name': 'missing_container'}]})
+        self.pw.pc.containers.get.side_effect = containers_get(
+            get_containers(self.fake_data['containers']))
+        self.pw.check_container_differs = mock.Mock(return_value=[])
+        self.pw._check_config = mock.Mock(return_value=(False, None))
+
+        with mock.patch('ansible.module_utils.kolla_container_worker.'
+                        'SystemdWorker') as mock_systemd:
+            mock_systemd.return_value.check_unit_change.return_value = False
+            self.assertTrue(self.pw.compare_containers())
+
+        self.assertEqual(
+            {'missing_container': [{'name': 'container_missing',
+                                    'current': None,
+                                    'desired': 'missing_container'}]},
+            self.pw.result['comparison_failures'])
+        self.pw.pc.containers.get.assert_has_calls(
+            [mock.call('my_container'), mock.call('missing_container')])
+        self.assertEqual(2, self.pw.snapshot.api_calls)
+        self.pw._check_config.assert_called_once_with('my_container')
+
     def test_remove_container_api_error(self):
         self.pw = get_PodmanWorker({'name': 'my_container',
                                     'action': 'remove_container'})
@@ -703,6 +775,60 @@ class TestContainer(base.BaseTestCase):
         self.pw.start_container.assert_called_once_with()
 
 
+class FakePodmanContainers(object):
+    """Stand-in for PodmanClient.containers holding many containers
+
+    Listing is not supported, so any lookup falling back to a scan of all
+    containers fails the test.
+    """
+
+    def __init__(self, count):
+        self.inspected = 0
+        self._containers = {}
+        for i in range(count):
+            cont = construct_container({'Name': 'container_%d' % i,
+                                        'State': {'Status': 'running'}})
+            self._containers[cont.name] = cont
+
+    def get(self, key):
+        self.inspected += 1
+        try:
+            return self._containers[key]
+        except KeyError:
+            raise podman_error.NotFound(
+                'no container with name or ID "{}" found'.format(key))
+
+    def list(self, **kwargs):
+        raise AssertionError('containers should not be listed')
+
+
+class TestContainerLookupScale(base.BaseTestCase):
+
+    def _lookup(self, count, name):
+        self.pw = get_PodmanWorker({'name': name})
+        self.pw.pc.containers = FakePodmanContainers(count)
+        return self.pw.check_container()
+
+    def test_lookup_cost_independent_of_container_count(self):
+        for count in (5, 500):
+            container = self._lookup(count, 'container_3')
+            self.assertEqual('container_3', container.name)
+            self.assertEqual(1, self.pw.pc.containers.inspected)
+            self.assertEqual(1, self.pw.snapshot.api_calls)
+            for cont in self.pw.pc.containers._containers.values():
+                cont.reload.assert_not_called()
+
+    def test_lookup_missing(self):
+        self.assertIsNone(self._lookup(500, 'container_500'))
+        self.assertEqual(1, self.pw.pc.containers.inspected)
+
+    def test_lookup_id_prefix_is_not_a_name_match(self):
+        self.pw = get_PodmanWorker({'name': '1663dfafec3b'})
+        self.pw.pc.containers.get.return_value = construct_container(
+            FAKE_DATA['containers'][0])
+        self.assertIsNone(self.pw.check_container())
+
+
 class TestImage(base.BaseTestCase):
     def setUp(self):
         super(TestImage, self).setUp()
@@ -846,6 +972,22 @@ class TestImage(base.BaseTestCase):
             pwm.COMPARE_CONFIG_CMD,
             user='root')
 
+    def _pull_response(self, statuses):
+        response = mock.Mock()
+        response.iter_lines.return_value = iter(
+            [json.dumps(status).encode('utf-8') for status in statuses])
+        self.pw.pc.api.post.return_value = response
+        return response
+
+    def _assert_pulled(self, headers=None):
+        self.pw.pc.api.post.assert_called_once_with(
+            '/images/pull',
+            params={'reference': 'myregistrydomain.com:5000/ubuntu:16.04',
+                    'tlsVerify': False,
+                    'compatMode': True},
+            headers=headers or {},
+            stream=True)
+
     def test_pull_image_new(self):
         self.pw = get_PodmanWorker(
             {'image': 'myregistrydomain.com:5000/ubuntu:16.04',
@@ -854,81 +996,95 @@ class TestImage(base.BaseTestCase):
              'auth_registry': 'myrepo/myapp',
              'auth_email': 'fake_mail@foogle.com'
              })
-        self.pw.pc.images.pull.return_value = construct_image(
-            self.fake_data['images'][0])
-        self.pw.pc.images.get.return_value = construct_image({})
+        self._pull_response([
+            {'status': 'Downloading', 'id': '22f7',
+             'progressDetail': {'current': 1000, 'total': 3000}},
+            {'status': 'Download complete', 'progressDetail': {},
+             'id': '22f7'},
+            {'status': 'Already exists', 'progressDetail': {}, 'id': '9c1a'},
+            {'status': 'Pull complete', 'progressDetail': {}, 'id': '22f7'},
+        ])
+        self.pw.pc.images.get.side_effect = [
+            construct_image({}),
+            construct_image(self.fake_data['images'][0])]
 
         self.pw.pull_image()
-        self.pw.pc.images.pull.assert_called_once_with(
-            repository='myregistrydomain.com:5000/ubuntu',
-            tag='16.04',
-            tls_verify=False,
-            stream=False,
-            auth_config={'username': 'fake_user',
-                         'password': 'fake_psw'}  # nosec B105
-        )
+        auth = base64.urlsafe_b64decode(
+            self.pw.pc.api.post.call_args[1]['headers']['X-Registry-Auth'])
+        self.assertEqual({'username': 'fake_user',
+                          'password': 'fake_psw'},  # nosec B105
+                         json.loads(auth))
+        self._assert_pulled(headers=mock.ANY)
         self.assertTrue(self.pw.changed)
+        stats = self.pw.result['pull_stats']
+        self.assertEqual({'22f7': 3000, '9c1a': 0}, stats['layers'])
+        self.assertEqual(3000, stats['total_bytes'])
 
     def test_pull_image_exists(self):
         self.pw = get_PodmanWorker(
-            {'image': 'myregistrydomain.com:5000/ubuntu:16.04',
-             'auth_username': 'fake_user',
-             'auth_password': 'fake_psw',  # nosec B105
-             'auth_registry': 'myrepo/myapp',
-             'auth_email': 'fake_mail@foogle.com'
-             })
+            {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
+        self._pull_response([
+            {'status': 'Digest: sha256:47c3bdbf0c1a36e4db'},
+            {'status': 'Image is up to date for ubuntu:16.04'}])
         image = construct_image(self.fake_data['images'][0])
-        self.pw.pc.images.pull.return_value = image
         self.pw.pc.images.get.return_value = image
 
         self.pw.pull_image()
-        self.pw.pc.images.pull.assert_called_once_with(
-            repository='myregistrydomain.com:5000/ubuntu',
-            tag='16.04',
-            tls_verify=False,
-            stream=False,
-            auth_config={'username': 'fake_user',
-                         'password': 'fake_psw'}  # nosec B105
-        )
+        self._assert_pulled()
         self.assertFalse(self.pw.changed)
+        self.assertEqual(0, self.pw.result['pull_stats']['total_bytes'])
 
     def test_pull_image_not_exists(self):
         self.pw = get_PodmanWorker(
-            {'image': 'unknown:16.04'})
-        self.pw.pc.images.pull.return_value = construct_image({})
+            {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
+        self.pw.pc.api.post.return_value.raise_for_status.side_effect = (
+            podman_error.NotFound("image not known"))
         self.pw.check_image = mock.Mock(return_value={})
 
         self.pw.pull_image()
-        self.pw.pc.images.pull.assert_called_once_with(
-            repository='unknown',
-            tag='16.04',
-            tls_verify=False,
-            stream=False,
-        )
+        self._assert_pulled()
         self.assertFalse(self.pw.changed)
         self.pw.module.fail_json.assert_called_once_with(
-            msg="The requested image does not exist: unknown:16.04",
+            msg="The requested image does not exist: "
+                "myregistrydomain.com:5000/ubuntu:16.04",
+            failed=True)
+
+    def test_pull_image_manifest_unknown(self):
+        self.pw = get_PodmanWorker(
+            {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
+        self._pull_response([
+            {'error': 'reading manifest 16.04: manifest unknown'}])
+        self.pw.check_image = mock.Mock(return_value={})
+
+        self.pw.pull_image()
+        self.pw.module.fail_json.assert_called_once_with(
+            msg="The requested image does not exist: "
+                "myregistrydomain.com:5000/ubuntu:16.04",
             failed=True)
 
     def test_pull_image_error(self):
         self.pw = get_PodmanWorker(
             {'image': 'myregistrydomain.com:5000/ubuntu:16.04'})
-        self.pw.pc.images.pull = mock.Mock(
-            side_effect=podman_error.APIError("unexpected error"))
+        response = self._pull_response([
+            {'status': 'Downloading', 'id': '22f7',
+             'progressDetail': {'current': 1000, 'total': 3000}},
+            {'error': 'unexpected error'},
+            {'status': 'Download complete', 'progressDetail': {},
+             'id': '22f7'},
+        ])
         self.pw.pc.images.get.return_value = construct_image(
             self.fake_data['images'][0])
 
         self.pw.pull_image()
-        self.pw.pc.images.pull.assert_called_once_with(
-            repository='myregistrydomain.com:5000/ubuntu',
-            tag='16.04',
-            tls_verify=False,
-            stream=False
-        )
+        self._assert_pulled()
         self.assertFalse(self.pw.changed)
         self.pw.module.fail_json.assert_called_once_with(
             msg="Unknown error message: unexpected error",
             failed=True)
+        # The stream is not read past the first error.
+        self.assertEqual(1, len(list(response.iter_lines.return_value)))
+        self.assertEqual({'22f7': 1000},
+                         self.pw.result['pull_stats']['layers'])
 
     def test_remove_image(self):
         self.pw = get_PodmanWorker(
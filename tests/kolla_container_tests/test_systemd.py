@@ -30,6 +30,10 @@ swm = SourceFileLoader('kolla_systemd_worker',
                        systemd_worker_file).load_module()
 
 
+class DBusExceptionStub(Exception):
+    pass
+
+
 class TestSystemd(base.BaseTestCase):
     def setUp(self) -> None:
         super(TestSystemd, self).setUp()
@@ -171,6 +175,20 @@ class TestSystemd(base.BaseTestCase):
         self.sw.reload.assert_called_once()
         self.sw.enable.assert_called_once()
 
+    def test_write_unit_file(self):
+        self.sw.generate_unit_file = mock.Mock(return_value='test data')
+        self.sw.check_unit_change = mock.Mock(return_value=True)
+        self.sw.reload = mock.Mock()
+        self.sw.enable = mock.Mock()
+        open_mock = mock.mock_open()
+
+        with mock.patch('builtins.open', open_mock, create=True):
+            self.assertTrue(self.sw.write_unit_file())
+
+        open_mock.return_value.write.assert_called_once_with('test data')
+        self.sw.reload.assert_not_called()
+        self.sw.enable.assert_not_called()
+
     def test_create_unit_file_no_change(self):
         self.sw.generate_unit_file = mock.Mock()
         self.sw.check_unit_change = mock.Mock(return_value=False)
@@ -199,27 +217,37 @@ class TestSystemd(base.BaseTestCase):
         self.sw.reload.assert_called_once()
 
     def test_get_unit_state(self):
-        unit_list = [
-            ('foo.service', '', 'loaded', 'active', 'exited'),
-            ('kolla-test-container.service', '', 'loaded', 'active', 'running')
-        ]
-        self.sw.manager.ListUnits = mock.Mock(return_value=unit_list)
+        self.sw.manager = mock.Mock()
+        self.sw.manager.GetUnit.return_value = (
+            '/org/freedesktop/systemd1/unit/kolla_2dtest')
+        self.sw.bus = mock.Mock()
+        properties = self.sw.bus.get_object.return_value
+        with mock.patch.object(swm.dbus, 'Interface') as mock_interface:
+            mock_interface.return_value.Get.return_value = 'running'
 
-        state = self.sw.get_unit_state()
+            state = self.sw.get_unit_state()
 
-        self.sw.manager.ListUnits.assert_called_once()
         self.assertEqual('running', state)
-
+        self.sw.manager.GetUnit.assert_called_once_with(
+            'kolla-test-container.service')
+        self.sw.bus.get_object.assert_called_once_with(
+            'org.freedesktop.systemd1',
+            '/org/freedesktop/systemd1/unit/kolla_2dtest')
+        mock_interface.assert_called_once_with(
+            properties, 'org.freedesktop.DBus.Properties')
+        mock_interface.return_value.Get.assert_called_once_with(
+            'org.freedesktop.systemd1.Unit', 'SubState')
+
+    @mock.patch.object(swm.dbus.exceptions, 'DBusException',
+                       DBusExceptionStub)
     def test_get_unit_state_not_exist(self):
-        unit_list = [
-            ('foo.service', '', 'loaded', 'active', 'exited'),
-            ('bar.service', '', 'loaded', 'active', 'running')
-        ]
-        self.sw.manager.ListUnits = mock.Mock(return_value=unit_list)
+        self.sw.manager = mock.Mock()
+        self.sw.manager.GetUnit.side_effect = DBusExceptionStub('NoSuchUnit')
 
         state = self.sw.get_unit_state()
 
-        self.sw.manager.ListUnits.assert_called_once()
+        self.sw.manager.GetUnit.assert_called_once_with(
+            'kolla-test-container.service')
         self.assertIsNone(state)
 
     def test_wait_for_unit(self):
@@ -229,12 +257,70 @@ class TestSystemd(base.BaseTestCase):
         result = self.sw.wait_for_unit(10)
 
         self.assertTrue(result)
+        swm.sleep.assert_called_once_with(0.1)
+
+    def test_wait_for_unit_immediate(self):
+        self.sw.get_unit_state = mock.Mock(return_value='running')
+
+        result = self.sw.wait_for_unit(10)
+
+        self.assertTrue(result)
+        swm.sleep.assert_not_called()
 
     def test_wait_for_unit_timeout(self):
-        self.sw.get_unit_state = mock.Mock()
-        self.sw.get_unit_state.side_effect = [
-            'starting', 'starting', 'failed', 'failed']
+        self.sw.get_unit_state = mock.Mock(return_value='failed')
 
         result = self.sw.wait_for_unit(10)
 
         self.assertFalse(result)
+        delays = [c[0][0] for c in swm.sleep.call_args_list]
+        self.assertEqual(1, max(delays))
+        self.assertGreaterEqual(sum(delays), 10)
+        self.assertLess(sum(delays), 11)
+
+    def test_wait_for_unit_dead_unloaded(self):
+        self.sw.get_unit_state = mock.Mock(return_value=None)
+
+        self.assertTrue(self.sw.wait_for_unit(10, state='dead'))
+
+
+class TestSystemdUnits(base.BaseTestCase):
+    def setUp(self) -> None:
+        super(TestSystemdUnits, self).setUp()
+        swm.sleep = mock.Mock()
+        self.workers = []
+        for name in ('foo', 'bar', 'baz'):
+            worker = swm.SystemdWorker(dict(name=name,
+                                            restart_policy='no',
+                                            client_timeout=120,
+                                            restart_retries=10,
+                                            graceful_timeout=15))
+            worker.manager = mock.Mock()
+            worker.write_unit_file = mock.Mock(return_value=name != 'bar')
+            self.workers.append(worker)
+
+    def test_create_unit_files(self):
+        changed = swm.create_unit_files(self.workers)
+
+        self.assertEqual([self.workers[0], self.workers[2]], changed)
+        for worker in self.workers:
+            worker.write_unit_file.assert_called_once_with()
+        manager = self.workers[0].manager
+        manager.Reload.assert_called_once()
+        manager.EnableUnitFiles.assert_called_once_with(
+            ['kolla-foo-container.service', 'kolla-baz-container.service'],
+            False,
+            True
+        )
+        self.workers[1].manager.Reload.assert_not_called()
+        self.workers[2].manager.Reload.assert_not_called()
+
+    def test_create_unit_files_no_change(self):
+        for worker in self.workers:
+            worker.write_unit_file.return_value = False
+
+        self.assertEqual([], swm.create_unit_files(self.workers))
+
+        for worker in self.workers:
+            worker.manager.Reload.assert_not_called()
+            worker.manager.EnableUnitFiles.assert_not_called()
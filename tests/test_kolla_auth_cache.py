@@ -0,0 +1,93 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from importlib.machinery import SourceFileLoader
+import json
+import os
+import sys
+from unittest import mock
+
+import fixtures
+from oslotest import base
+
+this_dir = os.path.dirname(sys.modules[__name__].__file__)
+ansible_dir = os.path.join(this_dir, '..', 'ansible')
+auth_cache_file = os.path.join(ansible_dir,
+                               'module_utils', 'kolla_auth_cache.py')
+kac = SourceFileLoader('kolla_auth_cache', auth_cache_file).load_module()
+
+# 2024-05-01T10:00:00Z
+NOW = 1714557600.0
+
+
+def auth_state(token, expires_at='2024-05-01T11:00:00.000000Z'):
+    return json.dumps({'auth_token': token,
+                       'body': {'token': {'expires_at': expires_at}}})
+
+
+@mock.patch('time.time', return_value=NOW)
+class TestAuthCache(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestAuthCache, self).setUp()
+        self.path = os.path.join(self.useFixture(fixtures.TempDir()).path,
+                                 'kolla-auth')
+        self.cache = kac.AuthCache(self.path)
+
+    def test_get_missing(self, mock_time):
+        self.assertIsNone(self.cache.get('openstacksdk/id'))
+        self.assertIsNone(self.cache.tokens_issued())
+
+    def test_set_get(self, mock_time):
+        state = auth_state('token1')
+        self.cache.set('openstacksdk/id', state)
+
+        self.assertEqual(state, self.cache.get('openstacksdk/id'))
+        self.assertIsNone(self.cache.get('openstacksdk/other'))
+        self.assertEqual(0o700, os.stat(self.path).st_mode & 0o777)
+        for name in os.listdir(self.path):
+            mode = os.stat(os.path.join(self.path, name)).st_mode
+            self.assertEqual(0, mode & 0o077)
+
+    def test_get_expiring(self, mock_time):
+        self.cache.set('openstacksdk/id',
+                       auth_state('token1', '2024-05-01T10:01:59Z'))
+
+        self.assertIsNone(self.cache.get('openstacksdk/id'))
+
+    def test_get_v2(self, mock_time):
+        state = json.dumps({'auth_token': 'token1', 'body': {  # nosec B105
+            'access': {'token': {'expires': '2024-05-01T11:00:00Z'}}}})
+        self.cache.set('openstacksdk/id', state)
+
+        self.assertEqual(state, self.cache.get('openstacksdk/id'))
+
+    def test_get_invalid(self, mock_time):
+        self.cache.set('openstacksdk/id', 'not json')
+
+        self.assertIsNone(self.cache.get('openstacksdk/id'))
+
+    def test_tokens_issued(self, mock_time):
+        self.cache.set('openstacksdk/admin', auth_state('token1'))
+        # Storing the state of a reused token does not count.
+        self.cache.set('openstacksdk/admin', auth_state('token1'))
+        self.cache.set('openstacksdk/admin', auth_state('token2'))
+        self.cache.set('openstacksdk/octavia', auth_state('token3'))
+
+        self.assertEqual(3, self.cache.tokens_issued())
+
+    def test_delete(self, mock_time):
+        self.cache.set('openstacksdk/id', auth_state('token1'))
+        self.cache.delete('openstacksdk/id')
+        self.cache.delete('openstacksdk/id')
+
+        self.assertIsNone(self.cache.get('openstacksdk/id'))
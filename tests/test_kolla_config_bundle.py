@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import base64
+from importlib.machinery import SourceFileLoader
+import os
+import sys
+from unittest import mock
+
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+import fixtures
+from oslotest import base
+
+
+this_dir = os.path.dirname(sys.modules[__name__].__file__)
+ansible_dir = os.path.join(this_dir, '..', 'ansible')
+kcb = SourceFileLoader(
+    'kolla_config_bundle',
+    os.path.join(ansible_dir, 'library', 'kolla_config_bundle.py')
+).load_module()
+kcb_action = SourceFileLoader(
+    'kolla_config_bundle_action',
+    os.path.join(ansible_dir, 'action_plugins', 'kolla_config_bundle.py')
+).load_module()
+merge_configs = SourceFileLoader(
+    'merge_configs',
+    os.path.join(ansible_dir, 'action_plugins', 'merge_configs.py')
+).load_module()
+
+
+class TestUnpack(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestUnpack, self).setUp()
+        self.dest = self.useFixture(fixtures.TempDir()).path
+        self.files = {
+            'nova-api/nova.conf': ('[DEFAULT]\ndebug = True\n', '0660'),
+            'nova-api/config.json': ('{}', '0660'),
+            'nova-compute/nova.conf': ('[DEFAULT]\n', '0600'),
+        }
+
+    def _unpack(self, check_mode=False, diff=False):
+        changed, diffs = kcb.unpack(
+            self.dest, kcb_action.build_bundle(self.files),
+            check_mode=check_mode, diff=diff)
+        return (changed, diffs) if diff else changed
+
+    def _read(self, path):
+        with open(os.path.join(self.dest, path)) as f:
+            return f.read()
+
+    def test_unpack(self):
+        changed = self._unpack()
+
+        self.assertEqual(sorted(self.files), changed)
+        for path, (content, mode) in self.files.items():
+            self.assertEqual(content, self._read(path))
+            self.assertEqual(
+                int(mode, 8),
+                os.stat(os.path.join(self.dest, path)).st_mode & 0o7777)
+        self.assertFalse(os.path.exists(
+            os.path.join(self.dest, kcb.MANIFEST)))
+
+    def test_unpack_only_changed(self):
+        self._unpack()
+        self.files['nova-api/nova.conf'] = ('[DEFAULT]\n', '0660')
+        self.files['nova-compute/nova.conf'] = ('[DEFAULT]\n', '0660')
+        other = os.path.join(self.dest, 'nova-api', 'other.conf')
+        with open(other, 'w') as f:
+            f.write('other')
+
+        self.assertEqual(['nova-api/nova.conf', 'nova-compute/nova.conf'],
+                         self._unpack())
+        self.assertEqual('[DEFAULT]\n', self._read('nova-api/nova.conf'))
+        # Files not in the bundle are left alone.
+        self.assertEqual('other', self._read('nova-api/other.conf'))
+        self.assertEqual([], self._unpack())
+
+    def test_unpack_check_mode(self):
+        self.assertEqual(sorted(self.files), self._unpack(check_mode=True))
+        self.assertEqual([], os.listdir(self.dest))
+
+    def test_unpack_diff(self):
+        self._unpack()
+        self.files['nova-api/nova.conf'] = ('[DEFAULT]\n', '0660')
+
+        changed, diffs = self._unpack(check_mode=True, diff=True)
+
+        path = os.path.join(self.dest, 'nova-api', 'nova.conf')
+        self.assertEqual(['nova-api/nova.conf'], changed)
+        self.assertEqual(
+            [{'before_header': path, 'after_header': path,
+              'before': '[DEFAULT]\ndebug = True\n',
+              'after': '[DEFAULT]\n'}],
+            diffs)
+
+    def test_unpack_failure_removes_temporary_file(self):
+        with mock.patch.object(kcb.os, 'replace',
+                               side_effect=OSError('busy')):
+            self.assertRaises(OSError, self._unpack)
+
+        self.assertEqual([], os.listdir(os.path.join(self.dest, 'nova-api')))
+
+    def test_unpack_invalid_path(self):
+        for path in ('../escape', '/etc/passwd', 'no-service'):
+            self.files = {path: ('', '0660')}
+            self.assertRaisesRegex(ValueError, 'Invalid path',
+                                   self._unpack)
+
+
+class TestBundleAction(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestBundleAction, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.template = os.path.join(self.tmp, 'config.json.j2')
+        with open(self.template, 'w') as f:
+            f.write('{"command": "{{ service_name }}"}')
+        self.conf = os.path.join(self.tmp, 'nova.conf.j2')
+        with open(self.conf, 'w') as f:
+            f.write('[DEFAULT]\nhost = {{ inventory_hostname }}\n')
+
+    def _run(self, files):
+        task = mock.MagicMock(async_val=0)
+        task.args = dict(dest='/etc/kolla', files=files)
+        loader = DataLoader()
+        templar = Templar(loader=loader)
+        args = (task, mock.MagicMock(), mock.MagicMock(), loader, templar)
+        shared_loader_obj = mock.MagicMock()
+        shared_loader_obj.action_loader.get.side_effect = (
+            lambda name, **kwargs: merge_configs.ActionModule(
+                *args, shared_loader_obj))
+        action = kcb_action.ActionModule(*args, shared_loader_obj)
+        action._shared_loader_obj = shared_loader_obj
+        action._remove_tmp_path = mock.Mock()
+        action._find_needle = mock.Mock(side_effect=lambda _, path: path)
+        action._execute_module = mock.Mock(return_value={'changed': True})
+        result = action.run(task_vars={'inventory_hostname': 'compute1'})
+        module_args = action._execute_module.call_args[1]['module_args']
+        return result, module_args
+
+    def test_run(self):
+        result, module_args = self._run([
+            {'dest': 'nova-api/config.json', 'template': self.template,
+             'vars': {'service_name': 'nova-api'}},
+            {'dest': 'nova-api/nova.conf', 'merge_configs': [self.conf],
+             'mode': 0o600},
+            {'dest': 'nova-api/policy.yaml', 'content': 'rules: {}\n',
+             'enabled': 'False'},
+        ])
+
+        self.assertTrue(result['changed'])
+        self.assertEqual('/etc/kolla', module_args['dest'])
+        dest = self.useFixture(fixtures.TempDir()).path
+        changed, _ = kcb.unpack(dest,
+                                base64.b64decode(module_args['bundle']))
+        self.assertEqual(['nova-api/config.json', 'nova-api/nova.conf'],
+                         changed)
+        with open(os.path.join(dest, 'nova-api', 'config.json')) as f:
+            self.assertEqual('{"command": "nova-api"}', f.read())
+        with open(os.path.join(dest, 'nova-api', 'nova.conf')) as f:
+            self.assertEqual('[DEFAULT]\nhost = compute1\n\n', f.read())
+        self.assertEqual(
+            0o600,
+            os.stat(os.path.join(dest, 'nova-api', 'nova.conf')).st_mode &
+            0o7777)
@@ -15,11 +15,26 @@
 
 # FIXME(yoctozepto): tests do not imitate how ansible would handle module args
 
+import contextlib
 from importlib.machinery import SourceFileLoader
+import json
 import os
 import sys
 from unittest import mock
 
+from ansible.module_utils import basic
+from ansible.module_utils.common.text.converters import to_bytes
+try:
+    from ansible.module_utils.testing import patch_module_args
+except ImportError:
+    # TODO(dougszu): Remove this exception handler when Python 3.10 support
+    # is not required. Python 3.10 isn't supported by Ansible Core 2.18 which
+    # provides patch_module_args
+    @contextlib.contextmanager
+    def patch_module_args(args):
+        serialized_args = to_bytes(json.dumps({'ANSIBLE_MODULE_ARGS': args}))
+        with mock.patch.object(basic, '_ANSIBLE_ARGS', serialized_args):
+            yield
 from oslotest import base
 
 this_dir = os.path.dirname(sys.modules[__name__].__file__)
@@ -40,10 +55,12 @@ class ModuleArgsTest(base.BaseTestCase):
             action=dict(
                 required=True, type='str',
                 choices=['compare_container',
+                         'compare_containers',
                          'compare_image',
                          'create_volume',
                          'ensure_image',
                          'pull_image',
+                         'pull_images',
                          'recreate_or_restart_container',
                          'remove_container',
                          'remove_image',
@@ -51,7 +68,8 @@ class ModuleArgsTest(base.BaseTestCase):
                          'restart_container',
                          'start_container',
                          'stop_container',
-                         'stop_and_remove_container']),
+                         'stop_and_remove_container',
+                         'update_unit_files']),
             api_version=dict(required=False, type='str'),
             auth_email=dict(required=False, type='str'),
             auth_password=dict(required=False, type='str', no_log=True),
@@ -59,11 +77,13 @@ class ModuleArgsTest(base.BaseTestCase):
             auth_username=dict(required=False, type='str'),
             command=dict(required=False, type='str'),
             container_engine=dict(required=False, type='str'),
+            containers=dict(required=False, type='list', elements='dict'),
             detach=dict(required=False, type='bool', default=True),
             labels=dict(required=False, type='dict', default=dict()),
             name=dict(required=False, type='str'),
             environment=dict(required=False, type='dict'),
             image=dict(required=False, type='str'),
+            images=dict(required=False, type='list', elements='str'),
             ipc_mode=dict(required=False, type='str', choices=['',
                                                                'host',
                                                                'private',
@@ -76,6 +96,9 @@ class ModuleArgsTest(base.BaseTestCase):
             cgroupns_mode=dict(required=False, type='str',
                                choices=['private', 'host']),
             privileged=dict(required=False, type='bool', default=False),
+            pull_concurrency=dict(required=False, type='int', default=4),
+            pull_retries=dict(required=False, type='int', default=3),
+            pull_retry_delay=dict(required=False, type='int', default=5),
             graceful_timeout=dict(required=False, type='int'),
             remove_on_exit=dict(required=False, type='bool', default=True),
             restart_policy=dict(
@@ -102,10 +125,25 @@ class ModuleArgsTest(base.BaseTestCase):
             healthcheck=dict(required=False, type='dict'),
             ignore_missing=dict(required=False, type='bool', default=False),
         )
+        module_options = ('action', 'api_version', 'auth_email',
+                          'auth_password', 'auth_registry', 'auth_username',
+                          'client_timeout', 'common_options',
+                          'container_engine', 'containers', 'images',
+                          'pull_concurrency', 'pull_retries',
+                          'pull_retry_delay', 'tls_cacert', 'tls_cert',
+                          'tls_key', 'tls_verify')
+        container_options = {
+            key: {k: v for k, v in spec.items() if k != 'default'}
+            for key, spec in argument_spec.items()
+            if key not in module_options}
+        container_options['name'] = dict(required=True, type='str')
+        argument_spec['containers']['options'] = container_options
         required_if = [
             ['action', 'pull_image', ['image']],
+            ['action', 'pull_images', ['images']],
             ['action', 'start_container', ['image', 'name']],
             ['action', 'compare_container', ['name']],
+            ['action', 'compare_containers', ['containers']],
             ['action', 'compare_image', ['name']],
             ['action', 'create_volume', ['name']],
             ['action', 'ensure_image', ['image']],
@@ -116,12 +154,35 @@ class ModuleArgsTest(base.BaseTestCase):
             ['action', 'restart_container', ['name']],
             ['action', 'stop_container', ['name']],
             ['action', 'stop_and_remove_container', ['name']],
+            ['action', 'update_unit_files', ['containers']],
         ]
 
-        kc.AnsibleModule = mock.MagicMock()
-        kc.generate_module()
-        kc.AnsibleModule.assert_called_with(
+        with mock.patch.object(kc, 'AnsibleModule') as ansible_module:
+            kc.generate_module()
+        ansible_module.assert_called_with(
             argument_spec=argument_spec,
             required_if=required_if,
             bypass_checks=False
         )
+
+    def test_containers_normalized(self):
+        args = {
+            'action': 'compare_containers',
+            'containers': [
+                {'name': 'my_container', 'privileged': 'yes',
+                 'graceful_timeout': '60', 'cap_add': 'NET_ADMIN,SYS_ADMIN'},
+                {'name': 'other_container'},
+            ],
+        }
+
+        with patch_module_args(args):
+            module = kc.generate_module()
+
+        first, second = module.params['containers']
+        self.assertIs(True, first['privileged'])
+        self.assertEqual(60, first['graceful_timeout'])
+        self.assertEqual(['NET_ADMIN', 'SYS_ADMIN'], first['cap_add'])
+        # Unset options are left to the module parameters.
+        self.assertIsNone(second['privileged'])
+        self.assertIsNone(second['graceful_timeout'])
+        self.assertNotIn('container_engine', second)
@@ -20,6 +20,7 @@
 
 import copy
 from importlib.machinery import SourceFileLoader
+import json
 import os
 import sys
 from unittest import mock
@@ -86,10 +87,11 @@ FAKE_DATA = {
 
 
 @mock.patch('docker.DockerClient')
-def get_DockerFactsWorker(mod_param, mock_client):
+def get_DockerFactsWorker(mod_param, mock_client, agent=None):
     module = mock.MagicMock()
     module.params = copy.deepcopy(mod_param)
-    dfw = kcf.DockerFactsWorker(module)
+    with mock.patch.object(kcf.AgentClient, 'connect', return_value=agent):
+        dfw = kcf.DockerFactsWorker(module)
     return dfw
 
 
@@ -154,7 +156,8 @@ class TestContainerFacts(base.BaseTestCase):
         self.assertDictEqual(
             self.fake_data['containers'][0],
             self.dfw.result['containers']['my_container'])
-        self.dfw.client.containers.list.assert_called_once_with(all=False)
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True, filters={'name': ['^my_container$']})
 
     def test_get_containers_multi(self):
         self.dfw = get_DockerFactsWorker(
@@ -168,7 +171,9 @@ class TestContainerFacts(base.BaseTestCase):
         self.assertIn('my_container', self.dfw.result['containers'])
         self.assertNotIn('my_container', self.dfw.result)
         self.assertNotIn('exited_container', self.dfw.result['containers'])
-        self.dfw.client.containers.list.assert_called_once_with(all=False)
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True,
+            filters={'name': ['^my_container$', '^exited_container$']})
 
     def test_get_containers_all_running(self):
         self.dfw = get_DockerFactsWorker({'name': [],
@@ -181,7 +186,8 @@ class TestContainerFacts(base.BaseTestCase):
         self.assertIn('my_container', self.dfw.result['containers'])
         self.assertNotIn('my_container', self.dfw.result)
         self.assertNotIn('exited_container', self.dfw.result['containers'])
-        self.dfw.client.containers.list.assert_called_once_with(all=False)
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True)
 
     def test_get_containers_all_including_stopped(self):
         self.dfw = get_DockerFactsWorker({'name': [],
@@ -195,7 +201,226 @@ class TestContainerFacts(base.BaseTestCase):
         self.assertFalse(self.dfw.result['changed'])
         self.assertIn('my_container', self.dfw.result['containers'])
         self.assertIn('exited_container', self.dfw.result['containers'])
-        self.dfw.client.containers.list.assert_called_once_with(all=True)
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=True, sparse=True)
+
+    def test_get_containers_inspects_only_matching(self):
+        self.dfw = get_DockerFactsWorker({'name': ['my_container'],
+                                          'action': 'get_containers'})
+        prefixed = dict(self.fake_data['containers'][0],
+                        Name='my_container_2')
+        containers = get_containers([self.fake_data['containers'][0],
+                                     prefixed])
+        self.dfw.client.containers.list.return_value = containers
+        self.dfw.get_containers()
+
+        self.assertEqual(['my_container'],
+                         list(self.dfw.result['containers']))
+        containers[0].reload.assert_called_once_with()
+        containers[1].reload.assert_not_called()
+
+    def test_get_containers_fields(self):
+        self.dfw = get_DockerFactsWorker(
+            {'name': ['my_container'],
+             'action': 'get_containers',
+             'fields': ['State.Status', 'HostConfig.NetworkMode',
+                        'Config.Image', 'Name']})
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'])
+        self.dfw.get_containers()
+
+        self.assertEqual(
+            {'my_container': {'State': {'Status': 'running'},
+                              'HostConfig': {'NetworkMode': 'host'},
+                              'Name': 'my_container'}},
+            self.dfw.result['containers'])
+
+    def test_get_containers_fields_agent(self):
+        self.dfw = get_DockerFactsWorker({'name': ['my_container'],
+                                          'action': 'get_containers',
+                                          'fields': ['State.Status']},
+                                         agent=self._agent())
+        self.dfw.get_containers()
+
+        self.assertEqual({'my_container': {'State': {'Status': 'running'}}},
+                         self.dfw.result['containers'])
+
+    def _event(self, name, action):
+        return {'Type': 'container', 'Action': action,
+                'Actor': {'Attributes': {'name': name}}}
+
+    @mock.patch('time.time', return_value=1000.5)
+    def test_get_containers_since(self, mock_time):
+        cached = {'my_container': {'State': {'Status': 'running'}},
+                  'other_container': {'State': {'Status': 'running'}}}
+        self.dfw = get_DockerFactsWorker(
+            {'name': [],
+             'action': 'get_containers',
+             'args': {'since': 900.5, 'cached': cached}})
+        self.dfw.client.events.return_value = iter([
+            self._event('my_container', 'exec_start: healthcheck_curl'),
+            self._event('my_container', 'health_status: healthy'),
+            self._event('other_container', 'die'),
+            self._event('other_container', 'destroy'),
+        ])
+        self.dfw.client.containers.list.return_value = []
+
+        self.dfw.get_containers()
+        self.dfw.client.events.assert_called_once_with(
+            since=900, until=1001, filters={'type': 'container'},
+            decode=True)
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True,
+            filters={'name': ['^my_container$', '^other_container$']})
+        self.assertEqual({}, self.dfw.result['containers'])
+        self.assertEqual(['my_container', 'other_container'],
+                         self.dfw.result['refreshed_containers'])
+        self.assertEqual(1000.5, self.dfw.result['cursor'])
+
+    @mock.patch('time.time', return_value=1000.5)
+    def test_get_containers_since_podman(self, mock_time):
+        cached = {'my_container': {'State': {'Status': 'running'}}}
+        module = mock.MagicMock()
+        module.params = {'name': [],
+                         'action': 'get_containers',
+                         'args': {'since': 900.5, 'cached': cached}}
+        pfw = kcf.PodmanFactsWorker(module)
+        response = mock.Mock()
+        response.iter_lines.return_value = iter([json.dumps(
+            self._event('my_container', 'exec_start: healthcheck_curl'))])
+
+        with mock.patch.object(pfw.client.api, 'get',
+                               return_value=response) as mock_get:
+            pfw.get_containers()
+
+        self.assertEqual(900, mock_get.call_args[1]['params']['since'])
+        self.assertEqual(1001, mock_get.call_args[1]['params']['until'])
+        self.assertEqual(cached, pfw.result['containers'])
+        self.assertEqual([], pfw.result['refreshed_containers'])
+        self.assertEqual(1000.5, pfw.result['cursor'])
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_get_containers_since_merges_cached(self, mock_time):
+        cached = {'my_container': {'State': {'Status': 'running'}},
+                  'glance_api': {'State': {'Status': 'running'}}}
+        self.dfw = get_DockerFactsWorker(
+            {'name': ['my_container', 'glance_api'],
+             'action': 'get_containers',
+             'args': {'since': 900.0, 'cached': cached}})
+        self.dfw.client.events.return_value = iter([
+            self._event('my_container', 'start'),
+            self._event('nova_api', 'start'),
+        ])
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'])
+
+        self.dfw.get_containers()
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True, filters={'name': ['^my_container$']})
+        self.assertEqual(
+            {'my_container': self.fake_data['containers'][0],
+             'glance_api': {'State': {'Status': 'running'}}},
+            self.dfw.result['containers'])
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_get_containers_since_nothing_changed(self, mock_time):
+        cached = {'my_container': {'State': {'Status': 'running'}}}
+        self.dfw = get_DockerFactsWorker(
+            {'name': [],
+             'action': 'get_containers',
+             'args': {'since': 900.0, 'cached': cached}})
+        self.dfw.client.events.return_value = iter([])
+
+        self.dfw.get_containers()
+        self.dfw.client.containers.list.assert_not_called()
+        self.assertEqual(cached, self.dfw.result['containers'])
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_get_containers_since_expired(self, mock_time):
+        self.dfw = get_DockerFactsWorker(
+            {'name': [],
+             'action': 'get_containers',
+             'args': {'since': 1.0, 'cached': {}}})
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'])
+
+        self.dfw.get_containers()
+        self.dfw.client.events.assert_not_called()
+        self.assertIn('my_container', self.dfw.result['containers'])
+        self.assertNotIn('refreshed_containers', self.dfw.result)
+
+    @mock.patch('time.time', return_value=1000.0)
+    def test_get_containers_since_too_many_events(self, mock_time):
+        self.dfw = get_DockerFactsWorker(
+            {'name': [],
+             'action': 'get_containers',
+             'args': {'since': 900.0, 'cached': {}}})
+        self.dfw.client.events.return_value = iter(
+            [self._event('my_container', 'start')] *
+            kcf.CURSOR_MAX_EVENTS)
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'])
+
+        self.dfw.get_containers()
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True)
+        self.assertIn('my_container', self.dfw.result['containers'])
+
+    def _agent(self):
+        agent = mock.Mock()
+        listed = {
+            'my_container': {'Names': ['/my_container'], 'State': 'running'},
+            'exited_container': {'Names': ['/exited_container'],
+                                 'State': 'exited'},
+        }
+        inspected = {c['Name']: c for c in self.fake_data['containers']}
+        inspected['my_container']['State']['Health'] = {'Log': ['...']}
+
+        def call(query, **args):
+            if query == 'list':
+                return listed
+            return copy.deepcopy(inspected[args['name']])
+        agent.call.side_effect = call
+        return agent
+
+    def test_get_containers_agent(self):
+        self.dfw = get_DockerFactsWorker({'name': [],
+                                          'action': 'get_containers'},
+                                         agent=self._agent())
+        self.dfw.get_containers()
+
+        self.assertEqual(['my_container'],
+                         list(self.dfw.result['containers']))
+        self.assertEqual(
+            {}, self.dfw.result['containers']['my_container']['State'][
+                'Health'])
+        self.dfw.client.containers.list.assert_not_called()
+
+    def test_get_containers_agent_all(self):
+        self.dfw = get_DockerFactsWorker(
+            {'name': ['exited_container'],
+             'action': 'get_containers',
+             'args': {'get_all_containers': True}},
+            agent=self._agent())
+        self.dfw.get_containers()
+
+        self.assertDictEqual(
+            {'exited_container': self.fake_data['containers'][1]},
+            self.dfw.result['containers'])
+
+    def test_get_containers_agent_unavailable(self):
+        agent = mock.Mock()
+        agent.call.side_effect = kcf.AgentError('Host agent unavailable')
+        self.dfw = get_DockerFactsWorker({'name': [],
+                                          'action': 'get_containers'},
+                                         agent=agent)
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'])
+        self.dfw.get_containers()
+
+        self.assertIn('my_container', self.dfw.result['containers'])
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True)
 
     def test_get_containers_env(self):
         fake_env = dict(KOLLA_BASE_DISTRO='ubuntu',
@@ -260,6 +485,68 @@ class TestContainerFacts(base.BaseTestCase):
         self.dfw.module.fail_json.assert_called_once_with(
             msg="No such container: fake_container")
 
+    def _health_log(self, checks):
+        log = []
+        for i, (duration_us, exit_code) in enumerate(checks):
+            log.append({
+                'Start': '2024-05-01T10:00:%02d.000000000Z' % i,
+                'End': '2024-05-01T10:00:%02d.%06d123+00:00' % (i,
+                                                                duration_us),
+                'ExitCode': exit_code,
+                'Output': ''})
+        return log
+
+    def test_get_health(self):
+        self.fake_data['containers'][0]['State']['Health'] = {
+            'Status': 'unhealthy',
+            'FailingStreak': 2,
+            'Log': self._health_log([(100000, 0), (200000, 0),
+                                     (300000, 0), (400000, 1),
+                                     (1000000 - 1, 1)])}
+        self.dfw = get_DockerFactsWorker({'action': 'get_health'})
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'], all=True)
+        self.dfw.get_health()
+
+        self.assertFalse(self.dfw.result['changed'])
+        self.dfw.client.containers.list.assert_called_once_with(
+            all=False, sparse=True)
+        # Containers without a healthcheck are left out.
+        self.assertEqual({'my_container': {
+            'status': 'unhealthy',
+            'failing_streak': 2,
+            'checks': 5,
+            'failure_rate': 0.4,
+            'mean_duration': 0.4,
+            'p95_duration': 1.0,
+        }}, self.dfw.result['health'])
+
+    def test_get_health_empty_log(self):
+        self.fake_data['containers'][0]['State']['Health'] = {
+            'Status': 'starting', 'FailingStreak': 0, 'Log': None}
+        self.dfw = get_DockerFactsWorker({'name': ['my_container'],
+                                          'action': 'get_health'})
+        self.dfw.client.containers.list.return_value = get_containers(
+            self.fake_data['containers'])
+        self.dfw.get_health()
+
+        self.assertEqual({'my_container': {
+            'status': 'starting',
+            'failing_streak': 0,
+            'checks': 0,
+            'failure_rate': None,
+            'mean_duration': None,
+            'p95_duration': None,
+        }}, self.dfw.result['health'])
+
+    def test_parse_time(self):
+        self.assertEqual(1714557600.5,
+                         kcf._parse_time('2024-05-01T10:00:00.5Z'))
+        self.assertEqual(
+            1714557600.123456,
+            kcf._parse_time('2024-05-01T12:00:00.123456789+02:00'))
+        self.assertRaises(ValueError, kcf._parse_time, '2024-05-01 10:00:00')
+
     def test_get_volumes_single(self):
         """Test fetching a single volume"""
         self.dfw = get_DockerFactsWorker(
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+from importlib.machinery import SourceFileLoader
+import io
+import json
+import os
+import sys
+import tarfile
+from unittest import mock
+
+import fixtures
+from oslotest import base
+
+
+this_dir = os.path.dirname(sys.modules[__name__].__file__)
+ansible_dir = os.path.join(this_dir, '..', 'ansible')
+kolla_image_archive_file = os.path.join(
+    ansible_dir,
+    'library', 'kolla_image_archive.py')
+kia = SourceFileLoader('kolla_image_archive',
+                       kolla_image_archive_file).load_module()
+
+
+def digest(data):
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeImage(object):
+    """Image built from layer contents, saved in docker save format"""
+
+    def __init__(self, name, layers):
+        self.name = name
+        self.layers = layers
+        self.diff_ids = [digest(layer) for layer in layers]
+        self.config = json.dumps(
+            {'rootfs': {'type': 'layers',
+                        'diff_ids': self.diff_ids}}).encode('utf-8')
+        self.id = digest(self.config)
+        self.attrs = {'Id': self.id, 'RootFS': {'Layers': self.diff_ids}}
+        self.saved_as = []
+
+    def save(self, named):
+        self.saved_as.append(named)
+        files = {'{}.json'.format(self.id[7:]): self.config}
+        manifest = [{'Config': '{}.json'.format(self.id[7:]),
+                     'RepoTags': [self.name],
+                     'Layers': []}]
+        for diff_id, layer in zip(self.diff_ids, self.layers):
+            path = '{}/layer.tar'.format(diff_id[7:])
+            files[path] = layer
+            manifest[0]['Layers'].append(path)
+        files['manifest.json'] = json.dumps(manifest).encode('utf-8')
+
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode='w') as tar:
+            for path, data in files.items():
+                info = tarfile.TarInfo(path)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        data = buf.getvalue()
+        return [data[:1000], data[1000:]]
+
+
+class FakeEngine(object):
+    """Image store which loads archives the way Docker does
+
+    Layers are read from the archive only when the engine does not have
+    the layer yet, identified by its chain ID.
+    """
+
+    def __init__(self, images=()):
+        self.images = {image.name: image for image in images}
+        self.loaded_layers = 0
+
+    def get(self, name):
+        if name not in self.images:
+            raise NotFound(name)
+        return self.images[name]
+
+    def list(self):
+        return list(self.images.values())
+
+    def chains(self):
+        chains = set()
+        for image in self.images.values():
+            chains.update(kia.chain_ids(image.diff_ids))
+        return chains
+
+    def load(self, f):
+        with tarfile.open(fileobj=f) as tar:
+            manifest = json.load(tar.extractfile('manifest.json'))
+            for entry in manifest:
+                config = json.load(tar.extractfile(entry['Config']))
+                diff_ids = config['rootfs']['diff_ids']
+                chains = kia.chain_ids(diff_ids)
+                layers = []
+                for path, chain in zip(entry['Layers'], chains):
+                    if chain in self.chains():
+                        layers.append(self._layer(chain))
+                    else:
+                        layers.append(tar.extractfile(path).read())
+                        self.loaded_layers += 1
+                self.images[entry['RepoTags'][0]] = FakeImage(
+                    entry['RepoTags'][0], layers)
+
+    def _layer(self, chain):
+        for image in self.images.values():
+            for layer, image_chain in zip(
+                    image.layers, kia.chain_ids(image.diff_ids)):
+                if image_chain == chain:
+                    return layer
+
+
+def get_worker(engine, params):
+    module = mock.MagicMock()
+    module.params = params
+    with mock.patch('docker.DockerClient') as client:
+        client.return_value.images = engine
+        worker = kia.DockerArchiveWorker(module)
+    worker.containerError = mock.Mock(NotFound=NotFound)
+    return worker
+
+
+class TestImageArchive(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestImageArchive, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.archive = os.path.join(self.tmp, 'images.tar')
+        base_layers = [b'base', b'python']
+        self.api = FakeImage('kolla/nova-api:1',
+                             base_layers + [b'nova', b'api'])
+        self.compute = FakeImage('kolla/nova-compute:1',
+                                 base_layers + [b'nova', b'compute'])
+        self.cron = FakeImage('kolla/cron:1', base_layers + [b'cron'])
+
+    def _distribute(self, seed, peer, images):
+        present = get_worker(peer, {'images': images})
+        present.layers()
+        exporter = get_worker(seed, {
+            'images': images,
+            'archive': self.archive,
+            'present_images': present.result['present_images'],
+            'skip_layers': present.result['layers'],
+        })
+        exporter.export()
+        get_worker(peer, {'archive': self.archive}).load()
+        return exporter.result
+
+    def test_chain_ids(self):
+        self.assertEqual([], kia.chain_ids([]))
+        chain = kia.chain_ids(['sha256:a', 'sha256:b'])
+        self.assertEqual('sha256:a', chain[0])
+        self.assertEqual(digest(b'sha256:a sha256:b'), chain[1])
+        # The same layer on top of a different parent is a different layer.
+        self.assertNotEqual(chain[1],
+                            kia.chain_ids(['sha256:c', 'sha256:b'])[1])
+
+    def test_layers(self):
+        worker = get_worker(FakeEngine([self.cron]),
+                            {'images': ['kolla/cron:1', 'kolla/nova-api:1']})
+        worker.layers()
+
+        self.assertEqual(sorted(kia.chain_ids(self.cron.diff_ids)),
+                         worker.result['layers'])
+        self.assertEqual({'kolla/cron:1': self.cron.id,
+                          'kolla/nova-api:1': None},
+                         worker.result['present_images'])
+
+    def test_distribute_to_empty_host(self):
+        seed = FakeEngine([self.api, self.compute])
+        peer = FakeEngine()
+
+        result = self._distribute(
+            seed, peer, ['kolla/nova-api:1', 'kolla/nova-compute:1',
+                         'kolla/nova-api:1'])
+
+        self.assertEqual(['kolla/nova-api:1', 'kolla/nova-compute:1'],
+                         result['exported_images'])
+        self.assertTrue(result['changed'])
+        # The base and nova layers travel once, with the first image.
+        self.assertEqual(3, result['skipped_layers'])
+        self.assertEqual(5, peer.loaded_layers)
+        for image in (self.api, self.compute):
+            self.assertEqual([image.name], image.saved_as)
+            self.assertEqual(image.id, peer.get(image.name).id)
+        self.assertFalse(os.path.exists(self.archive))
+
+    def test_distribute_skips_present_layers(self):
+        seed = FakeEngine([self.api, self.cron])
+        peer = FakeEngine([self.cron])
+
+        result = self._distribute(seed, peer, ['kolla/nova-api:1',
+                                               'kolla/cron:1'])
+
+        self.assertEqual(['kolla/nova-api:1'], result['exported_images'])
+        self.assertEqual({'kolla/nova-api:1': self.api.id,
+                          'kolla/cron:1': self.cron.id},
+                         result['image_ids'])
+        self.assertEqual(2, result['skipped_layers'])
+        self.assertEqual(2, peer.loaded_layers)
+        self.assertEqual(self.api.id, peer.get('kolla/nova-api:1').id)
+
+    def test_distribute_nothing_missing(self):
+        seed = FakeEngine([self.cron])
+        peer = FakeEngine([self.cron])
+
+        result = self._distribute(seed, peer, ['kolla/cron:1'])
+
+        self.assertEqual([], result['exported_images'])
+        self.assertFalse(result['changed'])
+        self.assertEqual(0, peer.loaded_layers)
+
+    def test_export_missing_on_seed(self):
+        worker = get_worker(FakeEngine(), {'images': ['kolla/cron:1'],
+                                           'archive': self.archive})
+        worker.export()
+
+        worker.module.fail_json.assert_called_once_with(
+            msg='No such image on the seed host: kolla/cron:1')
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from importlib.machinery import SourceFileLoader
+import itertools
+import os
+import sys
+import threading
+import types
+
+from oslotest import base
+
+
+this_dir = os.path.dirname(sys.modules[__name__].__file__)
+ansible_dir = os.path.join(this_dir, '..', 'ansible')
+kolla_keystone_catalog_file = os.path.join(
+    ansible_dir,
+    'library', 'kolla_keystone_catalog.py')
+kkc = SourceFileLoader('kolla_keystone_catalog',
+                       kolla_keystone_catalog_file).load_module()
+
+
+class FakeIdentity(object):
+    """In-memory identity proxy counting the requests made to it"""
+
+    def __init__(self, test):
+        self.test = test
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.calls = []
+        self._domains = [self._new(name='Default', id='default')]
+        self._services = []
+        self._endpoints = []
+        self._projects = []
+        self._users = []
+        self._roles = []
+        self._assignments = set()
+
+    def _new(self, **attrs):
+        attrs.setdefault('id', 'id-{}'.format(next(self.ids)))
+        return types.SimpleNamespace(**attrs)
+
+    def _call(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def _list(self, name):
+        self._call(name)
+        return iter(list(getattr(self, '_' + name)))
+
+    def find_domain(self, name_or_id, ignore_missing=True):
+        self._call('find_domain')
+        for domain in self._domains:
+            if name_or_id in (domain.id, domain.name):
+                return domain
+
+    def find_user(self, name):
+        self._call('find_user')
+        for user in self._users:
+            if user.name == name:
+                return user
+
+    def services(self):
+        return self._list('services')
+
+    def endpoints(self):
+        return self._list('endpoints')
+
+    def projects(self):
+        return self._list('projects')
+
+    def users(self, domain_id):
+        self._call('users')
+        return iter([u for u in self._users if u.domain_id == domain_id])
+
+    def roles(self):
+        return self._list('roles')
+
+    def role_assignments(self, user_id):
+        self._call('role_assignments')
+        for user, role, kind, scope_id in list(self._assignments):
+            if user == user_id:
+                scope = ({'system': {'all': True}} if kind == 'system'
+                         else {kind: {'id': scope_id}})
+                yield types.SimpleNamespace(user={'id': user},
+                                            role={'id': role}, scope=scope)
+
+    def create_service(self, **attrs):
+        self._call('create_service')
+        service = self._new(**attrs)
+        self._services.append(service)
+        return service
+
+    def update_service(self, service, **attrs):
+        self._call('update_service')
+        vars(service).update(attrs)
+
+    def delete_service(self, service):
+        self._call('delete_service')
+        self._services.remove(service)
+        self._endpoints = [e for e in self._endpoints
+                           if e.service_id != service.id]
+
+    def create_endpoint(self, **attrs):
+        self._call('create_endpoint')
+        self.test.assertIn(attrs['service_id'],
+                           [s.id for s in self._services])
+        self._endpoints.append(self._new(**attrs))
+
+    def update_endpoint(self, endpoint, **attrs):
+        self._call('update_endpoint')
+        vars(endpoint).update(attrs)
+
+    def delete_endpoint(self, endpoint):
+        self._call('delete_endpoint')
+        self._endpoints.remove(endpoint)
+
+    def create_project(self, **attrs):
+        self._call('create_project')
+        project = self._new(**attrs)
+        self._projects.append(project)
+        return project
+
+    def create_user(self, **attrs):
+        self._call('create_user')
+        self.test.assertIn(attrs['default_project_id'],
+                           [p.id for p in self._projects])
+        user = self._new(**attrs)
+        self._users.append(user)
+        return user
+
+    def update_user(self, user, **attrs):
+        self._call('update_user')
+        vars(user).update(attrs)
+
+    def create_role(self, **attrs):
+        self._call('create_role')
+        role = self._new(**attrs)
+        self._roles.append(role)
+        return role
+
+    def assign_project_role_to_user(self, project, user, role):
+        self._call('assign_project_role_to_user')
+        self._assignments.add((user.id, role.id, 'project', project))
+
+    def unassign_project_role_from_user(self, project, user, role):
+        self._call('unassign_project_role_from_user')
+        self._assignments.discard((user.id, role.id, 'project', project))
+
+    def assign_system_role_to_user(self, user, role, system):
+        self._call('assign_system_role_to_user')
+        self._assignments.add((user.id, role.id, 'system', system))
+
+
+def catalog(**overrides):
+    params = dict(
+        services=[
+            dict(name='glance', type='image', description='Openstack Image',
+                 endpoints=[
+                     dict(interface='internal', url='http://int:9292'),
+                     dict(interface='public', url='https://pub:9292'),
+                 ]),
+            dict(name='placement', type='placement',
+                 description='Placement Service',
+                 endpoints=[
+                     dict(interface='internal', url='http://int:8780'),
+                 ]),
+        ],
+        users=[
+            dict(project='service', user='glance',
+                 password='secret', role='admin'),  # nosec B106
+            dict(project='service', user='placement',
+                 password='secret', role='admin'),  # nosec B106
+        ],
+        roles=['service'],
+        user_roles=[
+            dict(project='service', user='glance', role='service'),
+        ],
+        domain='default',
+        endpoint_region='RegionOne',
+        update_password=False,
+        concurrency=4,
+    )
+    params.update(overrides)
+    return params
+
+
+class TestKeystoneCatalog(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestKeystoneCatalog, self).setUp()
+        self.identity = FakeIdentity(self)
+
+    def _changes(self, result):
+        return sorted((c['action'], c['type'], c['name'])
+                      for c in result['changes'])
+
+    def test_register_from_scratch(self):
+        result = kkc.reconcile(self.identity, catalog())
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(
+            [('create', 'endpoint', 'glance -> http://int:9292 -> internal'),
+             ('create', 'endpoint', 'glance -> https://pub:9292 -> public'),
+             ('create', 'endpoint',
+              'placement -> http://int:8780 -> internal'),
+             ('create', 'project', 'service'),
+             ('create', 'role', 'admin'),
+             ('create', 'role', 'service'),
+             ('create', 'role_assignment', 'glance -> service -> admin'),
+             ('create', 'role_assignment', 'glance -> service -> service'),
+             ('create', 'role_assignment', 'placement -> service -> admin'),
+             ('create', 'service', 'glance'),
+             ('create', 'service', 'placement'),
+             ('create', 'user', 'glance'),
+             ('create', 'user', 'placement')],
+            self._changes(result))
+        self.assertEqual(3, len(self.identity._endpoints))
+        self.assertEqual(3, len(self.identity._assignments))
+        project = self.identity._projects[0]
+        for user in self.identity._users:
+            self.assertEqual('default', user.domain_id)
+            self.assertEqual(project.id, user.default_project_id)
+
+    def test_reconcile_converged(self):
+        kkc.reconcile(self.identity, catalog())
+        self.identity.calls = []
+
+        result = kkc.reconcile(self.identity, catalog())
+
+        self.assertFalse(result['changed'])
+        self.assertEqual([], result['changes'])
+        # One list call per kind of resource, one per user for its roles.
+        self.assertEqual(
+            ['endpoints', 'find_domain', 'projects', 'role_assignments',
+             'role_assignments', 'roles', 'services', 'users'],
+            sorted(self.identity.calls))
+
+    def test_reconcile_updates(self):
+        kkc.reconcile(self.identity, catalog())
+        params = catalog(update_password=True)
+        params['services'][0]['description'] = 'Image Service'
+        params['services'][0]['endpoints'][1]['url'] = 'https://new:9292'
+        params['users'] = params['users'][:1]
+        self.identity.calls = []
+
+        result = kkc.reconcile(self.identity, params)
+
+        self.assertEqual(
+            [('update', 'endpoint', 'glance -> https://new:9292 -> public'),
+             ('update', 'service', 'glance'),
+             ('update', 'user', 'glance')],
+            self._changes(result))
+        self.assertEqual('Image Service',
+                         self.identity._services[0].description)
+        self.assertIn('https://new:9292',
+                      [e.url for e in self.identity._endpoints])
+        self.assertEqual('secret', self.identity._users[0].password)
+        self.assertNotIn('create_endpoint', self.identity.calls)
+
+    def test_reconcile_deletes(self):
+        kkc.reconcile(self.identity, catalog())
+        params = catalog()
+        params['services'][1]['state'] = 'absent'
+        params['services'][0]['endpoints'][1]['state'] = 'absent'
+        params['user_roles'][0]['state'] = 'absent'
+
+        result = kkc.reconcile(self.identity, params)
+
+        self.assertEqual(
+            [('delete', 'endpoint', 'glance -> https://pub:9292 -> public'),
+             ('delete', 'role_assignment', 'glance -> service -> service'),
+             ('delete', 'service', 'placement')],
+            self._changes(result))
+        self.assertEqual(['glance'], [s.name for s in self.identity._services])
+        self.assertEqual(['internal'],
+                         [e.interface for e in self.identity._endpoints])
+        self.assertEqual(2, len(self.identity._assignments))
+        # Absent resources which do not exist are no change.
+        self.assertFalse(kkc.reconcile(self.identity, params)['changed'])
+
+    def test_reconcile_check_mode(self):
+        result = kkc.reconcile(self.identity, catalog(), check_mode=True)
+
+        self.assertTrue(result['changed'])
+        self.assertEqual(13, len(result['changes']))
+        self.assertEqual([], self.identity._services)
+        self.assertEqual([], self.identity._users)
+
+    def test_reconcile_disabled_service(self):
+        params = catalog()
+        params['services'][1]['enabled'] = False
+
+        kkc.reconcile(self.identity, params)
+
+        self.assertEqual(['glance'], [s.name for s in self.identity._services])
+
+    def test_reconcile_system_role(self):
+        params = catalog(user_roles=[
+            dict(system='all', user='glance', role='service')])
+
+        kkc.reconcile(self.identity, params)
+
+        user = self.identity._users[0]
+        role = [r for r in self.identity._roles if r.name == 'service'][0]
+        self.assertIn((user.id, role.id, 'system', 'all'),
+                      self.identity._assignments)
+        self.assertFalse(kkc.reconcile(self.identity, params)['changed'])
+
+    def test_reconcile_no_scope(self):
+        params = catalog(user_roles=[dict(user='glance', role='service')])
+
+        self.assertRaisesRegex(ValueError, 'No project, domain or system',
+                               kkc.reconcile, self.identity, params)
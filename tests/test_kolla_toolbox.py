@@ -17,6 +17,7 @@ import contextlib
 import io
 import json
 import os
+import pwd
 import sys
 import tarfile
 
@@ -35,6 +36,7 @@ except ImportError:
         with mock.patch.object(basic, '_ANSIBLE_ARGS', serialized_args):
             yield
 
+import fixtures
 from importlib.machinery import SourceFileLoader
 from oslotest import base
 from unittest import mock
@@ -235,6 +237,21 @@ class TestBuildPlaybook(base.BaseTestCase):
 
         self.assertNotIn('check_mode', result[0])
 
+    def test_tasks_in_order(self):
+        tasks = [{'module_name': 'ping', 'module_args': {}},
+                 {'module_name': 'file',
+                  'module_args': {'path': '/tmp/a'}},  # nosec: B108
+                 {'module_name': 'ping'}]
+        result = json.loads(
+            kolla_toolbox._build_playbook(None, None, {}, False, tasks))
+
+        self.assertEqual(
+            [{'name': 'kolla_toolbox task', 'ping': {}},
+             {'name': 'kolla_toolbox task',
+              'file': {'path': '/tmp/a'}},  # nosec: B108
+             {'name': 'kolla_toolbox task', 'ping': {}}],
+            result[0]['tasks'])
+
     def test_module_name_is_task_key(self):
         result = json.loads(
             kolla_toolbox._build_playbook(
@@ -303,8 +320,6 @@ class TestPushPrivateDataDir(TestKollaToolboxModule):
             self.mock_container_errors)
 
         self.mock_container = mock.MagicMock()
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, b'')  # makedirs
         self.pdd = '/var/lib/ansible/kolla_runner.test1'
 
     def _get_put_archive_tar(self):
@@ -313,90 +328,123 @@ class TestPushPrivateDataDir(TestKollaToolboxModule):
         tar_arg = call_args.args[1]  # second positional arg
         return tar_arg.read()
 
-    def test_secrets_not_in_exec_argv(self):
-        """module_args values must not appear in any exec_run argv."""
-        self.fake_ktbw._push_private_data_dir(
-            self.mock_container, self.pdd, None)
+    def test_no_exec(self):
+        """The tree is pushed without any exec_run."""
+        self.fake_ktbw._push_private_data_dir(self.mock_container, self.pdd)
 
-        for call in self.mock_container.exec_run.call_args_list:
-            argv = call[0][0]  # first positional arg is the command list
-            argv_str = ' '.join(str(a) for a in argv)
-            self.assertNotIn('S3cr3t', argv_str)
-            self.assertNotIn('admin', argv_str)
+        self.mock_container.exec_run.assert_not_called()
 
     def test_module_args_in_tar_as_dict(self):
         """module_args must be a dict in the pushed playbook, not a string."""
-        self.fake_ktbw._push_private_data_dir(
-            self.mock_container, self.pdd, None)
+        self.fake_ktbw._push_private_data_dir(self.mock_container, self.pdd)
 
         tar_bytes = self._get_put_archive_tar()
         contents = _tar_contents(tar_bytes)
-        playbook = json.loads(contents['project/main.json'])
+        playbook = json.loads(contents['kolla_runner.test1/project/main.json'])
         task_args = playbook[0]['tasks'][0]['community.mysql.mysql_user']
 
         self.assertIsInstance(task_args, dict)
         self.assertEqual('S3cr3t', task_args['password'])
 
     def test_inventory_contains_required_vars(self):
-        self.fake_ktbw._push_private_data_dir(
-            self.mock_container, self.pdd, None)
+        self.fake_ktbw._push_private_data_dir(self.mock_container, self.pdd)
 
         tar_bytes = self._get_put_archive_tar()
         contents = _tar_contents(tar_bytes)
-        inventory = contents['inventory/hosts'].decode()
+        inventory = contents['kolla_runner.test1/inventory/hosts'].decode()
 
         self.assertIn('ansible_connection=local', inventory)
-        self.assertIn('ansible_remote_tmp=', inventory)
+        self.assertIn('ansible_remote_tmp=%s/tmp' % self.pdd, inventory)
         self.assertIn('ansible_local_tmp=', inventory)
         self.assertIn('ansible_python_interpreter=', inventory)
         self.assertIn(kolla_toolbox._PYTHON, inventory)
 
-    def test_setup_exec_chown_to_ansible_when_user_is_none(self):
-        self.fake_ktbw._push_private_data_dir(
+    def test_driver_in_tar(self):
+        self.fake_ktbw._push_private_data_dir(self.mock_container, self.pdd)
+
+        tar_bytes = self._get_put_archive_tar()
+        contents = _tar_contents(tar_bytes)
+
+        self.assertEqual(kolla_toolbox._DRIVER_SCRIPT.encode(),
+                         contents['kolla_runner.test1/driver.py'])
+
+    def test_put_archive_called_with_pdd_basedir(self):
+        self.fake_ktbw._push_private_data_dir(self.mock_container, self.pdd)
+
+        self.mock_container.put_archive.assert_called_once()
+        call_path = self.mock_container.put_archive.call_args.args[0]
+        self.assertEqual(kolla_toolbox._PDD_BASEDIR, call_path)
+
+
+class TestRunDriver(TestKollaToolboxModule):
+    """Tests for KollaToolboxWorker._run_driver."""
+
+    def setUp(self):
+        super().setUp()
+        self.mock_ansible_module = mock.MagicMock()
+        self.mock_ansible_module.fail_json.side_effect = self.fail_json
+        self.mock_ansible_module._diff = False
+        self.fake_ktbw = kolla_toolbox.KollaToolboxWorker(
+            self.mock_ansible_module,
+            mock.MagicMock(),
+            mock.MagicMock())
+        self.mock_container = mock.MagicMock()
+        self.pdd = '/var/lib/ansible/kolla_runner.test1'
+
+    def test_returns_results(self):
+        self.mock_container.exec_run.return_value = _make_exec_result(
+            0, '{"changed": false}\r\n{"changed": true}\r\n')
+
+        results = self.fake_ktbw._run_driver(
             self.mock_container, self.pdd, None)
 
-        setup_call = self.mock_container.exec_run.call_args_list[0]
-        script = setup_call[0][0][2]  # python3 -c <script>
-        self.assertIn('chown', script)
-        self.assertIn('ansible', script)
+        self.assertEqual([{'changed': False}, {'changed': True}], results)
+
+    def test_single_exec_as_root(self):
+        self.mock_container.exec_run.return_value = _make_exec_result(
+            0, '{"changed": false}')
+
+        self.fake_ktbw._run_driver(self.mock_container, self.pdd, None)
 
-    def test_setup_exec_no_chown_when_user_is_root(self):
-        self.fake_ktbw._push_private_data_dir(
-            self.mock_container, self.pdd, 'root')
+        self.mock_container.exec_run.assert_called_once_with(
+            [kolla_toolbox._PYTHON, self.pdd + '/driver.py', 'ansible', '0'],
+            user='root', tty=True)
 
-        setup_call = self.mock_container.exec_run.call_args_list[0]
-        script = setup_call[0][0][2]
-        self.assertNotIn('chown', script)
+    def test_user_and_diff_passed_to_driver(self):
+        self.mock_ansible_module._diff = True
+        self.mock_container.exec_run.return_value = _make_exec_result(
+            0, '{"changed": false}')
 
-    def test_setup_exec_chown_for_non_root_user(self):
-        self.fake_ktbw._push_private_data_dir(
-            self.mock_container, self.pdd, 'rabbitmq')
+        self.fake_ktbw._run_driver(self.mock_container, self.pdd, 'rabbitmq')
 
-        setup_call = self.mock_container.exec_run.call_args_list[0]
-        script = setup_call[0][0][2]
-        self.assertIn('chown', script)
-        self.assertIn('rabbitmq', script)
+        argv = self.mock_container.exec_run.call_args.args[0]
+        self.assertEqual(['rabbitmq', '1'], argv[2:])
 
-    def test_fail_json_when_setup_exec_fails(self):
+    def test_fail_json_on_driver_failure(self):
         self.mock_container.exec_run.return_value = _make_exec_result(
-            1, b'Permission denied')  # makedirs
+            1, json.dumps({'failed': True,
+                           'msg': 'ansible-runner exited with code 4'}))
 
         error = self.assertRaises(
             AnsibleFailJson,
-            self.fake_ktbw._push_private_data_dir,
+            self.fake_ktbw._run_driver,
             self.mock_container, self.pdd, None)
 
-        self.assertIn('Failed to create pdd', error.result['msg'])
-        # put_archive must not be called after setup failure
-        self.mock_container.put_archive.assert_not_called()
+        self.assertEqual('Failed to run ansible-runner (exit 1): '
+                         'ansible-runner exited with code 4',
+                         error.result['msg'])
+
+    def test_fail_json_on_invalid_json_output(self):
+        self.mock_container.exec_run.return_value = _make_exec_result(
+            1, b'Traceback (most recent call last):')
 
-    def test_put_archive_called_with_pdd(self):
-        self.fake_ktbw._push_private_data_dir(
+        error = self.assertRaises(
+            AnsibleFailJson,
+            self.fake_ktbw._run_driver,
             self.mock_container, self.pdd, None)
 
-        self.mock_container.put_archive.assert_called_once()
-        call_path = self.mock_container.put_archive.call_args.args[0]
-        self.assertEqual(self.pdd, call_path)
+        self.assertIn('Could not parse ansible-runner result output',
+                      error.result['msg'])
 
 
 class TestParseRunnerResult(TestKollaToolboxModule):
@@ -410,105 +458,210 @@ class TestParseRunnerResult(TestKollaToolboxModule):
             self.mock_ansible_module,
             mock.MagicMock(),
             mock.MagicMock())
-        self.mock_container = mock.MagicMock()
-        self.pdd = '/var/lib/ansible/kolla_runner.test1'
 
-    def _result_output(self, event_type, res):
+    def _results(self, event_type, res):
         res['_runner_status'] = event_type
-        return json.dumps(res).encode('utf-8')
+        return [res]
 
     def test_returns_result_on_runner_on_ok(self):
         expected = {'changed': False, 'ping': 'pong'}
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            # _PARSE_SCRIPT
-            0, self._result_output('runner_on_ok', expected.copy()))
 
         result = self.fake_ktbw._parse_runner_result(
-            self.mock_container, self.pdd, None)
+            self._results('runner_on_ok', expected.copy()))
 
         self.assertEqual(expected, result)
 
     def test_fail_json_on_runner_on_failed(self):
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, self._result_output(
-                'runner_on_failed', {'msg': 'Access denied'}))  # _PARSE_SCRIPT
-
         error = self.assertRaises(
             AnsibleFailJson,
             self.fake_ktbw._parse_runner_result,
-            self.mock_container, self.pdd, None)
+            self._results('runner_on_failed', {'msg': 'Access denied'}))
 
         self.assertIn('Access denied', error.result['msg'])
 
     def test_fail_json_on_runner_on_unreachable(self):
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, self._result_output(
-                'runner_on_unreachable',
-                {'msg': 'Host unreachable'}))  # _PARSE_SCRIPT
-
         error = self.assertRaises(
             AnsibleFailJson,
             self.fake_ktbw._parse_runner_result,
-            self.mock_container, self.pdd, None)
+            self._results('runner_on_unreachable',
+                          {'msg': 'Host unreachable'}))
 
         self.assertIn('Host unreachable', error.result['msg'])
 
     def test_ansible_no_log_stripped(self):
         res = {'changed': True, '_ansible_no_log': True, 'key': 'val'}
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, self._result_output('runner_on_ok', res))  # _PARSE_SCRIPT
 
         result = self.fake_ktbw._parse_runner_result(
-            self.mock_container, self.pdd, None)
+            self._results('runner_on_ok', res))
 
         self.assertNotIn('_ansible_no_log', result)
         self.assertEqual('val', result['key'])
 
-    def test_fail_json_on_nonzero_exit_code(self):
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            1, b'something went wrong')  # _PARSE_SCRIPT
-
-        error = self.assertRaises(
-            AnsibleFailJson,
-            self.fake_ktbw._parse_runner_result,
-            self.mock_container, self.pdd, None)
 
-        self.assertIn('Failed to read ansible-runner result',
-                      error.result['msg'])
+class TestParseRunnerResults(TestKollaToolboxModule):
+    """Tests for KollaToolboxWorker._parse_runner_results."""
 
-    def test_fail_json_on_invalid_json_output(self):
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, b'not valid json')  # _PARSE_SCRIPT
+    def setUp(self):
+        super().setUp()
+        self.mock_ansible_module = mock.MagicMock()
+        self.mock_ansible_module.fail_json.side_effect = self.fail_json
+        self.mock_ansible_module.params = {
+            'tasks': [{'module_name': 'ping', 'module_args': {}},
+                      {'module_name': 'file', 'module_args': {}},
+                      {'module_name': 'ping', 'module_args': {}}],
+        }
+        self.fake_ktbw = kolla_toolbox.KollaToolboxWorker(
+            self.mock_ansible_module,
+            mock.MagicMock(),
+            mock.MagicMock())
 
+    def _results(self, *events):
+        results = []
+        for event_type, res in events:
+            res['_runner_status'] = event_type
+            results.append(res)
+        return results
+
+    def test_returns_results_of_all_tasks(self):
+        result = self.fake_ktbw._parse_runner_results(self._results(
+            ('runner_on_ok', {'changed': False, 'ping': 'pong'}),
+            ('runner_on_ok', {'changed': True, '_ansible_no_log': False}),
+            ('runner_on_skipped', {'changed': False, 'skipped': True})))
+
+        self.assertEqual(
+            {'changed': True,
+             'results': [{'changed': False, 'ping': 'pong'},
+                         {'changed': True},
+                         {'changed': False, 'skipped': True}]},
+            result)
+
+    def test_fail_json_on_failed_task(self):
         error = self.assertRaises(
             AnsibleFailJson,
-            self.fake_ktbw._parse_runner_result,
-            self.mock_container, self.pdd, None)
+            self.fake_ktbw._parse_runner_results,
+            self._results(('runner_on_ok', {'changed': True}),
+                          ('runner_on_failed', {'msg': 'Access denied'})))
+
+        self.assertEqual('Task 1 (file) failed: Access denied',
+                         error.result['msg'])
+        self.assertTrue(error.result['changed'])
+        self.assertEqual(
+            [{'changed': True}, {'msg': 'Access denied', 'failed': True}],
+            error.result['results'])
+
+    def test_fail_json_on_missing_results(self):
+        error = self.assertRaises(
+            AnsibleFailJson,
+            self.fake_ktbw._parse_runner_results,
+            self._results(('runner_on_ok', {'changed': False})))
 
-        self.assertIn('Could not parse ansible-runner result output',
+        self.assertIn('Expected 3 task results from ansible-runner, got 1',
                       error.result['msg'])
 
-    def test_user_passed_to_exec_run_when_specified(self):
-        res = {'changed': False}
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, self._result_output('runner_on_ok', res))  # _PARSE_SCRIPT
-
-        self.fake_ktbw._parse_runner_result(
-            self.mock_container, self.pdd, 'rabbitmq')
 
-        call_kwargs = self.mock_container.exec_run.call_args.kwargs
-        self.assertEqual('rabbitmq', call_kwargs.get('user'))
-
-    def test_user_not_passed_to_exec_run_when_none(self):
-        res = {'changed': False}
-        self.mock_container.exec_run.return_value = _make_exec_result(
-            0, self._result_output('runner_on_ok', res))  # _PARSE_SCRIPT
+class TestDriverScript(base.BaseTestCase):
+    """Tests for _DRIVER_SCRIPT, run against a private_data_dir."""
 
-        self.fake_ktbw._parse_runner_result(
-            self.mock_container, self.pdd, None)
-
-        call_kwargs = self.mock_container.exec_run.call_args.kwargs
-        self.assertNotIn('user', call_kwargs)
+    def setUp(self):
+        super().setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.pdd = os.path.join(tmp, 'kolla_runner.test1')
+        self.events_dir = os.path.join(self.pdd, 'artifacts', 'ID',
+                                       'job_events')
+        os.makedirs(self.events_dir)
+        self.driver = {'__name__': 'driver'}
+        # NOTE: The script is a constant of the module under test.
+        exec(kolla_toolbox._DRIVER_SCRIPT, self.driver)  # nosec B102
+        self.driver['RUNNER'] = os.path.join(tmp, 'ansible-runner')
+        self.user = pwd.getpwuid(os.getuid()).pw_name
+
+    def _write_events(self, *events):
+        for counter, (event_type, res) in enumerate(events, 1):
+            path = os.path.join(self.events_dir,
+                                '%d-uuid%d.json' % (counter, counter))
+            with open(path, 'w') as f:
+                json.dump({'event': event_type,
+                           'event_data': {'res': res}}, f)
+
+    def _write_runner(self, exit_code):
+        with open(self.driver['RUNNER'], 'w') as f:
+            f.write('#!/bin/sh\necho "$@" "$HOME" > %s/runner.args\n'
+                    'exit %d\n' % (self.pdd, exit_code))
+        os.chmod(self.driver['RUNNER'], 0o700)
+
+    def _run(self, *args):
+        stdout = io.StringIO()
+        code = 0
+        with mock.patch('sys.stdout', stdout):
+            try:
+                self.driver['run'](self.pdd, self.user, *args)
+            except SystemExit as e:
+                code = e.code
+        return code, [json.loads(line)
+                      for line in stdout.getvalue().splitlines()]
+
+    def test_terminal_events_in_order(self):
+        events = [('playbook_on_start', {})]
+        events.extend(('runner_on_start', {}) for _ in range(5))
+        events.extend(('runner_on_ok', {'task': i}) for i in range(10))
+        self._write_events(*events)
+        self._write_runner(2)
+
+        code, results = self._run(False)
+
+        self.assertEqual(0, code)
+        self.assertEqual(list(range(10)), [r['task'] for r in results])
+        self.assertEqual(['runner_on_ok'],
+                         list({r['_runner_status'] for r in results}))
+        with open(os.path.join(self.pdd, 'runner.args')) as f:
+            self.assertEqual(
+                'run %s --playbook main.json --rotate-artifacts 1 %s'
+                % (self.pdd, pwd.getpwnam(self.user).pw_dir),
+                f.read().strip())
+        self.assertTrue(os.path.isdir(os.path.join(self.pdd, 'tmp')))
+
+    def test_auth_tokens_issued(self):
+        home = os.path.join(os.path.dirname(self.pdd), 'home')
+        os.makedirs(os.path.join(home, '.cache', 'kolla-auth'))
+        with open(os.path.join(home, '.cache', 'kolla-auth', 'issued'),
+                  'w') as f:
+            f.write('3')
+        self.driver['pwd'] = mock.Mock()
+        self.driver['pwd'].getpwnam.return_value = mock.Mock(
+            pw_uid=0, pw_gid=0, pw_dir=home)
+        self._write_events(('runner_on_ok', {}), ('runner_on_ok', {}))
+        self._write_runner(0)
+
+        code, results = self._run(False)
+
+        self.assertEqual(0, code)
+        self.assertNotIn('_auth_tokens_issued', results[0])
+        self.assertEqual(3, results[1]['_auth_tokens_issued'])
+
+    def test_no_terminal_event(self):
+        self._write_events(('playbook_on_start', {}))
+        self._write_runner(0)
+
+        code, results = self._run(False)
+
+        self.assertEqual(1, code)
+        self.assertEqual('no terminal event found', results[0]['msg'])
+
+    def test_runner_failure(self):
+        self._write_runner(4)
+
+        code, results = self._run(False)
+
+        self.assertEqual(1, code)
+        self.assertEqual('ansible-runner exited with code 4: ',
+                         results[0]['msg'])
+
+    def test_runner_missing(self):
+        code, results = self._run(False)
+
+        self.assertEqual(1, code)
+        self.assertIn("The 'ansible-runner' binary was not found",
+                      results[0]['msg'])
 
 
 class TestKollaToolboxWorkerMain(TestKollaToolboxModule):
@@ -519,6 +672,7 @@ class TestKollaToolboxWorkerMain(TestKollaToolboxModule):
         self.mock_ansible_module = mock.MagicMock()
         self.mock_ansible_module.fail_json.side_effect = self.fail_json
         self.mock_ansible_module.check_mode = False
+        self.mock_ansible_module._diff = False
         self.mock_ansible_module.params = {
             'module_name': 'ping',
             'module_args': {},
@@ -527,6 +681,7 @@ class TestKollaToolboxWorkerMain(TestKollaToolboxModule):
         }
         self.mock_container_client = mock.MagicMock()
         self.mock_container_errors = mock.MagicMock()
+        self.mock_container_errors.APIError = MockAPIError
         self.fake_ktbw = kolla_toolbox.KollaToolboxWorker(
             self.mock_ansible_module,
             self.mock_container_client,
@@ -535,179 +690,166 @@ class TestKollaToolboxWorkerMain(TestKollaToolboxModule):
         self.mock_container = mock.MagicMock()
         self.mock_container_client.containers.list.return_value = [
             self.mock_container]
-        # Default: setup exec succeeds, runner exits 0, parse returns ok
         ok_result = json.dumps(
             {'changed': False, '_runner_status': 'runner_on_ok'}
         ).encode()
         self.mock_container.exec_run.side_effect = [
-            _make_exec_result(0, b''),   # test -x ansible-runner
-            _make_exec_result(0, b''),   # makedirs
-            _make_exec_result(0, b''),   # ansible-runner
-            _make_exec_result(0, ok_result),  # _PARSE_SCRIPT
-            _make_exec_result(0, b''),   # cleanup
+            _make_exec_result(0, ok_result),  # driver
         ]
+        self.task_client = None
+        connect_patch = mock.patch.object(
+            kolla_toolbox.TaskClient, 'connect',
+            side_effect=lambda **kwargs: self.task_client)
+        self.connect_mock = connect_patch.start()
+        self.addCleanup(connect_patch.stop)
 
     def test_pdd_under_pdd_basedir(self):
         """pdd must be under _PDD_BASEDIR, not /tmp."""
-        pdd_used = []
+        self.fake_ktbw.main()
 
-        def capture_push(container, pdd, user):
-            pdd_used.append(pdd)
-            # Simulate success without real put_archive
-            container.put_archive = mock.MagicMock()
+        argv = self.mock_container.exec_run.call_args.args[0]
+        self.assertTrue(argv[1].startswith('/var/lib/ansible/kolla_runner.'))
 
-        with mock.patch.object(self.fake_ktbw,
-                               '_push_private_data_dir',
-                               side_effect=capture_push), \
-             mock.patch.object(self.fake_ktbw,
-                               '_parse_runner_result',
-                               return_value={'changed': False}):
-            self.fake_ktbw.main()
+    def test_single_exec(self):
+        self.fake_ktbw.main()
 
-        self.assertTrue(
-            pdd_used[0].startswith('/var/lib/ansible'))
+        self.assertEqual({'changed': False}, self.fake_ktbw.result)
+        self.mock_container.put_archive.assert_called_once()
+        self.assertEqual(1, self.mock_container.exec_run.call_count)
 
-    def test_cleanup_called_on_success(self):
-        ok_result = json.dumps(
-            {'changed': False, '_runner_status': 'runner_on_ok'}
-        ).encode()
+    def test_secrets_not_in_exec_argv(self):
+        """module_args values must not appear in any exec_run argv."""
+        self.mock_ansible_module.params['module_args'] = {
+            'user': 'admin', 'password': 'S3cr3t'}  # nosec B105
+
+        self.fake_ktbw.main()
+
+        for call in self.mock_container.exec_run.call_args_list:
+            argv_str = ' '.join(str(a) for a in call.args[0])
+            self.assertNotIn('S3cr3t', argv_str)
+            self.assertNotIn('admin', argv_str)
+
+    def test_cleanup_called_when_driver_cannot_run(self):
         self.mock_container.exec_run.side_effect = [
-            _make_exec_result(0, b''),  # test -x ansible-runner
-            _make_exec_result(0, b''),  # makedirs
-            _make_exec_result(0, b''),  # ansible-runner
-            _make_exec_result(0, ok_result),  # _PARSE_SCRIPT
+            MockAPIError('exec failed'),  # driver
             _make_exec_result(0, b''),  # cleanup
         ]
 
-        with mock.patch.object(self.fake_ktbw,
-                               '_parse_runner_result',
-                               return_value={'changed': False}):
-            self.fake_ktbw.main()
+        self.assertRaises(MockAPIError, self.fake_ktbw.main)
 
-        # Last exec_run call must be the shutil.rmtree cleanup
-        last_call = self.mock_container.exec_run.call_args_list[-1]
-        last_cmd = last_call[0][0]
-        self.assertIn('shutil', last_cmd[-1])
+        last_cmd = self.mock_container.exec_run.call_args.args[0]
         self.assertIn('rmtree', last_cmd[-1])
 
-    def test_cleanup_called_on_failure(self):
-        """finally block must run cleanup even when ansible-runner fails."""
+    def test_cleanup_called_when_push_fails(self):
+        self.mock_container.put_archive.side_effect = RuntimeError('full')
         self.mock_container.exec_run.side_effect = [
-            _make_exec_result(0, b''),  # test -x ansible-runner
-            _make_exec_result(0, b''),   # makedirs
-            _make_exec_result(1, b'runner crashed'),  # ansible-runner
-            _make_exec_result(0, b''),   # cleanup
+            _make_exec_result(0, b''),  # cleanup
         ]
 
-        self.assertRaises(AnsibleFailJson, self.fake_ktbw.main)
+        self.assertRaises(RuntimeError, self.fake_ktbw.main)
 
-        last_call = self.mock_container.exec_run.call_args_list[-1]
-        last_cmd = last_call[0][0]
+        self.assertEqual(1, self.mock_container.exec_run.call_count)
+        last_cmd = self.mock_container.exec_run.call_args.args[0]
         self.assertIn('rmtree', last_cmd[-1])
 
-    def test_fail_json_on_runner_exit_code_other_than_0_or_2(self):
+    def test_cleanup_failure_keeps_error(self):
         self.mock_container.exec_run.side_effect = [
-            _make_exec_result(0, b''),  # test -x ansible-runner
-            _make_exec_result(0, b''),  # makedirs
-            _make_exec_result(4, b'runner internal error'),  # ansible-runner
-            _make_exec_result(0, b''),  # cleanup
+            RuntimeError('exec failed'),  # driver
+            MockAPIError('container gone'),  # cleanup
         ]
 
-        error = self.assertRaises(AnsibleFailJson, self.fake_ktbw.main)
-        self.assertIn('ansible-runner exited with code 4',
-                      error.result['msg'])
+        error = self.assertRaises(RuntimeError, self.fake_ktbw.main)
+        self.assertEqual('exec failed', str(error))
 
-    def test_runner_exit_code_2_is_not_fatal(self):
-        """Exit code 2 means task failed — we handle it via the event."""
-        failed_result = json.dumps(
-            {'changed': False, 'msg': 'task failed',
-             '_runner_status': 'runner_on_failed'}
-        ).encode()
+    def test_task_failure(self):
         self.mock_container.exec_run.side_effect = [
-            _make_exec_result(0, b''),  # test -x ansible-runner
-            _make_exec_result(0, b''),  # makedirs
-            _make_exec_result(2, b''),  # ansible-runner
-            _make_exec_result(0, failed_result),  # _PARSE_SCRIPT
-            _make_exec_result(0, b''),  # cleanup
+            _make_exec_result(0, json.dumps(
+                {'changed': False, 'msg': 'task failed',
+                 '_runner_status': 'runner_on_failed'})),  # driver
         ]
 
-        with mock.patch.object(
-                self.fake_ktbw,
-                '_parse_runner_result',
-                side_effect=AnsibleFailJson({'msg': 'task failed'})):
-            error = self.assertRaises(AnsibleFailJson, self.fake_ktbw.main)
-        self.assertIn('task failed', error.result['msg'])
+        error = self.assertRaises(AnsibleFailJson, self.fake_ktbw.main)
+        self.assertEqual('task failed', error.result['msg'])
+        # The driver removed pdd itself.
+        self.assertEqual(1, self.mock_container.exec_run.call_count)
+
+    def test_task_server(self):
+        self.mock_ansible_module.params.update(
+            module_args={'password': 'S3cr3t'},  # nosec B105
+            module_extra_vars={'x': 1},
+            timeout=180)
+        self.task_client = mock.Mock()
+        self.task_client.run.return_value = [
+            {'changed': True, '_runner_status': 'runner_on_ok'}]
+
+        self.fake_ktbw.main()
+
+        self.assertEqual({'changed': True}, self.fake_ktbw.result)
+        self.connect_mock.assert_called_once_with(timeout=180)
+        self.task_client.run.assert_called_once_with(
+            [{'module_name': 'ping',
+              'module_args': {'password': 'S3cr3t'}}],  # nosec B105
+            {'x': 1}, False, False)
+        self.mock_container_client.containers.list.assert_not_called()
+        self.mock_container.exec_run.assert_not_called()
+
+    def test_auth_tokens_issued(self):
+        self.task_client = mock.Mock()
+        self.task_client.run.return_value = [
+            {'changed': True, '_runner_status': 'runner_on_ok',
+             '_auth_tokens_issued': 2}]
+
+        self.fake_ktbw.main()
+
+        self.assertEqual({'changed': True, 'auth_tokens_issued': 2},
+                         self.fake_ktbw.result)
+
+    def test_task_server_task_failure(self):
+        self.task_client = mock.Mock()
+        self.task_client.run.return_value = [
+            {'msg': 'task failed', '_runner_status': 'runner_on_failed'}]
 
-    def test_fail_json_when_ansible_runner_not_found(self):
-        """test -x failing means ansible-runner is missing."""
-        self.mock_container.exec_run.side_effect = [
-            _make_exec_result(1, b''),  # test -x ansible-runner fails
-            _make_exec_result(0, b''),  # cleanup
-        ]
+        error = self.assertRaises(AnsibleFailJson, self.fake_ktbw.main)
+        self.assertEqual('task failed', error.result['msg'])
+        self.mock_container.exec_run.assert_not_called()
 
-        error = self.assertRaises(AnsibleFailJson,
-                                  self.fake_ktbw.main)
-        self.assertIn('ansible-runner', error.result['msg'])
-
-    def test_runner_exec_uses_ansible_user_when_no_user_param(self):
-        """user=None must exec ansible-runner as 'ansible', not as root.
-
-        Podman serialises user=None as null in ExecCreate; some daemon
-        versions interpret null as UID 0 (root), which breaks openstacksdk
-        lookups because HOME becomes /root instead of /var/lib/ansible.
-        """
-        self.mock_ansible_module.params['user'] = None
-
-        with mock.patch.object(self.fake_ktbw, '_push_private_data_dir'), \
-             mock.patch.object(self.fake_ktbw, '_parse_runner_result',
-                               return_value={'changed': False}):
-            self.fake_ktbw.main()
-
-        # call[0]=check_runner, call[1]=ansible-runner, call[2]=cleanup
-        runner_call = self.mock_container.exec_run.call_args_list[1]
-        self.assertEqual('ansible', runner_call.kwargs.get('user'))
-
-    def test_runner_exec_sets_home_to_pdd_basedir_for_ansible_user(self):
-        """HOME must be set to _PDD_BASEDIR to finds clouds.yaml."""
-        self.mock_ansible_module.params['user'] = None
-
-        with mock.patch.object(self.fake_ktbw, '_push_private_data_dir'), \
-             mock.patch.object(self.fake_ktbw, '_parse_runner_result',
-                               return_value={'changed': False}):
-            self.fake_ktbw.main()
-
-        runner_call = self.mock_container.exec_run.call_args_list[1]
-        env = runner_call.kwargs.get('environment', {})
-        self.assertEqual(kolla_toolbox._PDD_BASEDIR, env.get('HOME'))
-
-    def test_runner_exec_uses_explicit_user_param(self):
-        """When user='rabbitmq', ansible-runner must exec as 'rabbitmq'."""
-        self.mock_ansible_module.params['user'] = 'rabbitmq'
+    def test_task_server_error(self):
+        self.task_client = mock.Mock()
+        self.task_client.run.side_effect = kolla_toolbox.TaskServerError(
+            'Task server unavailable: timed out')
+
+        error = self.assertRaises(AnsibleFailJson, self.fake_ktbw.main)
+        self.assertEqual('kolla_toolbox task server failed: Task server '
+                         'unavailable: timed out', error.result['msg'])
+        self.mock_container.exec_run.assert_not_called()
 
-        with mock.patch.object(self.fake_ktbw, '_push_private_data_dir'), \
-             mock.patch.object(self.fake_ktbw, '_parse_runner_result',
-                               return_value={'changed': False}):
-            self.fake_ktbw.main()
+    def test_task_server_unsupported(self):
+        self.task_client = mock.Mock()
+        self.task_client.run.return_value = None
 
-        runner_call = self.mock_container.exec_run.call_args_list[1]
-        self.assertEqual('rabbitmq', runner_call.kwargs.get('user'))
+        self.fake_ktbw.main()
 
-    def test_runner_exec_no_home_override_for_non_ansible_user(self):
-        """HOME must not be overridden for non-ansible users.
+        self.assertEqual({'changed': False}, self.fake_ktbw.result)
+        self.assertEqual(1, self.mock_container.exec_run.call_count)
 
-        Forcing HOME=/var/lib/ansible when running as rabbitmq causes
-        PermissionError because rabbitmq cannot write to ansible's home.
-        """
+    def test_task_server_not_used_for_other_users(self):
         self.mock_ansible_module.params['user'] = 'rabbitmq'
+        self.task_client = mock.Mock()
+
+        self.fake_ktbw.main()
+
+        self.connect_mock.assert_not_called()
+        self.assertEqual(1, self.mock_container.exec_run.call_count)
 
-        with mock.patch.object(self.fake_ktbw, '_push_private_data_dir'), \
-             mock.patch.object(self.fake_ktbw, '_parse_runner_result',
-                               return_value={'changed': False}):
-            self.fake_ktbw.main()
+    def test_tasks_results(self):
+        self.mock_ansible_module.params.update(
+            module_name=None,
+            tasks=[{'module_name': 'ping', 'module_args': {}}])
 
-        runner_call = self.mock_container.exec_run.call_args_list[1]
-        env = runner_call.kwargs.get('environment', {})
-        self.assertNotIn('HOME', env)
+        self.fake_ktbw.main()
+
+        self.assertEqual({'changed': False, 'results': [{'changed': False}]},
+                         self.fake_ktbw.result)
 
 
 class TestModuleInteraction(TestKollaToolboxModule):
@@ -720,9 +862,58 @@ class TestModuleInteraction(TestKollaToolboxModule):
         with patch_module_args(ansible_module_args):
             error = self.assertRaises(AnsibleFailJson,
                                       kolla_toolbox.create_ansible_module)
-        self.assertIn('missing required arguments: module_name',
+        self.assertIn('one of the following is required: module_name, tasks',
+                      error.result['msg'])
+
+    def test_create_ansible_module_module_name_and_tasks(self):
+        ansible_module_args = {
+            'container_engine': 'docker',
+            'module_name': 'ping',
+            'tasks': [{'module_name': 'ping'}],
+        }
+        with patch_module_args(ansible_module_args):
+            error = self.assertRaises(AnsibleFailJson,
+                                      kolla_toolbox.create_ansible_module)
+        self.assertIn('parameters are mutually exclusive: module_name|tasks',
                       error.result['msg'])
 
+    def test_create_ansible_module_tasks(self):
+        ansible_module_args = {
+            'container_engine': 'docker',
+            'tasks': [{'module_name': 'ping'},
+                      {'module_name': 'file',
+                       'module_args': {'path': '/tmp/a'}}],  # nosec: B108
+        }
+        with patch_module_args(ansible_module_args):
+            module = kolla_toolbox.create_ansible_module()
+        self.assertEqual([{'module_name': 'ping', 'module_args': {}},
+                          {'module_name': 'file',
+                           'module_args': {'path': '/tmp/a'}}],  # nosec: B108
+                         module.params['tasks'])
+
+    def test_create_ansible_module_nested_password_masked(self):
+        ansible_module_args = {
+            'container_engine': 'docker',
+            'module_name': 'kolla_keystone_catalog',
+            'module_args': {
+                'users': [{'user': 'glance',
+                           'password': 'S3cr3t'}],  # nosec B105
+                'auth': {'username': 'admin',
+                         'password': 'Adm1n'},  # nosec B105
+            },
+        }
+        with patch_module_args(ansible_module_args):
+            with mock.patch.object(kolla_toolbox.KollaAnsibleModule,
+                                   'log') as log:
+                module = kolla_toolbox.create_ansible_module()
+
+        self.assertIn('S3cr3t', module.no_log_values)
+        self.assertIn('Adm1n', module.no_log_values)
+        message = log.call_args.args[0]
+        self.assertIn('glance', message)
+        self.assertNotIn('S3cr3t', message)
+        self.assertNotIn('Adm1n', message)
+
     def test_create_ansible_module_missing_required_container_engine(self):
         ansible_module_args = {
             'module_name': 'url'
@@ -767,7 +958,8 @@ class TestModuleInteraction(TestKollaToolboxModule):
         with patch_module_args(ansible_module_args):
             module = kolla_toolbox.create_ansible_module()
         self.assertIsInstance(module, AnsibleModule)
-        self.assertEqual(ansible_module_args, module.params)
+        self.assertEqual(dict(ansible_module_args, tasks=None),
+                         module.params)
 
 
 class TestContainerEngineClientIntraction(TestKollaToolboxModule):
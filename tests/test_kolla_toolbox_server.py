@@ -0,0 +1,114 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from importlib.machinery import SourceFileLoader
+import os
+import pwd
+import sys
+import threading
+
+import fixtures
+from oslotest import base
+
+this_dir = os.path.dirname(sys.modules[__name__].__file__)
+ansible_dir = os.path.join(this_dir, '..', 'ansible')
+task_server_file = os.path.join(ansible_dir,
+                                'module_utils', 'kolla_toolbox_server.py')
+kts = SourceFileLoader('kolla_toolbox_server',
+                       task_server_file).load_module()
+
+
+class TestTaskServer(base.BaseTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestTaskServer, cls).setUpClass()
+        kts.preload()
+
+    def setUp(self):
+        super(TestTaskServer, self).setUp()
+        self.tmp = self.useFixture(fixtures.TempDir()).path
+        self.path = os.path.join(self.tmp, 'kolla-toolbox', 'task.sock')
+        server = kts.TaskServer(self.path)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.client = kts.TaskClient.connect(self.path, timeout=60)
+
+    def test_connect(self):
+        self.assertIsNotNone(self.client)
+        self.assertEqual(0o600, os.stat(self.path).st_mode & 0o777)
+
+    def test_connect_no_server(self):
+        self.assertIsNone(kts.TaskClient.connect(self.path + '.missing'))
+
+    def test_run(self):
+        path = os.path.join(self.tmp, 'dir')
+        results = self.client.run(
+            [{'module_name': 'ping', 'module_args': {'data': '{{ x }}'}},
+             {'module_name': 'ansible.builtin.file',
+              'module_args': {'path': path, 'state': 'directory'}}],
+            extra_vars={'x': 'templated'})
+
+        self.assertEqual(['runner_on_ok', 'runner_on_ok'],
+                         [r['_runner_status'] for r in results])
+        self.assertEqual('templated', results[0]['ping'])
+        self.assertTrue(results[1]['changed'])
+        self.assertTrue(os.path.isdir(path))
+
+    def test_run_check_mode(self):
+        path = os.path.join(self.tmp, 'dir')
+        results = self.client.run(
+            [{'module_name': 'file',
+              'module_args': {'path': path, 'state': 'directory'}}],
+            check_mode=True)
+
+        self.assertTrue(results[0]['changed'])
+        self.assertFalse(os.path.exists(path))
+
+    def test_run_stops_at_failure(self):
+        results = self.client.run(
+            [{'module_name': 'file',
+              'module_args': {'path': os.path.join(self.tmp, 'missing'),
+                              'state': 'file'}},
+             {'module_name': 'ping', 'module_args': {}}])
+
+        self.assertEqual(1, len(results))
+        self.assertEqual('runner_on_failed', results[0]['_runner_status'])
+        self.assertTrue(results[0]['failed'])
+
+    def test_run_module_args_restored(self):
+        from ansible.module_utils import basic
+        saved = basic._ANSIBLE_ARGS
+
+        result = kts.run_module(kts.find_module('ping'), {'data': 'x'},
+                                False, False)
+
+        self.assertEqual('x', result['ping'])
+        self.assertIs(saved, basic._ANSIBLE_ARGS)
+
+    def test_run_action_plugin(self):
+        self.assertIsNone(self.client.run(
+            [{'module_name': 'ping', 'module_args': {}},
+             {'module_name': 'copy', 'module_args': {}}]))
+
+    def test_run_other_user(self):
+        users = [user.pw_name for user in pwd.getpwall()
+                 if user.pw_uid != os.getuid()]
+        self.assertIsNone(self.client.run(
+            [{'module_name': 'ping', 'module_args': {}}], user=users[0]))
+
+    def test_error(self):
+        self.assertRaises(kts.TaskServerError, self.client.run,
+                          [{'module_name': 'no_such_module'}])
+        self.assertRaises(kts.TaskServerError, self.client.call, 'unknown')
@@ -13,9 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
 from importlib.machinery import SourceFileLoader
 import os
+from unittest import mock
 
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+from ansible.utils.hashing import checksum_s
+import fixtures
 from io import StringIO
 from oslotest import base
 
@@ -211,3 +217,178 @@ class OverrideConfigParserTest(base.BaseTestCase):
         parser.write(output)
         self.assertEqual(TESTC_NO_WHITESPACE, output.getvalue())
         output.close()
+
+    def test_diff(self):
+        before = merge_configs.OverrideConfigParser()
+        before.parse(StringIO(TESTA))
+        after = merge_configs.OverrideConfigParser()
+        after.parse(StringIO(TESTC))
+        after.parse(StringIO('[b]\nb_key1 = 1\n[d]\nd_key = 1\n'))
+        after._sections['c'].pop('c_key2')
+
+        self.assertEqual(
+            {'added': [{'key': '[d] d_key', 'after': ['1']}],
+             'removed': [{'key': '[c] c_key2',
+                          'before': ['1 2 3\n4 5 6']}],
+             'changed': [{'key': '[DEFAULT] key2', 'before': ['v1\nv2'],
+                          'after': ['v3\nv4\nv5']},
+                         {'key': '[DEFAULT] key4', 'before': ['v5'],
+                          'after': ['v4', '']},
+                         {'key': '[b] b_key2', 'before': ['1\n2'],
+                          'after': ['2']}]},
+            before.diff(after))
+        self.assertEqual({'added': [], 'removed': [], 'changed': []},
+                         after.diff(after))
+
+    def test_diff_no_sections(self):
+        before = merge_configs.OverrideConfigParser()
+        before.parse(StringIO(TESTA_NO_SECTIONS))
+        after = merge_configs.OverrideConfigParser()
+        after.parse(StringIO(TESTC_NO_SECTIONS))
+
+        self.assertEqual({'added': [{'key': 'key3', 'after': ['c']}],
+                          'removed': [], 'changed': []},
+                         before.diff(after))
+
+    def test_config_diff(self):
+        result = merge_configs.config_diff(TESTA, TESTC)
+        same = merge_configs.config_diff(TESTA + '\n# comment\n', TESTC)
+
+        self.assertEqual(
+            '~ [DEFAULT] key2: v1\nv2 -> v3\nv4\nv5\n'
+            '~ [DEFAULT] key4: v5 -> v4, \n'
+            '~ [b] b_key2: 1\n2 -> 2\n',
+            result['diff']['prepared'])
+        self.assertEqual(result['config_diff_digest'],
+                         same['config_diff_digest'])
+        self.assertNotEqual(
+            result['config_diff_digest'],
+            merge_configs.config_diff(TESTA, TESTA)['config_diff_digest'])
+
+
+class MergeConfigsActionTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(MergeConfigsActionTest, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.source = os.path.join(tmp, 'nova.conf')
+        with open(self.source, 'w') as f:
+            f.write('[DEFAULT]\ndebug = {{ 1 == 1 }}\n')
+        self.merged = '[DEFAULT]\ndebug = True\n\n'
+        self.stat = {'exists': True, 'isreg': True,
+                     'checksum': checksum_s(self.merged),
+                     'mode': '0660', 'pw_name': 'root', 'uid': 0,
+                     'gr_name': 'kolla', 'gid': 42400, 'size': 24}
+
+    def _run(self, diff=False, **args):
+        task = mock.MagicMock(async_val=0, diff=diff)
+        task.args = dict(sources=[self.source], dest='/etc/nova/nova.conf',
+                         **args)
+        loader = DataLoader()
+        shared_loader_obj = mock.MagicMock()
+        self.action_loader = shared_loader_obj.action_loader
+        copy_action = self.action_loader.get.return_value
+        copy_action.run.return_value = {'changed': True,
+                                        'invocation': {'module_args': {}}}
+        action = merge_configs.ActionModule(
+            task, mock.MagicMock(), mock.MagicMock(), loader,
+            Templar(loader=loader), shared_loader_obj)
+        # NOTE: ansible-core 2.19 ignores the shared_loader_obj argument.
+        action._shared_loader_obj = shared_loader_obj
+        action._remove_tmp_path = mock.Mock()
+        action._execute_module = mock.Mock(return_value={
+            'content': base64.b64encode(b'[DEFAULT]\ndebug = False\n'),
+            'encoding': 'base64'})
+        with mock.patch.object(action, '_execute_remote_stat',
+                               return_value=self.stat) as stat:
+            result = action.run(task_vars={})
+        return result, stat, copy_action
+
+    def test_unchanged(self):
+        result, stat, copy_action = self._run(mode='0660', group='kolla')
+
+        self.assertFalse(result['changed'])
+        self.assertEqual(self.stat['checksum'], result['checksum'])
+        stat.assert_called_once_with('/etc/nova/nova.conf', all_vars={},
+                                     follow=False)
+        copy_action.run.assert_not_called()
+
+    def test_content_changed(self):
+        self.stat['checksum'] = checksum_s('[DEFAULT]\n')
+
+        result, _, copy_action = self._run(mode='0660')
+
+        self.assertTrue(result['changed'])
+        copy_action.run.assert_called_once_with(task_vars={})
+
+    def test_missing(self):
+        self.stat = {'exists': False, 'checksum': '1'}
+
+        result, _, copy_action = self._run()
+
+        self.assertTrue(result['changed'])
+        copy_action.run.assert_called_once_with(task_vars={})
+
+    def test_attributes_changed(self):
+        for args in [dict(mode='0600'), dict(mode='u=rw,g=rw'),
+                     dict(owner='nova'), dict(group='nova')]:
+            _, _, copy_action = self._run(**args)
+            copy_action.run.assert_called_once_with(task_vars={})
+
+    def test_diff(self):
+        self.stat['checksum'] = checksum_s('[DEFAULT]\n')
+
+        result, _, copy_action = self._run(diff=True)
+
+        self.assertEqual(
+            {'added': [], 'removed': [],
+             'changed': [{'key': '[DEFAULT] debug', 'before': ['False'],
+                          'after': ['True']}]},
+            result['config_diff'])
+        self.assertEqual({'prepared': '~ [DEFAULT] debug: False -> True\n'},
+                         result['diff'])
+        # The copy action does not diff the whole file.
+        copy_task = self.action_loader.get.call_args[1]['task']
+        self.assertFalse(copy_task.diff)
+
+    def test_diff_missing(self):
+        self.stat = {'exists': False, 'checksum': '1'}
+
+        result, _, _ = self._run(diff=True)
+
+        self.assertEqual([{'key': '[DEFAULT] debug', 'after': ['True']}],
+                         result['config_diff']['added'])
+
+    def test_diff_unchanged(self):
+        result, _, _ = self._run(diff=True, mode='0660')
+
+        self.assertFalse(result['changed'])
+        self.assertEqual({'added': [], 'removed': [], 'changed': []},
+                         result['config_diff'])
+
+    def test_other_args_copy(self):
+        _, stat, copy_action = self._run(backup=True)
+
+        stat.assert_not_called()
+        copy_action.run.assert_called_once_with(task_vars={})
+
+    def test_static_source_cached(self):
+        override = os.path.join(os.path.dirname(self.source), 'override.conf')
+        with open(override, 'w') as f:
+            f.write('[DEFAULT]\nverbose = True\n')
+        cache = merge_configs.parse_cache.ParseCache(
+            self.useFixture(fixtures.TempDir()).path)
+        self.useFixture(fixtures.MockPatchObject(
+            merge_configs, '_PARSE_CACHE', cache))
+        action = merge_configs.ActionModule(
+            mock.MagicMock(), mock.MagicMock(), mock.MagicMock(),
+            DataLoader(), Templar(loader=DataLoader()), mock.MagicMock())
+        expected = '[DEFAULT]\ndebug = True\nverbose = True\n\n'
+
+        with mock.patch.object(merge_configs, '_parse_sections',
+                               wraps=merge_configs._parse_sections) as parse:
+            for _ in range(3):
+                self.assertEqual(expected,
+                                 action.render([self.source, override]))
+        # The source with Jinja is rendered every time, not the override.
+        parse.assert_called_once_with('[DEFAULT]\nverbose = True\n')
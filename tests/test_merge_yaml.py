@@ -15,8 +15,13 @@
 
 from importlib.machinery import SourceFileLoader
 import os
+from unittest import mock
 
 from ansible.errors import AnsibleModuleError
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+from ansible.utils.hashing import checksum_s
+import fixtures
 from oslotest import base
 
 PROJECT_DIR = os.path.abspath(os.path.join(os. path.dirname(__file__), '../'))
@@ -174,3 +179,72 @@ class MergeYamlConfigTest(base.BaseTestCase):
         with self.assertRaisesRegex(AnsibleModuleError, "Failure merging key"):
             merge_yaml.Utils.update_nested_conf(
                 initial_conf, extension, extend_lists=True)
+
+
+class MergeYamlActionTest(base.BaseTestCase):
+
+    def setUp(self):
+        super(MergeYamlActionTest, self).setUp()
+        tmp = self.useFixture(fixtures.TempDir()).path
+        self.source = os.path.join(tmp, 'policy.yaml')
+        with open(self.source, 'w') as f:
+            f.write('rule: "{{ 1 + 1 }}"\n')
+        self.stat = {'exists': True, 'isreg': True,
+                     'checksum': checksum_s("rule: '2'\n"),
+                     'mode': '0660', 'pw_name': 'root', 'uid': 0,
+                     'gr_name': 'root', 'gid': 0}
+
+    def _run(self):
+        task = mock.MagicMock(async_val=0)
+        task.args = dict(sources=[self.source], dest='/etc/nova/policy.yaml',
+                         mode='0660')
+        loader = DataLoader()
+        shared_loader_obj = mock.MagicMock()
+        copy_action = shared_loader_obj.action_loader.get.return_value
+        copy_action.run.return_value = {'changed': True,
+                                        'invocation': {'module_args': {}}}
+        action = merge_yaml.ActionModule(
+            task, mock.MagicMock(), mock.MagicMock(), loader,
+            Templar(loader=loader), shared_loader_obj)
+        # NOTE: ansible-core 2.19 ignores the shared_loader_obj argument.
+        action._shared_loader_obj = shared_loader_obj
+        action._remove_tmp_path = mock.Mock()
+        with mock.patch.object(action, '_execute_remote_stat',
+                               return_value=self.stat):
+            result = action.run(task_vars={})
+        return result, copy_action
+
+    def test_unchanged(self):
+        result, copy_action = self._run()
+
+        self.assertFalse(result['changed'])
+        copy_action.run.assert_not_called()
+
+    def test_changed(self):
+        self.stat['checksum'] = checksum_s("rule: '1'\n")
+
+        result, copy_action = self._run()
+
+        self.assertTrue(result['changed'])
+        copy_action.run.assert_called_once_with(task_vars={})
+
+    def test_static_source_cached(self):
+        override = os.path.join(os.path.dirname(self.source), 'override.yaml')
+        with open(override, 'w') as f:
+            f.write('other: {a: 1}\n')
+        cache = merge_yaml.parse_cache.ParseCache(
+            self.useFixture(fixtures.TempDir()).path)
+        self.useFixture(fixtures.MockPatchObject(
+            merge_yaml, '_PARSE_CACHE', cache))
+        action = merge_yaml.ActionModule(
+            mock.MagicMock(), mock.MagicMock(), mock.MagicMock(),
+            DataLoader(), Templar(loader=DataLoader()), mock.MagicMock())
+
+        with mock.patch.object(merge_yaml.yaml, 'safe_load',
+                               wraps=merge_yaml.yaml.safe_load) as load:
+            for _ in range(3):
+                self.assertEqual(
+                    "other:\n  a: 1\nrule: '2'\n",
+                    action.render([override, self.source]))
+        # Once for the override, every time for the source with Jinja.
+        self.assertEqual(4, load.call_count)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark merge_configs with and without the cache of parsed sources
+
+Renders a config made of a template and three static overrides for each
+host of a synthetic inventory, each host in a forked worker process like
+Ansible does, and prints the time taken per host.
+"""
+
+import argparse
+from importlib.machinery import SourceFileLoader
+import os
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+from ansible.parsing.dataloader import DataLoader
+from ansible.template import Templar
+
+from kolla_ansible import parse_cache
+
+PROJECT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+merge_configs = SourceFileLoader(
+    'merge_configs',
+    os.path.join(PROJECT_DIR, 'ansible', 'action_plugins', 'merge_configs.py')
+).load_module()
+
+
+class NoCache(parse_cache.ParseCache):
+    """Render and parse every source for every host, as before the cache"""
+
+    def read(self, path, parse):
+        with open(path, 'r') as f:
+            return None, f.read()
+
+
+def write_sources(directory, sections, keys):
+    template = os.path.join(directory, 'nova.conf.j2')
+    with open(template, 'w') as f:
+        for section in range(sections):
+            f.write('[section{}]\n'.format(section))
+            for key in range(keys):
+                f.write('key{} = {{{{ inventory_hostname }}}}-{}\n'.format(
+                    key, key))
+    sources = [template]
+    for name in ('global', 'service', 'host'):
+        override = os.path.join(directory, name + '.conf')
+        with open(override, 'w') as f:
+            for section in range(sections):
+                f.write('[section{}]\n'.format(section))
+                for key in range(keys):
+                    f.write('key{} = {}-{}\n'.format(key, name, key))
+        sources.append(override)
+    return sources
+
+
+def render_host(cache, sources, host):
+    merge_configs._PARSE_CACHE = cache
+    loader = DataLoader()
+    templar = Templar(loader=loader,
+                      variables={'inventory_hostname': host})
+    action = merge_configs.ActionModule(
+        mock.MagicMock(), mock.MagicMock(), mock.MagicMock(), loader,
+        templar, mock.MagicMock())
+    action.render(sources)
+
+
+def run(cache, sources, hosts):
+    """Return the time to render each host, in seconds"""
+    times = []
+    for host in range(hosts):
+        start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            render_host(cache, sources, 'host{}'.format(host))
+            os._exit(0)
+        os.waitpid(pid, 0)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hosts', type=int, default=500)
+    parser.add_argument('--sections', type=int, default=20)
+    parser.add_argument('--keys', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sources = write_sources(directory, args.sections, args.keys)
+        cache_dir = os.path.join(directory, 'cache')
+        for name, cache in (('uncached', NoCache(cache_dir)),
+                            ('cached', parse_cache.ParseCache(cache_dir))):
+            times = run(cache, sources, args.hosts)
+            print('{:<9} hosts={} total={:.2f}s per-host mean={:.2f}ms '
+                  'median={:.2f}ms'.format(
+                      name, args.hosts, sum(times),
+                      statistics.mean(times) * 1000,
+                      statistics.median(times) * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())